@@ -13,13 +13,19 @@
 #  * See the License for the specific language governing permissions and
 #  * limitations under the License.
 
+import json
+import time
 import uuid
+import hashlib
+import contextlib
+from collections import OrderedDict
 
 # Third-party Imports
 from boto import exception
 
 # Cloudify imports
 from ec2 import utils as ec2_utils
+from ec2 import records
 from ec2 import constants
 from vpc import constants as vpc_constants
 from vpc import connection
@@ -34,6 +40,7 @@ class AwsBase(object):
                  ):
         self.client = \
             client if client else connection.VPCConnectionClient().client()
+        self._resource_index = dict()
 
     def execute(self, fn, args=None, raise_on_falsy=False):
 
@@ -49,73 +56,173 @@ class AwsBase(object):
 
         return output
 
-    def get_and_filter_resources_by_matcher(
+    def iterate_resources_by_matcher(
             self, filter_function, filters,
             not_found_token='NotFound'):
+        """Yields the resources returned by filter_function one page
+        at a time, so that a caller looking for one resource
+        does not pay for the whole listing.
+        """
 
         try:
-            list_of_matching_resources = filter_function(**filters)
+            for resource in ec2_utils.describe_resources(
+                    filter_function, **filters):
+                yield resource
         except exception.EC2ResponseError as e:
             if not_found_token in str(e):
-                return []
+                return
             raise NonRecoverableError('{0}'.format(str(e)))
         except exception.BotoServerError as e:
             raise NonRecoverableError('{0}'.format(str(e)))
 
-        return list_of_matching_resources
+    def get_and_filter_resources_by_matcher(
+            self, filter_function, filters,
+            not_found_token='NotFound'):
+
+        return list(self.iterate_resources_by_matcher(
+            filter_function, filters, not_found_token))
+
+    def index_resources(self, filter_function, filters,
+                        not_found_token='NotFound'):
+        """Returns the resources returned by filter_function, by ID.
+        The index is kept for the lifetime of this object, so repeated
+        lookups with the same function and filters describe once.
+
+        :param filter_function: A boto get_all_* function.
+        :param filters: A dict of keyword arguments to filter_function.
+        :param not_found_token: The error code meaning no match.
+        :returns a dict of resource ID to resource.
+        """
+
+        key = (filter_function, self._freeze_filters(filters))
+
+        if key not in self._resource_index:
+            self._resource_index[key] = dict(
+                (resource.id, resource)
+                for resource in self.iterate_resources_by_matcher(
+                    filter_function, filters, not_found_token))
+
+        return self._resource_index[key]
+
+    def _freeze_filters(self, value):
+
+        if isinstance(value, dict):
+            return tuple(sorted(
+                (key, self._freeze_filters(item))
+                for key, item in value.items()))
+        elif isinstance(value, (list, tuple, set)):
+            return tuple(self._freeze_filters(item) for item in value)
+
+        return value
 
     def filter_for_single_resource(self, filter_function,
                                    filters,
                                    not_found_token='NotFound'):
+        """Returns the resource with the ID given by the one *_ids
+        argument of filters. The other arguments, such as filters,
+        narrow the describe.
 
-        resources = self.get_and_filter_resources_by_matcher(
-            filter_function, filters, not_found_token)
-
-        if resources:
-            for resource in resources:
-                if resource.id == filters.values()[0]:
-                    return resource
+        :returns the boto resource or None if there is no match.
+        """
 
-        return None
+        resource_ids = [value for argument, value in filters.items()
+                        if argument.endswith('_ids')]
 
-    def get_related_targets_and_types(self, relationships):
+        if not len(resource_ids) == 1:
+            raise NonRecoverableError(
+                'Expected one resource ID argument in {0}.'.format(filters))
+
+        resource_id = resource_ids[0]
+
+        if isinstance(resource_id, (list, tuple)) and len(resource_id) == 1:
+            resource_id = resource_id[0]
+
+        return self.index_resources(
+            filter_function, filters, not_found_token).get(resource_id)
+
+    def resolve_external_resource(self, node, instance, resource_id,
+                                  get_resource):
+        """Returns a record of an external resource. The first call
+        describes the resource and memoizes the record, with its etag,
+        in the runtime properties of the node instance. Later calls for
+        the same resource ID and region return the memoized record
+        without calling AWS, until it is older than
+        constants.EXTERNAL_RESOURCE_STATE_TTL. The resource is then
+        described again, and a changed etag replaces the record.
+
+        :param node: The node of the resource, such as ctx.node
+            or ctx.source.node.
+        :param instance: The node instance of the resource.
+        :param resource_id: The ID of the external resource.
+        :param get_resource: A function returning the boto resource,
+            or None if it does not exist.
+        :returns a VpcResourceRecord, or None if the resource
+            does not exist.
         """
 
-        :param relationships: should be ctx.instance.relationships
-        or ctx.source/target.instance.relationships
-        :return: targets_and_types a dict of structure
-        relationship-type: relationship_target_id
-        """
+        key = self._external_resource_key(node, resource_id)
+        state = instance.runtime_properties.get(
+            constants.EXTERNAL_RESOURCE_STATE)
 
-        targets_by_relationship_type = dict()
+        if state and state['key'] != key:
+            state = None
 
-        if len(relationships) > 0:
+        if state and time.time() - state.get('described_at', 0) < \
+                constants.EXTERNAL_RESOURCE_STATE_TTL:
+            return records.VpcResourceRecord.from_dict(state['resource'])
 
-            for relationship in relationships:
-                targets_by_relationship_type.update(
-                    {
-                        relationship.type:
-                            relationship.target.instance
-                            .runtime_properties.get(
-                                constants.EXTERNAL_RESOURCE_ID)
-                    }
-                )
+        resource = get_resource()
 
-        return targets_by_relationship_type
+        if resource is None:
+            if state:
+                ec2_utils.unassign_runtime_property_from_resource(
+                    constants.EXTERNAL_RESOURCE_STATE, instance)
+            return None
 
-    def get_target_ids_of_relationship_type(
-            self, relationship_type,
-            targets_by_relationship_type):
+        record = records.VpcResourceRecord.from_resource(resource)
 
-        target_ids = []
+        if state and state['etag'] == record.etag:
+            state['described_at'] = time.time()
+        else:
+            if state:
+                ctx.logger.info(
+                    'External resource {0} changed since it was last '
+                    'described.'.format(resource_id))
+            state = dict(key=key, etag=record.etag,
+                         resource=record.to_dict(),
+                         described_at=time.time())
+
+        instance.runtime_properties[constants.EXTERNAL_RESOURCE_STATE] = \
+            state
+
+        return record
 
-        for current_relationship_type, current_target_id in \
-                targets_by_relationship_type.items():
+    def _external_resource_key(self, node, resource_id):
 
-            if relationship_type in current_relationship_type:
-                target_ids.append(current_target_id)
+        aws_config = node.properties.get(constants.AWS_CONFIG_PROPERTY) or {}
 
-        return target_ids
+        return hashlib.sha1(json.dumps([
+            resource_id,
+            aws_config.get('ec2_region_name'),
+            aws_config.get('ec2_region_endpoint')
+        ])).hexdigest()
+
+    def get_related_targets_and_types(self, ctx_instance):
+        """
+
+        :param ctx_instance: should be ctx.instance
+        or ctx.source/target.instance
+        :return: the relationship index of the instance, which keeps
+        every target of each relationship type
+        """
+
+        return ec2_utils.get_relationship_index(ctx_instance)
+
+    def get_target_ids_of_relationship_type(
+            self, relationship_type,
+            targets_by_relationship_type):
+
+        return targets_by_relationship_type.get_target_ids(relationship_type)
 
     def raise_forbidden_external_resource(self, resource_id):
         raise NonRecoverableError(
@@ -167,7 +274,7 @@ class AwsBaseRelationship(AwsBase):
         if not self.source_is_external_resource:
             return False
 
-        resource = self.get_source_resource()
+        resource = self.get_external_source_resource()
 
         if resource is None:
             self.raise_forbidden_external_resource(
@@ -203,7 +310,11 @@ class AwsBaseRelationship(AwsBase):
         if not self.source_is_external_resource:
             return False
 
-        resource = self.get_source_resource()
+        resource = self.get_external_source_resource()
+
+        if resource is None:
+            self.raise_forbidden_external_resource(
+                self.source_resource_id)
 
         ctx.logger.info(
             'Assuming {0} is external, because the user '
@@ -227,6 +338,12 @@ class AwsBaseRelationship(AwsBase):
 
         return resource
 
+    def get_external_source_resource(self):
+
+        return self.resolve_external_resource(
+            ctx.source.node, ctx.source.instance,
+            self.source_resource_id, self.get_source_resource)
+
 
 class AwsBaseNode(AwsBase):
 
@@ -258,7 +375,10 @@ class AwsBaseNode(AwsBase):
         """ This validates all VPC Nodes before bootstrap.
         """
 
-        resource = self.get_resource()
+        if self.is_external_resource:
+            resource = self.get_external_resource()
+        else:
+            resource = self.get_resource(snapshot=True)
 
         for property_key in self.required_properties:
             ec2_utils.validate_node_property(
@@ -286,7 +406,8 @@ class AwsBaseNode(AwsBase):
             .format(self.aws_resource_type,
                     self.cloudify_node_instance_id))
 
-        if self.use_external_resource_naively() or self.create():
+        if self.use_external_resource_naively() \
+                or self.use_built_resource() or self.create():
             return self.post_create()
 
         raise NonRecoverableError(
@@ -298,7 +419,7 @@ class AwsBaseNode(AwsBase):
         if not self.is_external_resource:
             return False
 
-        if not self.get_resource():
+        if not self.get_external_resource():
             self.raise_forbidden_external_resource(self.resource_id)
 
         ctx.logger.info(
@@ -308,6 +429,20 @@ class AwsBaseNode(AwsBase):
 
         return True
 
+    def use_built_resource(self):
+        """Adopts a resource created by the build_topology workflow.
+        """
+
+        if not ctx.instance.runtime_properties.get(
+                vpc_constants.TOPOLOGY_BUILT):
+            return False
+
+        ctx.logger.info(
+            '{0} {1} was created by the topology builder. Not creating it.'
+            .format(self.aws_resource_type, self.resource_id))
+
+        return True
+
     def start(self):
         return False
 
@@ -326,7 +461,12 @@ class AwsBaseNode(AwsBase):
             .format(self.aws_resource_type,
                     self.cloudify_node_instance_id))
 
-        if not self.get_resource():
+        if self.is_external_resource:
+            resource = self.get_external_resource()
+        else:
+            resource = self.get_resource(snapshot=True)
+
+        if not resource:
             self.raise_forbidden_external_resource(self.resource_id)
 
         if self.delete_external_resource_naively() or self.delete():
@@ -359,7 +499,7 @@ class AwsBaseNode(AwsBase):
 
         return matches
 
-    def get_resource(self):
+    def get_resource(self, snapshot=False):
 
         resource = self.filter_for_single_resource(
             self.get_all_handler['function'],
@@ -367,23 +507,28 @@ class AwsBaseNode(AwsBase):
             not_found_token=self.not_found_error
         )
 
+        if snapshot and resource:
+            return records.VpcResourceRecord.from_resource(resource)
+
         return resource
 
-    def tag_resource(self, resource):
+    def get_external_resource(self):
 
-        name = ctx.node.properties.get('name')
-        if name:
-            self._tag_resource(resource, 'Name', name)
-        else:
-            self._tag_resource(resource, 'Name', uuid.uuid4())
+        return self.resolve_external_resource(
+            ctx.node, ctx.instance, self.resource_id, self.get_resource)
 
-        self._tag_resource(resource, 'resource_id', ctx.instance.id)
-        self._tag_resource(resource, 'deployment_id', ctx.deployment.id)
+    def tag_resource(self, resource_id):
 
-    def _tag_resource(self, resource, tag_key, tag_value):
+        tags = {
+            'Name': ctx.node.properties.get('name') or str(uuid.uuid4()),
+            'resource_id': ctx.instance.id,
+            'deployment_id': ctx.deployment.id
+        }
+        if not self.is_external_resource:
+            tags.update(ec2_utils.get_owner_tags())
 
         try:
-            output = resource.add_tag(tag_key, tag_value)
+            output = self.client.create_tags([resource_id], tags)
         except (exception.EC2ResponseError,
                 exception.BotoServerError) as e:
             raise NonRecoverableError(
@@ -403,8 +548,21 @@ class AwsBaseNode(AwsBase):
 
     def post_start(self):
 
-        resource = self.get_resource()
-        self.tag_resource(resource)
+        state = ctx.instance.runtime_properties.get(
+            constants.EXTERNAL_RESOURCE_STATE)
+
+        if self.is_external_resource and state and state.get('tagged'):
+            return True
+
+        if ctx.instance.runtime_properties.get(vpc_constants.TOPOLOGY_BUILT):
+            return True
+
+        self.tag_resource(self.resource_id)
+
+        if self.is_external_resource and state:
+            state['tagged'] = True
+            ctx.instance.runtime_properties[
+                constants.EXTERNAL_RESOURCE_STATE] = state
 
         return True
 
@@ -412,6 +570,10 @@ class AwsBaseNode(AwsBase):
 
         ec2_utils.unassign_runtime_property_from_resource(
             constants.EXTERNAL_RESOURCE_ID, ctx.instance)
+        ec2_utils.unassign_runtime_property_from_resource(
+            constants.EXTERNAL_RESOURCE_STATE, ctx.instance)
+        ec2_utils.unassign_runtime_property_from_resource(
+            vpc_constants.TOPOLOGY_BUILT, ctx.instance)
 
         ctx.logger.info(
             'Removed {0} {1} from Cloudify.'
@@ -420,6 +582,68 @@ class AwsBaseNode(AwsBase):
         return True
 
 
+def get_route_key(route):
+    """Returns the canonical key of a route, its destination and the ID
+    of its target, so the same route is one key whatever other fields
+    its dict carries.
+
+    :param route: A route dict, or a boto Route.
+    :returns a (destination_cidr_block, target) tuple.
+    """
+
+    fields = route if isinstance(route, dict) else vars(route)
+
+    return (fields.get('destination_cidr_block'),
+            next((fields[target] for target in vpc_constants.ROUTE_TARGETS
+                  if fields.get(target)), None))
+
+
+class RouteStore(ec2_utils.StagedList):
+    """The routes of a route table, indexed by get_route_key."""
+
+    def __init__(self, routes=None):
+        super(RouteStore, self).__init__(routes, get_route_key)
+        self.batches = 0
+
+    def diff(self, live_routes):
+        """Compares the routes with the live routes of the route table.
+        Destinations are unique in a route table, so routes are matched
+        by destination. The local and propagated routes are left out.
+
+        :param live_routes: The boto Routes of the route table.
+        :returns a tuple of the routes to create, the routes to replace
+            and the live routes to delete, as route dicts.
+        """
+
+        desired = OrderedDict(
+            (key[0], route) for key, route in self._items.items())
+        live = dict()
+        fixed = set()
+
+        for live_route in live_routes:
+            fields = dict(
+                (field, getattr(live_route, field, None))
+                for field in ['destination_cidr_block'] +
+                vpc_constants.ROUTE_TARGETS)
+            if fields['gateway_id'] == vpc_constants.ROUTE_LOCAL_GATEWAY or \
+                    getattr(live_route, 'origin', None) == \
+                    vpc_constants.ROUTE_PROPAGATED_ORIGIN:
+                fixed.add(fields['destination_cidr_block'])
+            else:
+                live[fields['destination_cidr_block']] = fields
+
+        to_create = [route for destination, route in desired.items()
+                     if destination not in live and destination not in fixed]
+        to_replace = [route for destination, route in desired.items()
+                      if destination in live and
+                      get_route_key(live[destination]) !=
+                      get_route_key(route)]
+        to_delete = [route for destination, route in live.items()
+                     if destination not in desired]
+
+        return to_create, to_replace, to_delete
+
+
 class RouteMixin(object):
 
     def create_route(self, route_table_id,
@@ -429,22 +653,7 @@ class RouteMixin(object):
             route_table_id=route_table_id,
             destination_cidr_block=route['destination_cidr_block'],
         )
-
-        if 'gateway_id' in route:
-            route_to_create['gateway_id'] = route['gateway_id']
-        elif 'instance_id' in route:
-            route_to_create['instance_id'] = route['instance_id']
-        elif 'interface_id' in route:
-            route_to_create['interface_id'] = \
-                route['interface_id']
-        elif 'vpc_peering_connection_id' in route:
-            route_to_create['vpc_peering_connection_id'] = \
-                route['vpc_peering_connection_id']
-        else:
-            raise NonRecoverableError(
-                'Unable to create provided route. '
-                'Missing valid values: {0}'.format(route)
-            )
+        route_to_create.update(self.get_route_target(route))
 
         try:
             output = self.client.create_route(**route_to_create)
@@ -469,12 +678,176 @@ class RouteMixin(object):
                                                  route_to_create)
         return True
 
+    def get_route_target(self, route):
+        """Returns the target field of a route, as route arguments.
+
+        :raises NonRecoverableError: If the route has no target.
+        """
+
+        for target in vpc_constants.ROUTE_TARGETS:
+            if route.get(target):
+                return {target: route[target]}
+
+        raise NonRecoverableError(
+            'Unable to create provided route. '
+            'Missing valid values: {0}'.format(route)
+        )
+
+    def reconcile_routes(self, route_table_id, routes,
+                         route_table_ctx_instance,
+                         live_routes=None, delete_unmanaged=False,
+                         kept_peering_connection_ids=None):
+        """Makes the routes of a route table match the given routes.
+        The live routes are read once, and only the routes that are
+        missing, point at another target or, with delete_unmanaged, are
+        not wanted, are created, replaced or deleted, concurrently.
+
+        :param route_table_id: The ID of the route table.
+        :param routes: The wanted route dicts.
+        :param route_table_ctx_instance: The route table ctx instance,
+            whose routes runtime property records the wanted routes,
+            including those whose change failed.
+        :param live_routes: The boto Routes of the route table, if they
+            were just read, such as when the route table was created.
+        :param delete_unmanaged: Whether to delete the live routes that
+            are not wanted.
+        :param kept_peering_connection_ids: The VPC peering connections
+            whose live routes are never deleted, such as the return
+            routes added to the route tables of a peer VPC.
+        :returns the number of changes made.
+        :raises RecoverableError: If a change failed.
+        """
+
+        route_store = RouteStore(routes)
+
+        if live_routes is None:
+            route_table = self.filter_for_single_resource(
+                self.client.get_all_route_tables,
+                {'route_table_ids': route_table_id},
+                vpc_constants.ROUTE_TABLE['NOT_FOUND_ERROR'])
+            if not route_table:
+                raise NonRecoverableError(
+                    'Route table {0} does not exist.'.format(route_table_id))
+            live_routes = route_table.routes
+
+        to_create, to_replace, to_delete = route_store.diff(live_routes)
+        kept_peering_connection_ids = set(kept_peering_connection_ids or [])
+        to_delete = [route for route in to_delete
+                     if route.get('vpc_peering_connection_id') not in
+                     kept_peering_connection_ids]
+        changes = \
+            [('create', route) for route in to_create] + \
+            [('replace', route) for route in to_replace] + \
+            ([('delete', route) for route in to_delete]
+             if delete_unmanaged else [])
+
+        ctx.logger.info(
+            'Route table {0}: {1} routes to create, {2} to replace '
+            'and {3} to delete.'.format(
+                route_table_id, len(to_create), len(to_replace),
+                len(to_delete) if delete_unmanaged else 0))
+
+        # the wanted routes are recorded even if a change fails, so that
+        # a retry diffs the route table against them again
+        route_table_ctx_instance.runtime_properties['routes'] = \
+            route_store.to_list()
+
+        errors = ec2_utils.run_concurrently(
+            lambda change: self._apply_route_change(route_table_id, change),
+            changes)
+
+        for error in errors:
+            if error:
+                raise RecoverableError('{0}'.format(str(error)))
+
+        return len(changes)
+
+    def _apply_route_change(self, route_table_id, change):
+        """Creates, replaces or deletes one route, with a client of its
+        own, since it runs in a thread of reconcile_routes.
+
+        :returns None, or the EC2ResponseError of the change.
+        """
+
+        action, route = change
+        client = connection.VPCConnectionClient().client()
+        destination_cidr_block = route['destination_cidr_block']
+
+        try:
+            if action == 'delete':
+                client.delete_route(route_table_id, destination_cidr_block)
+            elif action == 'replace':
+                client.replace_route(route_table_id, destination_cidr_block,
+                                     **self.get_route_target(route))
+            else:
+                client.create_route(route_table_id, destination_cidr_block,
+                                    **self.get_route_target(route))
+        except exception.EC2ResponseError as e:
+            if action == 'delete' and \
+                    vpc_constants.ROUTE_NOT_FOUND_ERROR in str(e) or \
+                    action == 'create' and \
+                    '<Code>RouteAlreadyExists</Code>' in str(e):
+                return None
+            return e
+
+        return None
+
+    def get_route_store(self, route_table_ctx_instance):
+        """Returns the routes runtime property of a route table as a
+        RouteStore, built once and kept by this object, keyed by route
+        table ID, for as long as the routes property is only changed
+        through it.
+        """
+
+        routes = route_table_ctx_instance.runtime_properties.get('routes')
+        route_table_id = route_table_ctx_instance.runtime_properties.get(
+            constants.EXTERNAL_RESOURCE_ID)
+        route_stores = self._get_route_stores()
+        cached = route_stores.get(route_table_id)
+
+        if cached is None or cached[0] is not routes:
+            cached = (routes, RouteStore(routes))
+            route_stores[route_table_id] = cached
+
+        return cached[1]
+
+    def save_routes(self, route_table_ctx_instance):
+
+        route_store = self.get_route_store(route_table_ctx_instance)
+        routes = route_store.to_list()
+        route_table_ctx_instance.runtime_properties['routes'] = routes
+        self._get_route_stores()[
+            route_table_ctx_instance.runtime_properties.get(
+                constants.EXTERNAL_RESOURCE_ID)] = (routes, route_store)
+
+    def _get_route_stores(self):
+
+        if not hasattr(self, '_route_stores'):
+            self._route_stores = dict()
+
+        return self._route_stores
+
+    @contextlib.contextmanager
+    def route_batch(self, route_table_ctx_instance):
+        """Keeps the route changes made in the with block in the route
+        store, and writes the routes runtime property once on exit.
+        """
+
+        route_store = self.get_route_store(route_table_ctx_instance)
+        route_store.batches += 1
+        try:
+            yield route_store
+        finally:
+            route_store.batches -= 1
+            if not route_store.batches:
+                self.save_routes(route_table_ctx_instance)
+
     def add_route_to_runtime_properties(self,
                                         route_table_ctx_instance, route):
-        if 'routes' not in \
-                route_table_ctx_instance.runtime_properties.keys():
-            route_table_ctx_instance.runtime_properties['routes'] = []
-        route_table_ctx_instance.runtime_properties['routes'].append(route)
+        route_store = self.get_route_store(route_table_ctx_instance)
+        route_store.add(route)
+        if not route_store.batches:
+            self.save_routes(route_table_ctx_instance)
 
     def delete_route(self, route_table_id,
                      route, route_table_ctx_instance=None):
@@ -503,5 +876,6 @@ class RouteMixin(object):
 
     def remove_route_from_runtime_properties(
             self, route_table_ctx_instance, route):
-        if route in route_table_ctx_instance.runtime_properties['routes']:
-            route_table_ctx_instance.runtime_properties['routes'].remove(route)
+        route_store = self.get_route_store(route_table_ctx_instance)
+        if route_store.discard(route) and not route_store.batches:
+            self.save_routes(route_table_ctx_instance)
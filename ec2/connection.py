@@ -15,14 +15,10 @@
 
 # Builtin Imports
 import os
-import ConfigParser
 
 # Third-party Imports
 from boto.ec2 import get_region
 from boto.ec2 import EC2Connection
-from boto.ec2.elb import ELBConnection
-from boto.regioninfo import RegionInfo
-from boto.ec2.elb import connect_to_region as connect_to_elb_region
 
 # Cloudify Imports
 from ec2 import utils
@@ -37,12 +33,29 @@ class EC2ConnectionClient():
     def __init__(self):
         self.connection = None
 
-    def client(self):
+    def client(self, aws_config=None):
         """Represents the EC2Connection Client
         """
 
-        aws_config_property = (self._get_aws_config_property() or
-                               self._get_aws_config_from_file())
+        return self._connect(self._get_aws_config_property(aws_config) or
+                             self._get_aws_config_from_file())
+
+    def config_client(self, aws_config=None):
+        """Represents the client of an AWS config, or of the Boto config
+        file if it is empty, without reading any node properties. This is
+        the client of code that runs outside of an operation, such as a
+        workflow.
+
+        :param aws_config: An aws_config node property, or None.
+        """
+
+        return self._connect(aws_config or self._get_aws_config_from_file())
+
+    def _connect(self, aws_config_property):
+        """Returns the client of an AWS config, or the default client
+        if there is none.
+        """
+
         if not aws_config_property:
             return EC2Connection()
         elif aws_config_property.get('ec2_region_name'):
@@ -60,7 +73,9 @@ class EC2ConnectionClient():
 
         return EC2Connection(**aws_config)
 
-    def _get_aws_config_property(self):
+    def _get_aws_config_property(self, aws_config=None):
+        if aws_config:
+            return aws_config
         node_properties = \
             utils.get_instance_or_source_node_properties()
         return node_properties[constants.AWS_CONFIG_PROPERTY]
@@ -79,6 +94,8 @@ class EC2ConnectionClient():
     def _parse_config_file(self, path):
         """Parse and validate Boto cfg file
         """
+        import ConfigParser
+
         path = str(path)
         if not os.path.isfile(path):
             raise NonRecoverableError('no aws config file at {0}'.format(path))
@@ -141,8 +158,16 @@ class ELBConnectionClient(EC2ConnectionClient):
         """Represents the ELBConnection Client
         """
 
-        aws_config_property = (self._get_aws_config_property() or
-                               self._get_aws_config_from_file())
+        return self._connect(self._get_aws_config_property() or
+                             self._get_aws_config_from_file())
+
+    def _connect(self, aws_config_property):
+
+        # imported here, so that only ELB operations load boto.ec2.elb
+        from boto.ec2.elb import ELBConnection
+        from boto.regioninfo import RegionInfo
+        from boto.ec2.elb import connect_to_region as connect_to_elb_region
+
         if not aws_config_property:
             return ELBConnection()
 
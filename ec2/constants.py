@@ -30,6 +30,28 @@ INSTANCE_INTERNAL_ATTRIBUTES = \
 INSTANCE_INTERNAL_ATTRIBUTES_POST_CREATE = \
     ['vpc_id', 'subnet_id', 'placement']
 
+INSTANCE_LAUNCH_ATTRIBUTES = \
+    ['private_ip_address', 'private_dns_name',
+     'vpc_id', 'subnet_id', 'placement']
+# launch attributes whose empty value is final, the others are unknown
+# until set, like the private address of an instance not yet placed
+INSTANCE_LAUNCH_ATTRIBUTES_FINAL_IF_EMPTY = ['vpc_id', 'subnet_id']
+INSTANCE_LAUNCH_CACHE = 'launch_attributes'
+# node launch parameters and user data kept by an agent
+INSTANCE_PARAMETERS_CACHE_SIZE = 128
+
+# AMI metadata cache, kept in the agent work dir
+AMI_CACHE_WORK_DIR_ENV_VAR_NAME = 'CELERY_WORK_DIR'
+AMI_CACHE_FILE_NAME = 'aws_ami_cache.json'
+# seconds a cached AMI state is trusted, the rest of the AMI never changes
+AMI_CACHE_STATE_TTL = 300
+
+# Runtime properties named differently from the instance attribute.
+INSTANCE_PROPERTY_ATTRIBUTES = {
+    'ip': 'private_ip_address',
+    'public_ip_address': 'ip_address'
+}
+
 RUN_INSTANCE_PARAMETERS = {
     'image_id': None, 'key_name': None, 'security_groups': None,
     'user_data': None, 'addressing_type': None,
@@ -49,6 +71,14 @@ INSTANCE_KEYPAIR_RELATIONSHIP = 'instance_connected_to_keypair'
 INSTANCE_SUBNET_RELATIONSHIP = 'instance_contained_in_subnet'
 SECURITY_GROUP_VPC_RELATIONSHIP = 'security_group_contained_in_vpc'
 
+# workflows module constants
+INSTANCE_NODE_TYPE = 'cloudify.aws.nodes.Instance'
+VOLUME_NODE_TYPE = 'cloudify.aws.nodes.Volume'
+VOLUME_INSTANCE_RELATIONSHIP_TYPE = \
+    'cloudify.aws.relationships.volume_connected_to_instance'
+SNAPSHOT_OPERATION = 'cloudify.interfaces.aws.snapshot.create'
+PREFETCH_IMAGES_OPERATION = 'cloudify.interfaces.aws.images.prefetch'
+
 ADMIN_PASSWORD_PROPERTY = 'password'  # the server's password
 
 # securitygroup module constants
@@ -66,24 +96,61 @@ ELB_REQUIRED_PROPERTIES = ['elb_name', 'zones', 'listeners']
 ZONE = 'zone'
 VOLUME_REQUIRED_PROPERTIES = ['size', ZONE, 'device']
 VOLUME_SNAPSHOT_ATTRIBUTE = 'snapshots_ids'
+VOLUME_PENDING_SNAPSHOTS = 'pending_snapshots'
+VOLUME_PENDING_SNAPSHOTS_EXECUTION = 'pending_snapshots_execution_id'
+SNAPSHOT_COMPLETED = 'completed'
+SNAPSHOT_ERROR = 'error'
 VOLUME_AVAILABLE = 'available'
 VOLUME_CREATING = 'creating'
 VOLUME_IN_USE = 'in-use'
+VOLUME_ATTACHING = 'attaching'
+VOLUME_DETACHING = 'detaching'
+INSTANCE_VOLUMES_PROPERTY = 'volumes'
+INSTANCE_VOLUMES_AT_LAUNCH = 'volumes_at_launch'
+INSTANCE_VOLUME_IDS = 'volume_ids'
+# errors meaning an attachment change is already in flight
+VOLUME_BUSY_ERRORS = ['VolumeInUse', 'IncorrectState']
 
 # keypair module constants
 KEYPAIR_REQUIRED_PROPERTIES = ['private_key_path']
 
 # elastic ip module contants
 ALLOCATION_ID = 'allocation_id'
+ASSOCIATION_ID = 'association_id'
+ELASTIC_IP_NOT_FOUND_ERRORS = ['InvalidAddress.NotFound',
+                               'InvalidAssociationID.NotFound']
+ELASTIC_IP_RELEASE_WAIT_ATTEMPTS = 5
+ELASTIC_IP_RELEASE_WAIT_INTERVAL = 1
+ELASTIC_IP_POOL_PROPERTY = 'pool'
+ELASTIC_IP_POOL_PREALLOCATE_PROPERTY = 'pool_preallocate'
+POOL_TAG = 'cloudify_pool'
+POOL_STATE_TAG = 'cloudify_pool_state'
+POOL_STATE_FREE = 'free'
+POOL_STATE_LEASED = 'leased'
+POOL_LEASE_TAG_PREFIX = 'cloudify_lease:'
+# seconds between writing a lease and reading the competing leases back
+POOL_LEASE_SETTLE_TIME = 2
+# leases older than this, in seconds, were left by failed claims
+POOL_LEASE_TTL = 60
+POOL_CLAIM_ATTEMPTS = 3
 
 # config
 AWS_CONFIG_PROPERTY = 'aws_config'
 AWS_DEFAULT_CONFIG_PATH = '~/.boto'
 EXTERNAL_RESOURCE_ID = 'aws_resource_id'
+EXTERNAL_RESOURCE_STATE = 'external_resource'
+# seconds a memoized external resource is trusted before it is described
+EXTERNAL_RESOURCE_STATE_TTL = 300
 NODE_INSTANCE = 'node-instance'
 RELATIONSHIP_INSTANCE = 'relationship-instance'
 AWS_CONFIG_PATH_ENV_VAR_NAME = "AWS_CONFIG_PATH"
 
+# tag of the resources the plugin created, naming the manager, which is
+# known by its IP address to agents and workflows alike
+OWNER_TAG = 'cloudify_manager'
+OWNER_ENV_VAR_NAME = 'MANAGEMENT_IP'
+OWNER_LOCAL = 'local'
+
 # Boto config schema (section > options)
 BOTO_CONFIG_SCHEMA = {
     'Credentials': ['aws_access_key_id', 'aws_secret_access_key'],
@@ -101,3 +168,18 @@ VPC_DOMAIN = 'vpc'
 ELASTIC_IP_DOMAIN_PROPERTY = 'domain'
 
 OBJECTATTR = 'object'
+
+# describe pagination
+DESCRIBE_PAGE_SIZE = 100
+
+# concurrent API requests issued by a single operation
+MAX_CONCURRENT_REQUESTS = 8
+
+# operation retry backoff, in seconds
+RETRY_INITIAL_INTERVAL = 5
+RETRY_MAX_INTERVAL = 60
+
+# in-operation retry of throttled API requests, interval in seconds
+THROTTLING_ERRORS = ['Throttling', 'RequestLimitExceeded']
+THROTTLING_RETRY_ATTEMPTS = 5
+THROTTLING_RETRY_INTERVAL = 1
@@ -18,9 +18,11 @@ import datetime
 
 # Third-party Imports
 import boto.exception
+from boto.ec2.blockdevicemapping import BlockDeviceMapping, BlockDeviceType
 
 # Cloudify imports
 from ec2 import utils
+from ec2 import records
 from ec2 import constants
 from ec2 import connection
 from cloudify import ctx
@@ -36,7 +38,8 @@ def creation_validation(**_):
     for property_key in constants.VOLUME_REQUIRED_PROPERTIES:
         utils.validate_node_property(property_key, ctx.node.properties)
 
-    volume_object = _get_volumes_from_id(utils.get_resource_id())
+    volume_object = _get_volumes_from_id(
+        utils.get_resource_id(), snapshot=True)
 
     if ctx.node.properties['use_external_resource'] and not volume_object:
         raise NonRecoverableError(
@@ -82,6 +85,10 @@ def create(args, **_):
     utils.set_external_resource_id(
         new_volume.id, ctx.instance, external=False)
 
+    error = _tag_volume(ec2_client, new_volume.id)
+    if error:
+        raise error
+
 
 @operation
 def delete(**_):
@@ -99,7 +106,8 @@ def delete(**_):
     if not _delete_volume(volume_id):
         return ctx.operation.retry(
             message='Failed to delete volume {0}.'
-                    .format(volume_id))
+                    .format(volume_id),
+            retry_after=utils.get_retry_interval())
 
     utils.unassign_runtime_property_from_resource(
             constants.ZONE, ctx.instance)
@@ -138,39 +146,40 @@ def attach(**_):
     if _attach_external_volume_or_instance(instance_id):
         return
 
-    volume_object = _get_volumes_from_id(volume_id)
+    volume = _get_volume_or_raise(volume_id)
 
-    if not volume_object:
-        raise NonRecoverableError(
-            'EBS volume {0} not found in account.'.format(volume_id))
+    if _get_volume_state(volume) == constants.VOLUME_AVAILABLE:
+        if not _attach_volume(
+                volume_id, instance_id, ctx.source.node.properties['device']):
+            return ctx.operation.retry(
+                message='Waiting for volume {0} to be attached.'
+                        .format(volume_id),
+                retry_after=utils.get_retry_interval())
+        volume = _get_volume_or_raise(volume_id)
 
-    if constants.VOLUME_CREATING in volume_object.update():
-        return ctx.operation.retry(
-            message='Waiting for volume to be ready. '
-                    'Volume in state {0}'
-                    .format(volume_object.status))
-    elif constants.VOLUME_AVAILABLE not in volume_object.update():
-        raise NonRecoverableError(
-            'Cannot attach Volume {0} because it is in state {1}.'
-            .format(volume_object.id, volume_object.status))
+    volume_state = _get_volume_state(volume)
 
-    ctx.logger.debug(
-        'Attempting to attach volume {0} to instance {1}.'
-        .format(volume_id, instance_id))
+    if volume_state == constants.VOLUME_IN_USE and \
+            volume.instance_id == instance_id:
+        ctx.source.instance.runtime_properties['instance_id'] = \
+            instance_id
+        ctx.logger.info(
+            'Attached EBS volume {0} with instance {1}.'
+            .format(volume_id, instance_id))
+        return
 
-    try:
-        volume_object.attach(
-            instance_id,
-            ctx.source.node.properties['device'])
-    except (boto.exception.EC2ResponseError,
-            boto.exception.BotoServerError) as e:
-        raise NonRecoverableError('{0}'.format(str(e)))
+    if volume_state in [constants.VOLUME_CREATING,
+                        constants.VOLUME_AVAILABLE] or \
+            (volume_state == constants.VOLUME_ATTACHING and
+             volume.instance_id == instance_id):
+        return ctx.operation.retry(
+            message='Waiting for volume {0} to be attached. '
+                    'Volume in state {1}'.format(volume_id, volume_state),
+            retry_after=utils.get_retry_interval())
 
-    ctx.source.instance.runtime_properties['instance_id'] = \
-        instance_id
-    ctx.logger.info(
-        'Attached EBS volume {0} with instance {1}.'
-        .format(volume_id, instance_id))
+    raise NonRecoverableError(
+        'Cannot attach Volume {0} because it is in state {1}.'
+        .format(volume_id, volume_state))
 
 
 @operation
@@ -191,22 +200,21 @@ def detach(args, **_):
 
     ctx.logger.debug('Detaching EBS volume {0}'.format(volume_id))
 
-    volume_object = _get_volumes_from_id(volume_id)
+    volume = _get_volume_or_raise(volume_id)
 
-    if not volume_object:
-        raise NonRecoverableError(
-            'EBS volume {0} not found in account.'.format(volume_id))
+    if _get_volume_state(volume) == constants.VOLUME_IN_USE and \
+            volume.instance_id == instance_id:
+        _detach_volume(volume, args)
+        volume = _get_volume_or_raise(volume_id)
 
-    try:
-        detached = volume_object.detach(**args)
-    except (boto.exception.EC2ResponseError,
-            boto.exception.BotoServerError) as e:
-        raise NonRecoverableError('{0}'.format(str(e)))
+    volume_state = _get_volume_state(volume)
 
-    if not detached:
-        raise NonRecoverableError(
-            'Failed to detach volume {0} from instance {1}'
-            .format(volume_id, instance_id))
+    if volume.instance_id == instance_id and volume_state in \
+            [constants.VOLUME_IN_USE, constants.VOLUME_DETACHING]:
+        return ctx.operation.retry(
+            message='Waiting for volume {0} to be detached. '
+                    'Volume in state {1}'.format(volume_id, volume_state),
+            retry_after=utils.get_retry_interval())
 
     utils.unassign_runtime_property_from_resource(
         'instance_id', ctx.source.instance)
@@ -216,7 +224,7 @@ def detach(args, **_):
 
 
 @operation
-def create_snapshot(args, **_):
+def create_snapshot(args, retention=0, wait_for_completion=False, **_):
     """ Create a snapshot of an EBS Volume
     """
 
@@ -228,30 +236,501 @@ def create_snapshot(args, **_):
         'Trying to create a snapshot of EBS volume {0}.'
         .format(volume_id))
 
-    volume_object = _get_volumes_from_id(volume_id)
+    if not _snapshot_volumes(
+            [volume_id], args, retention, wait_for_completion):
+        return ctx.operation.retry(
+            message='Waiting for the snapshot of EBS volume {0} '
+                    'to complete.'.format(volume_id),
+            retry_after=utils.get_retry_interval())
+
+
+@operation
+def snapshot_instance_volumes(args=None, retention=0,
+                              wait_for_completion=False,
+                              attached_volumes=True, **_):
+    """ Snapshots the volumes of an EC2 Instance together.
+    With attached_volumes, these are all the volumes attached to the
+    instance. Otherwise, only those created through its volumes property.
+    """
+
+    instance_id = \
+        ctx.instance.runtime_properties.get(constants.EXTERNAL_RESOURCE_ID)
+
+    if not instance_id:
+        ctx.logger.info(
+            'Instance {0} is not created. Not creating snapshots.'
+            .format(ctx.instance.id))
+        return
+
+    volume_ids = _get_pending_snapshots().keys()
+
+    if not volume_ids and attached_volumes:
+        volume_ids = [volume.id for volume in utils.describe_resources(
+            connection.EC2ConnectionClient().client().get_all_volumes,
+            filters={'attachment.instance-id': instance_id})]
+    elif not volume_ids:
+        volume_ids = ctx.instance.runtime_properties.get(
+            constants.INSTANCE_VOLUME_IDS, {}).values()
+
+    if not volume_ids:
+        ctx.logger.info(
+            'Instance {0} has no EBS volumes to snapshot.'
+            .format(instance_id))
+        return
+
+    ctx.logger.info(
+        'Trying to create snapshots of EBS volumes {0} of instance {1}.'
+        .format(', '.join(volume_ids), instance_id))
+
+    if not _snapshot_volumes(
+            volume_ids, args or {}, retention, wait_for_completion):
+        return ctx.operation.retry(
+            message='Waiting for the snapshots of instance {0} '
+                    'to complete.'.format(instance_id),
+            retry_after=utils.get_retry_interval())
+
+
+def _snapshot_volumes(volume_ids, args, retention, wait_for_completion):
+    """Creates snapshots of several volumes concurrently, tags them with
+    one CreateTags and, if asked, waits for them with one
+    DescribeSnapshots per poll. Snapshots older than the latest
+    retention ones of each volume are then deleted.
+
+    :param volume_ids: A list of EBS volume IDs.
+    :param args: Additional CreateSnapshot arguments, such as description.
+    :param retention: How many snapshots to keep per volume, 0 for all.
+    :param wait_for_completion: Whether to wait for the new snapshots.
+    :returns False while waiting for the snapshots to complete.
+    """
+
+    pending_snapshots = _get_pending_snapshots()
+
+    if not pending_snapshots:
+        pending_snapshots = _create_snapshots(volume_ids, args)
+        if wait_for_completion:
+            ctx.instance.runtime_properties[
+                constants.VOLUME_PENDING_SNAPSHOTS] = pending_snapshots
+            ctx.instance.runtime_properties[
+                constants.VOLUME_PENDING_SNAPSHOTS_EXECUTION] = \
+                ctx.execution_id
+
+    if wait_for_completion:
+        try:
+            completed = _snapshots_completed(pending_snapshots.values())
+        except NonRecoverableError:
+            _clear_pending_snapshots()
+            raise
+        if completed is None:
+            ctx.logger.info(
+                'Snapshots {0} no longer exist, creating them again.'
+                .format(', '.join(pending_snapshots.values())))
+            _clear_pending_snapshots()
+            return False
+        if not completed:
+            return False
+        _clear_pending_snapshots()
+
+    if retention:
+        _prune_snapshots(pending_snapshots, retention)
+
+    return True
+
+
+def _get_pending_snapshots():
+    """Returns the snapshots that the current execution is waiting for.
+    Those of an earlier execution, which failed or was cancelled while
+    waiting, are ignored, so that new snapshots are created.
+
+    :returns a dict of volume ID to snapshot ID.
+    """
 
-    if not args:
-        snapshot_desc = \
-            unicode(datetime.datetime.now()) + \
-            ctx.instance.runtime_properties[constants.EXTERNAL_RESOURCE_ID]
-        args = dict(description=snapshot_desc)
+    if ctx.instance.runtime_properties.get(
+            constants.VOLUME_PENDING_SNAPSHOTS_EXECUTION) != \
+            ctx.execution_id:
+        return {}
+
+    return ctx.instance.runtime_properties.get(
+        constants.VOLUME_PENDING_SNAPSHOTS) or {}
+
+
+def _clear_pending_snapshots():
+
+    utils.unassign_runtime_properties_from_resource(
+        [constants.VOLUME_PENDING_SNAPSHOTS,
+         constants.VOLUME_PENDING_SNAPSHOTS_EXECUTION], ctx.instance)
+
+
+def _create_snapshots(volume_ids, args):
+    """Creates and tags a snapshot of every volume.
+
+    :returns a dict of volume ID to new snapshot ID.
+    :raises NonRecoverableError: If a snapshot cannot be created, after
+        recording the snapshots that were.
+    """
+
+    created = utils.run_concurrently(
+        lambda volume_id: _create_volume_snapshot(volume_id, args),
+        volume_ids)
+
+    snapshots = dict(
+        (volume_id, snapshot_id)
+        for volume_id, (snapshot_id, _) in zip(volume_ids, created)
+        if snapshot_id)
+
+    if snapshots:
+        ec2_client = connection.EC2ConnectionClient().client()
+        try:
+            ec2_client.create_tags(
+                snapshots.values(),
+                {'deployment_id': ctx.deployment.id,
+                 'resource_id': ctx.instance.id})
+        except (boto.exception.EC2ResponseError,
+                boto.exception.BotoServerError) as e:
+            raise NonRecoverableError(
+                'unable to tag snapshots: {0}'.format(str(e)))
+
+        with utils.RuntimePropertyStage(ctx.instance) as \
+                runtime_properties:
+            snapshot_ids = runtime_properties.list(
+                constants.VOLUME_SNAPSHOT_ATTRIBUTE)
+            for snapshot_id in snapshots.values():
+                snapshot_ids.add(snapshot_id)
+
+    for volume_id, (_, error) in zip(volume_ids, created):
+        if error:
+            raise error
+
+    ctx.logger.info(
+        'Created snapshots {0}.'.format(', '.join(snapshots.values())))
+
+    return snapshots
+
+
+def _create_volume_snapshot(volume_id, args):
+    """Creates a snapshot of one volume.
+
+    :returns a tuple of the ID of the new snapshot, or None,
+        and the NonRecoverableError that prevented its creation, or None.
+    """
+
+    snapshot_args = dict(
+        description=unicode(datetime.datetime.now()) + volume_id)
+    snapshot_args.update(args or {})
+
+    ec2_client = connection.EC2ConnectionClient().client()
 
     try:
-        new_snapshot = volume_object.create_snapshot(**args)
+        new_snapshot = ec2_client.create_snapshot(volume_id, **snapshot_args)
     except (boto.exception.EC2ResponseError,
             boto.exception.BotoServerError) as e:
+        return None, NonRecoverableError('{0}'.format(str(e)))
+
+    return new_snapshot.id, None
+
+
+def _snapshots_completed(snapshot_ids):
+    """Checks several snapshots with one DescribeSnapshots.
+
+    :returns True if all of them completed, and None if one of them
+        no longer exists.
+    :raises NonRecoverableError: If a snapshot failed.
+    """
+
+    ec2_client = connection.EC2ConnectionClient().client()
+
+    try:
+        snapshots = list(utils.describe_resources(
+            ec2_client.get_all_snapshots, snapshot_ids=list(snapshot_ids)))
+    except boto.exception.EC2ResponseError as e:
+        if 'InvalidSnapshot.NotFound' in str(e):
+            return None
         raise NonRecoverableError('{0}'.format(str(e)))
+    except boto.exception.BotoServerError as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+    if set(snapshot_ids) - set(snapshot.id for snapshot in snapshots):
+        return None
+
+    for snapshot in snapshots:
+        if snapshot.status == constants.SNAPSHOT_ERROR:
+            raise NonRecoverableError(
+                'Snapshot {0} of EBS volume {1} failed.'
+                .format(snapshot.id, snapshot.volume_id))
+
+    completed = [snapshot for snapshot in snapshots
+                 if snapshot.status == constants.SNAPSHOT_COMPLETED]
 
     ctx.logger.info(
-        'Created snapshot of EBS volume {0}.'.format(volume_id))
+        '{0} of {1} snapshots completed.'
+        .format(len(completed), len(snapshot_ids)))
+
+    return len(completed) == len(snapshot_ids)
+
+
+def _prune_snapshots(new_snapshots, retention):
+    """Deletes, concurrently, the completed snapshots of this deployment
+    beyond the latest retention ones of each volume. The new snapshots
+    count toward retention even while they are still pending.
+
+    :param new_snapshots: A dict of volume ID to the ID of the snapshot
+        just created of it.
+    :param retention: How many snapshots to keep per volume.
+    """
+
+    ec2_client = connection.EC2ConnectionClient().client()
+
+    try:
+        snapshots = list(utils.describe_resources(
+            ec2_client.get_all_snapshots,
+            owner='self',
+            filters={'volume-id': list(new_snapshots.keys()),
+                     'status': constants.SNAPSHOT_COMPLETED,
+                     'tag:deployment_id': ctx.deployment.id}))
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+    snapshots_by_volume = dict()
+    for snapshot in snapshots:
+        snapshots_by_volume.setdefault(snapshot.volume_id, []).append(snapshot)
+
+    expired_snapshot_ids = []
+    for volume_id, volume_snapshots in snapshots_by_volume.items():
+        volume_snapshots.sort(key=lambda snapshot: snapshot.start_time,
+                              reverse=True)
+        completed_retention = retention
+        if new_snapshots.get(volume_id) not in \
+                [snapshot.id for snapshot in volume_snapshots]:
+            completed_retention = max(retention - 1, 0)
+        expired_snapshot_ids.extend(
+            snapshot.id for snapshot in volume_snapshots[completed_retention:])
+
+    utils.run_concurrently(_delete_snapshot, expired_snapshot_ids)
+
+    if expired_snapshot_ids:
+        with utils.RuntimePropertyStage(ctx.instance) as \
+                runtime_properties:
+            snapshot_ids = runtime_properties.list(
+                constants.VOLUME_SNAPSHOT_ATTRIBUTE)
+            for snapshot_id in expired_snapshot_ids:
+                snapshot_ids.discard(snapshot_id)
+        ctx.logger.info(
+            'Deleted expired snapshots {0}.'
+            .format(', '.join(expired_snapshot_ids)))
+
 
-    if constants.VOLUME_SNAPSHOT_ATTRIBUTE not in \
-            ctx.instance.runtime_properties:
-        ctx.instance.runtime_properties[
-            constants.VOLUME_SNAPSHOT_ATTRIBUTE] = list()
+def _delete_snapshot(snapshot_id):
+
+    ec2_client = connection.EC2ConnectionClient().client()
+
+    try:
+        ec2_client.delete_snapshot(snapshot_id)
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
 
-    ctx.instance.runtime_properties[
-        constants.VOLUME_SNAPSHOT_ATTRIBUTE].append(new_snapshot.id)
+
+def provision_instance_volumes(instance_id, zone, volumes):
+    """Creates and attaches the volumes listed in an instance's
+    volumes property. Missing volumes are created concurrently, all of
+    them are described with a single DescribeVolumes, and the available
+    ones are attached concurrently. Call again until it returns True.
+
+    :param instance_id: The ID of the running EC2 Instance.
+    :param zone: The availability zone of the instance.
+    :param volumes: A list of volume dicts with a device and a size
+        or snapshot_id, and optionally volume_type, iops and encrypted.
+    :returns True once every volume is attached to the instance.
+    :raises NonRecoverableError: If a volume is in use elsewhere or failed.
+    """
+
+    volume_ids = dict(ctx.instance.runtime_properties.get(
+        constants.INSTANCE_VOLUME_IDS, {}))
+
+    for volume in volumes:
+        _validate_instance_volume(volume)
+
+    missing_volumes = [volume for volume in volumes
+                       if volume['device'] not in volume_ids]
+    created = utils.run_concurrently(
+        lambda volume: _create_instance_volume(zone, volume),
+        missing_volumes)
+    for volume, (volume_id, _) in zip(missing_volumes, created):
+        if volume_id:
+            volume_ids[volume['device']] = volume_id
+
+    # runtime properties only notice assignment, not nested updates
+    ctx.instance.runtime_properties[constants.INSTANCE_VOLUME_IDS] = \
+        volume_ids
+
+    # the volumes that were created are recorded before failing,
+    # so that delete_instance_volumes can clean them up.
+    for _, error in created:
+        if error:
+            raise error
+
+    volumes_by_id = _describe_instance_volumes(volume_ids.values())
+
+    available_devices = [
+        device for device, volume_id in volume_ids.items()
+        if volume_id in volumes_by_id and
+        _get_volume_state(volumes_by_id[volume_id]) ==
+        constants.VOLUME_AVAILABLE]
+
+    if available_devices:
+        utils.run_concurrently(
+            lambda device: _attach_volume(
+                volume_ids[device], instance_id, device),
+            available_devices)
+        volumes_by_id = _describe_instance_volumes(volume_ids.values())
+
+    attached = 0
+
+    for volume_id in volume_ids.values():
+        volume = volumes_by_id.get(volume_id)
+        if not volume:
+            continue
+        volume_state = _get_volume_state(volume)
+        if volume.instance_id not in [None, instance_id] or \
+                volume_state not in [constants.VOLUME_CREATING,
+                                     constants.VOLUME_AVAILABLE,
+                                     constants.VOLUME_ATTACHING,
+                                     constants.VOLUME_IN_USE]:
+            raise NonRecoverableError(
+                'Cannot attach Volume {0} because it is in state {1}.'
+                .format(volume_id, volume_state))
+        if volume_state == constants.VOLUME_IN_USE:
+            attached += 1
+
+    ctx.logger.info(
+        '{0} of {1} EBS volumes attached to instance {2}.'
+        .format(attached, len(volume_ids), instance_id))
+
+    return attached == len(volume_ids)
+
+
+def delete_instance_volumes():
+    """Deletes the volumes created by provision_instance_volumes,
+    concurrently. Call again until it returns True.
+
+    :returns True once every volume is deleted.
+    """
+
+    volume_ids = ctx.instance.runtime_properties.get(
+        constants.INSTANCE_VOLUME_IDS, {})
+
+    deleted = utils.run_concurrently(_delete_volume, volume_ids.values())
+
+    remaining_volume_ids = dict(
+        (device, volume_id)
+        for (device, volume_id), volume_deleted
+        in zip(volume_ids.items(), deleted) if not volume_deleted)
+
+    if remaining_volume_ids:
+        ctx.instance.runtime_properties[constants.INSTANCE_VOLUME_IDS] = \
+            remaining_volume_ids
+        return False
+
+    utils.unassign_runtime_property_from_resource(
+        constants.INSTANCE_VOLUME_IDS, ctx.instance)
+    return True
+
+
+def get_block_device_map(volumes):
+    """Returns a block device map creating the volumes listed in an
+    instance's volumes property at launch. The volumes are deleted with
+    the instance unless delete_on_termination is false.
+
+    :param volumes: A list of volume dicts, as for
+        provision_instance_volumes.
+    :returns a boto BlockDeviceMapping.
+    """
+
+    block_device_map = BlockDeviceMapping()
+
+    for volume in volumes:
+        _validate_instance_volume(volume)
+        block_device_map[volume['device']] = BlockDeviceType(
+            size=volume.get('size'),
+            snapshot_id=volume.get('snapshot_id'),
+            volume_type=volume.get('volume_type'),
+            iops=volume.get('iops'),
+            encrypted=volume.get('encrypted'),
+            delete_on_termination=volume.get('delete_on_termination', True))
+
+    return block_device_map
+
+
+def _validate_instance_volume(volume):
+
+    if 'device' not in volume or \
+            not (volume.get('size') or volume.get('snapshot_id')):
+        raise NonRecoverableError(
+            'Each of the instance volumes requires a device and either '
+            'a size or a snapshot_id: {0}.'.format(volume))
+
+
+def _create_instance_volume(zone, volume):
+    """Creates one of the volumes of an instance.
+
+    :returns a tuple of the ID of the new volume, or None,
+        and the NonRecoverableError that prevented its creation
+        or tagging, or None.
+    """
+
+    ec2_client = connection.EC2ConnectionClient().client()
+
+    try:
+        new_volume = ec2_client.create_volume(
+            size=volume.get('size'),
+            zone=zone,
+            snapshot=volume.get('snapshot_id'),
+            volume_type=volume.get('volume_type'),
+            iops=volume.get('iops'),
+            encrypted=volume.get('encrypted', False))
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        return None, NonRecoverableError('{0}'.format(str(e)))
+
+    ctx.logger.info(
+        'Created EBS volume {0} for device {1}.'
+        .format(new_volume.id, volume['device']))
+
+    return new_volume.id, _tag_volume(ec2_client, new_volume.id)
+
+
+def _tag_volume(ec2_client, volume_id):
+    """Tags a volume created by the plugin with its node instance,
+    deployment and owner, so that sweep_orphans finds it if it outlives
+    the deployment.
+
+    :returns the NonRecoverableError that occurred, or None.
+    """
+
+    tags = {
+        'resource_id': ctx.instance.id,
+        'deployment_id': ctx.deployment.id
+    }
+    tags.update(utils.get_owner_tags())
+
+    try:
+        ec2_client.create_tags([volume_id], tags)
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        return NonRecoverableError(
+            'unable to tag resource name: {0}'.format(str(e)))
+
+
+def _describe_instance_volumes(volume_ids):
+    """Describes several volumes with one DescribeVolumes.
+
+    :returns a dict of volume ID to VolumeRecord. It is empty while
+        any of the volumes is not visible yet.
+    """
+
+    volumes = _get_volumes(list(volume_ids), snapshot=True) or []
+
+    return dict((volume.id, volume) for volume in volumes)
 
 
 def _delete_volume(volume_id):
@@ -262,7 +741,7 @@ def _delete_volume(volume_id):
     False if the item cannot be deleted yet.
     """
 
-    volume_to_delete = _get_volumes_from_id(volume_id)
+    volume_to_delete = _get_volumes_from_id(volume_id, snapshot=True)
 
     if not volume_to_delete:
         ctx.logger.info(
@@ -270,14 +749,13 @@ def _delete_volume(volume_id):
             .format(volume_id))
         return True
 
-    if volume_to_delete.status not in \
-            constants.VOLUME_AVAILABLE or \
-            volume_to_delete.status in \
-            constants.VOLUME_IN_USE:
+    if _get_volume_state(volume_to_delete) != constants.VOLUME_AVAILABLE:
         return False
 
+    ec2_client = connection.EC2ConnectionClient().client()
+
     try:
-        output = volume_to_delete.delete()
+        output = ec2_client.delete_volume(volume_to_delete.id)
     except (boto.exception.EC2ResponseError,
             boto.exception.BotoServerError) as e:
         raise NonRecoverableError('{0}'.format(str(e)))
@@ -298,7 +776,7 @@ def _create_external_volume():
 
     volume_id = ctx.node.properties['resource_id']
 
-    volume = _get_volumes_from_id(volume_id)
+    volume = _get_volumes_from_id(volume_id, snapshot=True)
     if not volume:
         raise NonRecoverableError(
             'External EBS volume was indicated, but the '
@@ -372,22 +850,112 @@ def _detach_external_volume_or_instance():
     return True
 
 
-def _get_volumes_from_id(volume_id):
+def _get_volume_or_raise(volume_id):
+    """Describes an EBS volume once, for one step of its lifecycle.
+
+    :param volume_id: The ID of an EBS Volume.
+    :returns a VolumeRecord.
+    :raises NonRecoverableError: If the volume does not exist.
+    """
+
+    volume = _get_volumes_from_id(volume_id, snapshot=True)
+
+    if not volume:
+        raise NonRecoverableError(
+            'EBS volume {0} not found in account.'.format(volume_id))
+
+    return volume
+
+
+def _get_volume_state(volume):
+    """Returns the lifecycle state of a volume: creating, available,
+    attaching, in-use or detaching. Other EC2 statuses, such as deleting
+    or error, are returned as they are.
+
+    :param volume: A volume object or VolumeRecord.
+    :returns a volume state string.
+    """
+
+    if volume.status == constants.VOLUME_IN_USE and \
+            volume.attachment_status in [constants.VOLUME_ATTACHING,
+                                         constants.VOLUME_DETACHING]:
+        return volume.attachment_status
+
+    return volume.status
+
+
+def _attach_volume(volume_id, instance_id, device):
+    """Requests the attachment of an available volume.
+
+    :returns False if another attachment change is already in flight.
+    :raises NonRecoverableError: If Boto errors.
+    """
+
+    ctx.logger.debug(
+        'Attempting to attach volume {0} to instance {1}.'
+        .format(volume_id, instance_id))
+
+    ec2_client = connection.EC2ConnectionClient().client()
+
+    try:
+        ec2_client.attach_volume(volume_id, instance_id, device)
+    except boto.exception.EC2ResponseError as e:
+        if e.error_code in constants.VOLUME_BUSY_ERRORS:
+            return False
+        raise NonRecoverableError('{0}'.format(str(e)))
+    except boto.exception.BotoServerError as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+    return True
+
+
+def _detach_volume(volume, args):
+    """Requests the detachment of a volume from its instance.
+    A detachment that is already in flight is left to complete.
+
+    :param volume: A VolumeRecord of an attached volume.
+    :param args: Additional DetachVolume arguments, such as force.
+    :raises NonRecoverableError: If Boto errors or EC2 refuses.
+    """
+
+    ec2_client = connection.EC2ConnectionClient().client()
+
+    detach_args = dict(instance_id=volume.instance_id, device=volume.device)
+    detach_args.update(args)
+
+    try:
+        detached = ec2_client.detach_volume(volume.id, **detach_args)
+    except boto.exception.EC2ResponseError as e:
+        if e.error_code in constants.VOLUME_BUSY_ERRORS:
+            return
+        raise NonRecoverableError('{0}'.format(str(e)))
+    except boto.exception.BotoServerError as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+    if not detached:
+        raise NonRecoverableError(
+            'Failed to detach volume {0} from instance {1}'
+            .format(volume.id, volume.instance_id))
+
+
+def _get_volumes_from_id(volume_id, snapshot=False):
     """Returns the EBS Volume object for a given EBS Volume id.
 
     :param volume_id: The ID of an EBS Volume.
+    :param snapshot: Return a VolumeRecord instead of the boto object.
     :returns The boto EBS volume object.
     """
 
-    volumes = _get_volumes(list_of_volume_ids=volume_id)
+    volumes = _get_volumes(list_of_volume_ids=volume_id, snapshot=snapshot)
 
     return volumes[0] if volumes else volumes
 
 
-def _get_volumes(list_of_volume_ids):
+def _get_volumes(list_of_volume_ids, snapshot=False):
     """Returns a list of EBS Volumes for a given list of volume IDs.
 
     :param list_of_volume_ids: A list of EBS volume IDs.
+    :param snapshot: Return VolumeRecord snapshots instead of boto objects.
     :returns A list of EBS objects.
     :raises NonRecoverableError: If Boto errors.
     """
@@ -395,14 +963,18 @@ def _get_volumes(list_of_volume_ids):
     ec2_client = connection.EC2ConnectionClient().client()
 
     try:
-        volumes = ec2_client.get_all_volumes(
-            volume_ids=list_of_volume_ids)
+        volumes = list(utils.describe_resources(
+            ec2_client.get_all_volumes,
+            volume_ids=list_of_volume_ids))
     except boto.exception.EC2ResponseError as e:
         if 'InvalidVolume.NotFound' in e:
-            all_volumes = ec2_client.get_all_volumes()
-            utils.log_available_resources(all_volumes)
+            utils.log_available_resources(
+                utils.describe_resources(ec2_client.get_all_volumes))
         return None
     except boto.exception.BotoServerError as e:
         raise NonRecoverableError('{0}'.format(str(e)))
 
+    if snapshot:
+        return records.VolumeRecord.from_resources(volumes)
+
     return volumes
@@ -13,11 +13,17 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+# Built-in Imports
+import time
+import uuid
+import random
+
 # Third-party Imports
 import boto.exception
 
 # Cloudify imports
 from ec2 import utils
+from ec2 import records
 from ec2 import constants
 from ec2 import connection
 from cloudify import ctx
@@ -55,6 +61,12 @@ def allocate(**_):
     if _allocate_external_elasticip():
         return
 
+    pool = ctx.node.properties.get(constants.ELASTIC_IP_POOL_PROPERTY)
+
+    if pool:
+        _allocate_pooled_address(ec2_client, pool)
+        return
+
     ctx.logger.debug('Attempting to allocate elasticip.')
 
     provider_variables = utils.get_provider_variables()
@@ -93,6 +105,19 @@ def release(**_):
     if _release_external_elasticip():
         return
 
+    if ctx.node.properties.get(constants.ELASTIC_IP_POOL_PROPERTY):
+        allocation_id = ctx.instance.runtime_properties.get(
+            constants.ALLOCATION_ID)
+        if allocation_id:
+            _return_pooled_address(
+                connection.EC2ConnectionClient().client(), allocation_id)
+        for runtime_property in \
+                [constants.ALLOCATION_ID,
+                 constants.EXTERNAL_RESOURCE_ID]:
+            utils.unassign_runtime_property_from_resource(
+                runtime_property, ctx.instance)
+        return
+
     address_object = _get_address_object_by_id(elasticip)
 
     if not address_object:
@@ -112,17 +137,16 @@ def release(**_):
             'Elastic IP {0} deletion failed for an unknown reason.'
             .format(address_object.public_ip))
 
-    address = _get_address_object_by_id(address_object.public_ip)
-
-    if not address:
-        for runtime_property in \
-                [constants.ALLOCATION_ID,
-                 constants.EXTERNAL_RESOURCE_ID]:
-            utils.unassign_runtime_property_from_resource(
-                runtime_property, ctx.instance)
-    else:
+    if not _wait_for_release(address_object.public_ip):
         return ctx.operation.retry(
-            message='Elastic IP not released. Retrying...')
+            message='Elastic IP not released. Retrying...',
+            retry_after=utils.get_retry_interval())
+
+    for runtime_property in \
+            [constants.ALLOCATION_ID,
+             constants.EXTERNAL_RESOURCE_ID]:
+        utils.unassign_runtime_property_from_resource(
+            runtime_property, ctx.instance)
 
 
 @operation
@@ -156,7 +180,7 @@ def associate(**_):
         .format(kw))
 
     try:
-        ec2_client.associate_address(**kw)
+        association = ec2_client.associate_address_object(**kw)
     except (boto.exception.EC2ResponseError,
             boto.exception.BotoServerError) as e:
         raise NonRecoverableError('{0}'.format(str(e)))
@@ -164,6 +188,9 @@ def associate(**_):
     ctx.logger.info(
         'Associated Elastic IP {0} with instance {1}.'
         .format(elasticip, instance_id))
+    if association.association_id:
+        ctx.target.instance.runtime_properties[constants.ASSOCIATION_ID] = \
+            association.association_id
     ctx.source.instance.runtime_properties['public_ip_address'] = elasticip
     ctx.target.instance.runtime_properties['instance_id'] = \
         ctx.source.instance.runtime_properties[constants.EXTERNAL_RESOURCE_ID]
@@ -189,25 +216,38 @@ def disassociate(**_):
     if _disassociate_external_elasticip_or_instance():
         return
 
-    elasticip_object = _get_address_object_by_id(elasticip)
-
-    if not elasticip_object:
-        raise NonRecoverableError(
-            'no matching elastic ip in account: {0}'.format(elasticip))
+    association_id = ctx.target.instance.runtime_properties.get(
+        constants.ASSOCIATION_ID)
 
-    disassociate_args = dict(
-        public_ip=elasticip_object.public_ip,
-        association_id=elasticip_object.association_id
-    )
+    if association_id or \
+            constants.ALLOCATION_ID not in \
+            ctx.target.instance.runtime_properties:
+        disassociate_args = dict(
+            public_ip=elasticip, association_id=association_id)
+    else:
+        # VPC addresses associated before association IDs were kept
+        elasticip_object = _get_address_object_by_id(elasticip)
+        if not elasticip_object:
+            raise NonRecoverableError(
+                'no matching elastic ip in account: {0}'.format(elasticip))
+        disassociate_args = dict(
+            public_ip=elasticip_object.public_ip,
+            association_id=elasticip_object.association_id)
 
     ctx.logger.debug('Disassociating Elastic IP {0}'.format(elasticip))
 
     try:
         ec2_client.disassociate_address(**disassociate_args)
-    except (boto.exception.EC2ResponseError,
-            boto.exception.BotoServerError) as e:
+    except boto.exception.EC2ResponseError as e:
+        if e.error_code in constants.ELASTIC_IP_NOT_FOUND_ERRORS:
+            raise NonRecoverableError(
+                'no matching elastic ip in account: {0}'.format(elasticip))
+        raise NonRecoverableError('{0}'.format(str(e)))
+    except boto.exception.BotoServerError as e:
         raise NonRecoverableError('{0}'.format(str(e)))
 
+    utils.unassign_runtime_property_from_resource(
+        constants.ASSOCIATION_ID, ctx.target.instance)
     utils.unassign_runtime_property_from_resource(
         'public_ip_address', ctx.source.instance)
     utils.unassign_runtime_property_from_resource(
@@ -307,6 +347,227 @@ def _disassociate_external_elasticip_or_instance():
     return True
 
 
+def _allocate_pooled_address(ec2_client, pool):
+    """Claims a free address of a pool, or allocates a new one into the
+    pool if none can be claimed, and records it in the runtime
+    properties. Then allocates free addresses until the pool has
+    pool_preallocate of them, so that later claims are fast.
+
+    :param ec2_client: The EC2 client.
+    :param pool: The name of the pool.
+    :returns the boto Address, leased to the current node instance.
+    :raises NonRecoverableError: If Boto errors while claiming.
+    """
+
+    free_allocation_ids = _get_free_pooled_allocation_ids(ec2_client, pool)
+    address_object = None
+
+    candidates = random.sample(
+        free_allocation_ids,
+        min(len(free_allocation_ids), constants.POOL_CLAIM_ATTEMPTS))
+
+    for allocation_id in candidates:
+        if _lease_pooled_address(ec2_client, allocation_id):
+            free_allocation_ids.remove(allocation_id)
+            address_object = _get_pooled_address(ec2_client, allocation_id)
+            ctx.logger.info(
+                'Claimed Elastic IP {0} from pool {1}.'
+                .format(address_object.public_ip, pool))
+            break
+
+    if not address_object:
+        address_object = _allocate_into_pool(
+            ec2_client, pool, _get_lease_tags())
+
+    # the address is leased, so it is recorded before anything may fail
+    ctx.instance.runtime_properties[constants.ALLOCATION_ID] = \
+        address_object.allocation_id
+    utils.set_external_resource_id(
+        address_object.public_ip, ctx.instance, external=False)
+
+    missing = ctx.node.properties.get(
+        constants.ELASTIC_IP_POOL_PREALLOCATE_PROPERTY, 0) - \
+        len(free_allocation_ids)
+
+    if missing > 0:
+        ctx.logger.info(
+            'Allocating {0} free Elastic IPs into pool {1}.'
+            .format(missing, pool))
+        utils.run_concurrently(
+            lambda _: _preallocate_into_pool(pool), range(missing))
+
+    return address_object
+
+
+def _preallocate_into_pool(pool):
+    """Allocates a free address into a pool. Preallocation only makes
+    later claims faster, so a failure, such as AddressLimitExceeded, is
+    logged and not raised.
+    """
+
+    try:
+        _allocate_into_pool(
+            connection.EC2ConnectionClient().client(), pool,
+            {constants.POOL_STATE_TAG: constants.POOL_STATE_FREE})
+    except NonRecoverableError as e:
+        ctx.logger.warn(
+            'Unable to allocate a free Elastic IP into pool {0}: {1}'
+            .format(pool, str(e)))
+
+
+def _get_free_pooled_allocation_ids(ec2_client, pool):
+    """Lists the unassociated addresses of a pool in the free state.
+
+    :returns a list of allocation IDs.
+    """
+
+    try:
+        pooled = set(tag.res_id for tag in ec2_client.get_all_tags(
+            filters={'key': constants.POOL_TAG, 'value': pool}))
+        free = [tag.res_id for tag in ec2_client.get_all_tags(
+                    filters={'key': constants.POOL_STATE_TAG,
+                             'value': constants.POOL_STATE_FREE})
+                if tag.res_id in pooled]
+        addresses = ec2_client.get_all_addresses(allocation_ids=free) \
+            if free else []
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+    return [address.allocation_id for address in addresses
+            if not address.association_id]
+
+
+def _lease_pooled_address(ec2_client, allocation_id):
+    """Tries to lease a free address of a pool to the current node
+    instance. EC2 tags cannot be written conditionally, so every claim
+    writes its own lease tag holding the time of the claim, waits for
+    competing claims to become visible, and reads the leases back. The
+    earliest recent lease wins, and only while the address is still
+    free. The others remove their lease and try another address.
+
+    :returns True if the address was leased.
+    """
+
+    lease_key = '{0}{1}'.format(
+        constants.POOL_LEASE_TAG_PREFIX, uuid.uuid4().hex)
+
+    try:
+        ec2_client.create_tags(
+            [allocation_id], {lease_key: repr(time.time())})
+        time.sleep(constants.POOL_LEASE_SETTLE_TIME)
+        tags = dict((tag.name, tag.value) for tag in ec2_client.get_all_tags(
+            filters={'resource-id': allocation_id}))
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+    now = time.time()
+    leases = sorted(
+        (float(value), key) for key, value in tags.items()
+        if key.startswith(constants.POOL_LEASE_TAG_PREFIX) and
+        now - float(value) < constants.POOL_LEASE_TTL)
+
+    try:
+        if tags.get(constants.POOL_STATE_TAG) != \
+                constants.POOL_STATE_FREE or \
+                not leases or leases[0][1] != lease_key:
+            ec2_client.delete_tags([allocation_id], [lease_key])
+            return False
+        ec2_client.create_tags([allocation_id], _get_lease_tags())
+        ec2_client.delete_tags(
+            [allocation_id],
+            [key for key in tags
+             if key.startswith(constants.POOL_LEASE_TAG_PREFIX)])
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+    return True
+
+
+def _get_lease_tags():
+    return {
+        constants.POOL_STATE_TAG: constants.POOL_STATE_LEASED,
+        'resource_id': ctx.instance.id,
+        'deployment_id': ctx.deployment.id
+    }
+
+
+def _allocate_into_pool(ec2_client, pool, tags):
+    """Allocates a VPC address and tags it into a pool.
+
+    :returns the boto Address.
+    """
+
+    try:
+        address_object = ec2_client.allocate_address(
+            domain=constants.VPC_DOMAIN)
+        ec2_client.create_tags(
+            [address_object.allocation_id],
+            dict(tags, **{constants.POOL_TAG: pool}))
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+    return address_object
+
+
+def _get_pooled_address(ec2_client, allocation_id):
+
+    try:
+        return ec2_client.get_all_addresses(allocation_ids=[allocation_id])[0]
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+
+def _return_pooled_address(ec2_client, allocation_id):
+    """Frees an address leased from a pool, for the next claim,
+    instead of releasing it.
+    """
+
+    try:
+        ec2_client.create_tags(
+            [allocation_id],
+            {constants.POOL_STATE_TAG: constants.POOL_STATE_FREE})
+        ec2_client.delete_tags(
+            [allocation_id], ['resource_id', 'deployment_id'])
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+    ctx.logger.info(
+        'Returned Elastic IP {0} to its pool.'.format(allocation_id))
+
+
+def _wait_for_release(public_ip):
+    """Polls for a released address to disappear, briefly, since a
+    release is usually visible within seconds.
+
+    :param public_ip: The released address.
+    :returns True once the address is no longer described.
+    :raises NonRecoverableError: If Boto errors.
+    """
+
+    ec2_client = connection.EC2ConnectionClient().client()
+
+    for attempt in range(constants.ELASTIC_IP_RELEASE_WAIT_ATTEMPTS):
+        if attempt:
+            time.sleep(constants.ELASTIC_IP_RELEASE_WAIT_INTERVAL)
+        try:
+            if not ec2_client.get_all_addresses(addresses=[public_ip]):
+                return True
+        except boto.exception.EC2ResponseError as e:
+            if e.error_code in constants.ELASTIC_IP_NOT_FOUND_ERRORS:
+                return True
+            raise NonRecoverableError('{0}'.format(str(e)))
+        except boto.exception.BotoServerError as e:
+            raise NonRecoverableError('{0}'.format(str(e)))
+
+    return False
+
+
 def _get_address_by_id(address_id):
     """Returns the elastip ip for a given address elastip.
 
@@ -314,27 +575,29 @@ def _get_address_by_id(address_id):
     :returns The boto elastip ip.
     """
 
-    address = _get_address_object_by_id(address_id)
+    address = _get_address_object_by_id(address_id, snapshot=True)
 
     return address.public_ip if address else address
 
 
-def _get_address_object_by_id(address_id):
+def _get_address_object_by_id(address_id, snapshot=False):
     """Returns the elastip object for a given address elastip.
 
     :param address_id: The ID of a elastip.
+    :param snapshot: Return an AddressRecord instead of the boto object.
     :returns The boto elastip object.
     """
 
-    address = _get_all_addresses(address=address_id)
+    address = _get_all_addresses(address=address_id, snapshot=snapshot)
 
     return address[0] if address else address
 
 
-def _get_all_addresses(address=None):
+def _get_all_addresses(address=None, snapshot=False):
     """Returns a list of elastip objects for a given address elastip.
 
     :param address: The ID of a elastip.
+    :param snapshot: Return AddressRecord snapshots instead of boto objects.
     :returns A list of elasticip objects.
     :raises NonRecoverableError: If Boto errors.
     """
@@ -342,13 +605,17 @@ def _get_all_addresses(address=None):
     ec2_client = connection.EC2ConnectionClient().client()
 
     try:
-        addresses = ec2_client.get_all_addresses(address)
+        addresses = list(utils.describe_resources(
+            ec2_client.get_all_addresses, addresses=address))
     except boto.exception.EC2ResponseError as e:
         if 'InvalidAddress.NotFound' in e:
-            addresses = ec2_client.get_all_addresses()
-            utils.log_available_resources(addresses)
+            utils.log_available_resources(
+                utils.describe_resources(ec2_client.get_all_addresses))
         return None
     except boto.exception.BotoServerError as e:
         raise NonRecoverableError('{0}'.format(str(e)))
 
+    if snapshot:
+        return records.AddressRecord.from_resources(addresses)
+
     return addresses
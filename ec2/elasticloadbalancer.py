@@ -68,16 +68,16 @@ def create_elb(**_):
 
 def _add_instance_to_elb_list_in_properties(instance_id):
 
-    if 'instance_list' not in ctx.target.instance.runtime_properties.keys():
-        ctx.target.instance.runtime_properties['instance_list'] = []
-
-    ctx.target.instance.runtime_properties['instance_list'].append(instance_id)
+    with utils.RuntimePropertyStage(ctx.target.instance) as \
+            runtime_properties:
+        runtime_properties.list('instance_list').add(instance_id)
 
 
 def _remove_instance_from_elb_list_in_properties(instance_id):
-    if instance_id in ctx.target.instance.runtime_properties['instance_list']:
-        ctx.target.instance.runtime_properties['instance_list'].remove(
-            instance_id)
+
+    with utils.RuntimePropertyStage(ctx.target.instance) as \
+            runtime_properties:
+        runtime_properties.list('instance_list').discard(instance_id)
 
 
 @operation
@@ -278,9 +278,7 @@ def _get_elbs_by_names(list_of_names):
     elb_client = connection.ELBConnectionClient().client()
 
     try:
-        total_elb_list = elb_client.get_all_load_balancers()
-        elb_list = elb_client.get_all_load_balancers(
-            load_balancer_names=list_of_names)
+        elb_list = list(_describe_elbs(elb_client, list_of_names))
     except (boto.exception.EC2ResponseError,
             boto.exception.BotoServerError,
             boto.exception.BotoClientError) as e:
@@ -288,12 +286,26 @@ def _get_elbs_by_names(list_of_names):
             ctx.logger.info('Unable to find load balancers matching: '
                             '{0}'.format(list_of_names))
             ctx.logger.info('load balancers available: '
-                            '{0}'.format(total_elb_list))
+                            '{0}'.format(list(_describe_elbs(elb_client))))
         raise NonRecoverableError('Error when accessing ELB interface '
                                   '{0}'.format(str(e)))
     return elb_list
 
 
+def _describe_elbs(elb_client, list_of_names=None):
+    """Yields load balancers one DescribeLoadBalancers page at a time.
+
+    :param elb_client: The ELB client.
+    :param list_of_names: A list of load balancer names.
+    :returns a generator of load balancer objects.
+    """
+
+    return utils.describe_resources(
+        elb_client.get_all_load_balancers,
+        token_argument='marker', token_attribute='next_marker',
+        load_balancer_names=list_of_names)
+
+
 def _get_existing_elb(elb_name):
     elbs = _get_elbs_by_names([elb_name])
     if elbs:
@@ -0,0 +1,173 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import os
+import json
+import time
+import tempfile
+import threading
+
+# Third-party Imports
+import boto.exception
+
+# Cloudify imports
+from ec2 import records
+from ec2 import constants
+from cloudify.exceptions import NonRecoverableError
+
+_cache_lock = threading.Lock()
+
+
+def get_cache_path():
+    """Returns the path of the AMI cache file, in the work dir of the
+    agent, or in the temporary directory outside of an agent.
+    """
+
+    work_dir = os.environ.get(constants.AMI_CACHE_WORK_DIR_ENV_VAR_NAME) \
+        or tempfile.gettempdir()
+
+    return os.path.join(work_dir, constants.AMI_CACHE_FILE_NAME)
+
+
+class ImageCache(object):
+    """An on-disk cache of AMI metadata, keyed by access key, region and
+    image ID, since the AMIs available differ between accounts.
+
+    The metadata of an AMI never changes, so cached images are kept for
+    good. Only their state expires, after AMI_CACHE_STATE_TTL seconds,
+    for the lookups that need a current one.
+    """
+
+    def __init__(self, ec2_client, path=None):
+        self.ec2_client = ec2_client
+        self.access_key = ec2_client.aws_access_key_id or ''
+        self.region = ec2_client.region.name
+        self.path = path or get_cache_path()
+
+    def get(self, image_id, current_state=True):
+        """Returns an AMI, describing it only if it is not cached,
+        or if a current state is needed and the cached one expired.
+
+        :param image_id: The ID of the AMI image.
+        :param current_state: Whether the state must be current.
+        :returns an image record.
+        :raises NonRecoverableError: If the AMI cannot be described.
+        """
+
+        if not image_id:
+            raise NonRecoverableError(
+                'No image_id was provided.')
+
+        image = self.get_cached(image_id, current_state)
+
+        if image is None:
+            image = self._describe([image_id])[image_id]
+
+        return image
+
+    def get_cached(self, image_id, current_state=True):
+        """Returns a cached AMI, without calling EC2.
+
+        :param image_id: The ID of the AMI image.
+        :param current_state: Whether the state must be current.
+        :returns an image record, or None if the AMI is not cached
+            or its state expired.
+        """
+
+        entry = self._load().get(self._key(image_id))
+
+        if entry is None or current_state and \
+                time.time() - entry['state_time'] > \
+                constants.AMI_CACHE_STATE_TTL:
+            return None
+
+        return records.ImageRecord.from_dict(entry['image'])
+
+    def prefetch(self, image_ids):
+        """Caches many AMIs with one DescribeImages call. The AMIs
+        already cached with a current state are left out.
+
+        :param image_ids: The IDs of the AMI images.
+        :returns a dict of image IDs to image records.
+        :raises NonRecoverableError: If the AMIs cannot be described.
+        """
+
+        image_ids = set(image_ids)
+        images = dict((image_id, self.get_cached(image_id))
+                      for image_id in image_ids)
+        missing = [image_id for image_id, image in images.items()
+                   if image is None]
+
+        if missing:
+            images.update(self._describe(missing))
+
+        return images
+
+    def _describe(self, image_ids):
+
+        try:
+            images = records.ImageRecord.from_resources(
+                self.ec2_client.get_all_images(image_ids=image_ids))
+        except (boto.exception.EC2ResponseError,
+                boto.exception.BotoServerError) as e:
+            raise NonRecoverableError('{0}.'.format(str(e)))
+
+        images = dict((image.id, image) for image in images)
+
+        not_found = set(image_ids) - set(images)
+        if not_found:
+            raise NonRecoverableError(
+                'image_id {0} not available to this account.'
+                .format(', '.join(sorted(not_found))))
+
+        self._store(images.values())
+
+        return images
+
+    def _key(self, image_id):
+        return '{0}:{1}:{2}'.format(self.access_key, self.region, image_id)
+
+    def _load(self):
+
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError):
+            return {}
+
+    def _store(self, images):
+        """Writes images to the cache file. The file is replaced with a
+        rename, so concurrent operations never read a partial file.
+        """
+
+        state_time = time.time()
+
+        with _cache_lock:
+            entries = self._load()
+            entries.update(
+                (self._key(image.id),
+                 dict(image=image.to_dict(), state_time=state_time))
+                for image in images)
+
+            cache_dir = os.path.dirname(self.path) or '.'
+            try:
+                fd, temporary_path = tempfile.mkstemp(dir=cache_dir)
+                with os.fdopen(fd, 'w') as cache_file:
+                    json.dump(entries, cache_file)
+                os.rename(temporary_path, self.path)
+            except (IOError, OSError):
+                # The cache only saves calls, a failed write loses nothing.
+                pass
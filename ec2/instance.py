@@ -14,21 +14,31 @@
 #    * limitations under the License.
 
 import os
+import copy
+import json
+import hashlib
 
 # Third-party Imports
 import boto.exception
 
 # Cloudify imports
 from ec2 import utils
+from ec2 import images
+from ec2 import records
 from ec2 import constants
 from ec2 import connection
 from cloudify import ctx
 from cloudify import compute
 from cloudify.exceptions import NonRecoverableError
 from cloudify.decorators import operation
+from ec2 import ebs
 from ec2 import passwd
 from ec2.keypair import KEYPAIR_AWS_TYPE
 
+# Launch parameters already assembled by this agent, keyed by a digest
+# of their inputs.
+_launch_parameters_cache = dict()
+
 
 @operation
 def creation_validation(**_):
@@ -37,7 +47,7 @@ def creation_validation(**_):
     for property_key in constants.INSTANCE_REQUIRED_PROPERTIES:
         utils.validate_node_property(property_key, ctx.node.properties)
 
-    instance = _get_instance_from_id(utils.get_resource_id())
+    instance = _get_instance_from_id(utils.get_resource_id(), snapshot=True)
 
     if ctx.node.properties['use_external_resource'] and not instance:
         raise NonRecoverableError(
@@ -68,6 +78,7 @@ def run_instances(**_):
         return
 
     instance_parameters = _get_instance_parameters()
+    _check_cached_image(instance_parameters['image_id'])
 
     ctx.logger.info(
         'Attempting to create EC2 Instance with these API parameters: {0}.'
@@ -75,9 +86,8 @@ def run_instances(**_):
 
     instance_id = _run_instances_if_needed(ec2_client, instance_parameters)
 
-    instance = _get_instance_from_id(instance_id)
-
-    if instance is None:
+    if not _get_launch_attributes(instance_id) and \
+            _get_instance_from_id(instance_id, snapshot=True) is None:
         return ctx.operation.retry(
             message='Waiting to verify that instance {0} '
             'has been added to your account.'.format(instance_id))
@@ -134,7 +144,7 @@ def start(start_retry_interval=30, private_key_path=None, **_):
                     retry_after=start_retry_interval)
 
         _instance_started_assign_runtime_properties_and_tag(instance_id)
-        return
+        return _provision_instance_volumes(instance_id)
 
     ctx.logger.debug('Attempting to start instance: {0}.)'.format(instance_id))
 
@@ -157,6 +167,7 @@ def start(start_retry_interval=30, private_key_path=None, **_):
                     message='Waiting for server to post generated password',
                     retry_after=start_retry_interval)
         _instance_started_assign_runtime_properties_and_tag(instance_id)
+        return _provision_instance_volumes(instance_id)
     else:
         return ctx.operation.retry(
             message='Waiting server to be running. Retrying...',
@@ -220,26 +231,66 @@ def terminate(**_):
 
     if _get_instance_state() == \
             constants.INSTANCE_STATE_TERMINATED:
+        if not ebs.delete_instance_volumes():
+            return ctx.operation.retry(
+                message='Waiting to delete the EBS volumes of instance {0}.'
+                        .format(instance_id),
+                retry_after=utils.get_retry_interval())
         ctx.logger.info('Terminated instance: {0}.'.format(instance_id))
         utils.unassign_runtime_property_from_resource(
             constants.EXTERNAL_RESOURCE_ID, ctx.instance)
+        utils.unassign_runtime_property_from_resource(
+            constants.INSTANCE_LAUNCH_CACHE, ctx.instance)
     else:
         return ctx.operation.retry(
             message='Waiting server to terminate. Retrying...')
 
 
+@operation
+def release(**_):
+    """Forgets an instance terminated by the teardown_deployment
+    workflow, once the EBS volumes provisioned for it are deleted.
+    """
+
+    if not ebs.delete_instance_volumes():
+        return ctx.operation.retry(
+            message='Waiting to delete the EBS volumes of instance {0}.'
+                    .format(ctx.instance.runtime_properties.get(
+                        constants.EXTERNAL_RESOURCE_ID)),
+            retry_after=utils.get_retry_interval())
+
+    _unassign_runtime_properties(
+        list(ctx.instance.runtime_properties.keys()), ctx.instance)
+
+
+@operation
+def prefetch_images(image_ids, **_):
+    """Caches AMIs in the AMI cache of this agent, with one
+    DescribeImages call, for the instances validated and launched
+    by it afterwards.
+
+    :param image_ids: The IDs of the AMI images.
+    """
+
+    ec2_client = connection.EC2ConnectionClient().client()
+    ctx.logger.info(
+        'Caching AMIs {0}.'.format(', '.join(sorted(image_ids))))
+    images.ImageCache(ec2_client).prefetch(image_ids)
+
+
 def _assign_runtime_properties_to_instance(runtime_properties):
 
-    for property_name in runtime_properties:
-        if 'ip' is property_name:
-            ctx.instance.runtime_properties[property_name] = \
-                _get_instance_attribute('private_ip_address')
-        elif 'public_ip_address' is property_name:
-            ctx.instance.runtime_properties[property_name] = \
-                _get_instance_attribute('ip_address')
-        else:
-            ctx.instance.runtime_properties[property_name] = \
-                _get_instance_attribute(property_name)
+    attribute_names = dict(
+        (property_name,
+         constants.INSTANCE_PROPERTY_ATTRIBUTES.get(
+             property_name, property_name))
+        for property_name in runtime_properties)
+
+    attributes = _get_instance_attributes(attribute_names.values())
+
+    with utils.RuntimePropertyStage(ctx.instance) as runtime_properties:
+        for property_name, attribute in attribute_names.items():
+            runtime_properties[property_name] = attributes[attribute]
 
 
 def _instance_created_assign_runtime_properties():
@@ -247,6 +298,27 @@ def _instance_created_assign_runtime_properties():
         runtime_properties=constants.INSTANCE_INTERNAL_ATTRIBUTES_POST_CREATE)
 
 
+def _provision_instance_volumes(instance_id):
+    """Creates and attaches the volumes of the instance, unless there are
+    none or they were created at launch through the block device map.
+    """
+
+    volumes = ctx.node.properties.get(constants.INSTANCE_VOLUMES_PROPERTY)
+
+    if not volumes or \
+            ctx.node.properties.get(constants.INSTANCE_VOLUMES_AT_LAUNCH):
+        return
+
+    if not ebs.provision_instance_volumes(
+            instance_id,
+            ctx.instance.runtime_properties.get('placement'),
+            volumes):
+        return ctx.operation.retry(
+            message='Waiting for the EBS volumes of instance {0} '
+                    'to be attached.'.format(instance_id),
+            retry_after=utils.get_retry_interval())
+
+
 def _instance_started_assign_runtime_properties_and_tag(instance_id):
 
     instance = _get_instance_from_id(instance_id)
@@ -314,41 +386,126 @@ def _get_windows_password(ec2_client,
 
 
 def _unassign_runtime_properties(runtime_properties, ctx_instance):
-    for property_name in runtime_properties:
-        utils.unassign_runtime_property_from_resource(
-            property_name, ctx_instance)
+    utils.unassign_runtime_properties_from_resource(
+        runtime_properties, ctx_instance)
 
 
 def _run_instances_if_needed(ec2_client, instance_parameters):
 
     if ctx.operation.retry_number == 0:
-
-        try:
-            reservation = ec2_client.run_instances(**instance_parameters)
-        except (boto.exception.EC2ResponseError,
-                boto.exception.BotoServerError) as e:
-            raise NonRecoverableError('{0}'.format(str(e)))
-        ctx.instance.runtime_properties['reservation_id'] = reservation.id
-        return reservation.instances[0].id
+        return _launch_instance(ec2_client, instance_parameters)
 
     elif constants.EXTERNAL_RESOURCE_ID not in ctx.instance.runtime_properties:
 
-        instances = _get_instances_from_reservation_id(ec2_client)
+        reservation = _get_reservation_from_client_token(
+            ec2_client, instance_parameters['client_token'])
 
-        if not instances:
-            raise NonRecoverableError(
-                'Instance failed for an unknown reason. Node ID: {0}. '
-                .format(ctx.instance.id))
-        elif len(instances) != 1:
-            raise NonRecoverableError(
-                'More than one instance was created by the install workflow. '
-                'Unable to handle request.')
+        if reservation and reservation.instances:
+            ctx.instance.runtime_properties['reservation_id'] = \
+                reservation.id
+            _cache_launch_attributes(reservation.instances[0])
+            return reservation.instances[0].id
 
-        return instances[0].id
+        # The launch may not be visible yet, or may never have reached EC2.
+        # Either way, launching again with the same client token is safe:
+        # EC2 returns the original reservation instead of a new one.
+        return _launch_instance(ec2_client, instance_parameters)
 
     return ctx.instance.runtime_properties[constants.EXTERNAL_RESOURCE_ID]
 
 
+def _launch_instance(ec2_client, instance_parameters):
+
+    try:
+        reservation = ec2_client.run_instances(**instance_parameters)
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+    ctx.instance.runtime_properties['reservation_id'] = reservation.id
+    _cache_launch_attributes(reservation.instances[0])
+    return reservation.instances[0].id
+
+
+def _cache_launch_attributes(instance):
+    """Keeps the attributes that are known as soon as RunInstances
+    returns, so that they can be read before EC2 lists the instance.
+    Empty attributes are left out, so that they are described later,
+    unless their empty value is final.
+
+    :param instance: The launched instance object.
+    """
+
+    launch_attributes = dict(id=instance.id)
+
+    for attribute in constants.INSTANCE_LAUNCH_ATTRIBUTES:
+        value = getattr(instance, attribute, None)
+        if value or attribute in \
+                constants.INSTANCE_LAUNCH_ATTRIBUTES_FINAL_IF_EMPTY:
+            launch_attributes[attribute] = value
+
+    ctx.instance.runtime_properties[constants.INSTANCE_LAUNCH_CACHE] = \
+        launch_attributes
+
+
+def _get_launch_attributes(instance_id):
+    """Returns the attributes cached by _cache_launch_attributes.
+    These never change during the life of the instance, so a cached
+    None, such as the vpc_id of an EC2-Classic instance, is final.
+    Attributes that were empty at launch are missing, and described.
+
+    :param instance_id: The ID of the EC2 Instance.
+    :returns a dict of attributes, empty if instance_id was not launched
+        by this node instance.
+    """
+
+    launch_attributes = ctx.instance.runtime_properties.get(
+        constants.INSTANCE_LAUNCH_CACHE, {})
+
+    if launch_attributes.get('id') != instance_id:
+        return {}
+
+    return launch_attributes
+
+
+def _get_client_token():
+    """Returns the RunInstances client token of this node instance.
+
+    The token is the same every time the create operation runs within
+    an execution, so a repeated launch never creates a second instance.
+    The execution id is part of it because EC2 keeps honoring a token
+    after its instance is terminated, which would otherwise break
+    reinstalling the same node instance.
+
+    :returns a client token string.
+    """
+
+    seed = ':'.join([ctx.deployment.id,
+                     ctx.instance.id,
+                     ctx.execution_id or ''])
+
+    return hashlib.sha1(seed.encode('utf-8')).hexdigest()
+
+
+def _get_reservation_from_client_token(ec2_client, client_token):
+    """Returns the reservation launched with a client token.
+
+    :param ec2_client: The EC2 client.
+    :param client_token: The client token of the RunInstances request.
+    :returns a boto Reservation or None.
+    """
+
+    try:
+        return utils.find_resource(
+            utils.describe_resources(
+                ec2_client.get_all_reservations,
+                token_argument='next_token',
+                filters={'client-token': client_token},
+                max_results=constants.DESCRIBE_PAGE_SIZE))
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+
 def _handle_userdata(parameters):
 
     existing_userdata = parameters.get('user_data')
@@ -370,22 +527,24 @@ def _handle_userdata(parameters):
     return parameters
 
 
-def _get_instances_from_reservation_id(ec2_client):
+def _get_instances_from_reservation_id(ec2_client, snapshot=False):
+
+    reservation_id = ctx.instance.runtime_properties.get('reservation_id')
+    if not reservation_id:
+        return None
 
     try:
-        reservations = ec2_client.get_all_instances(
-            filters={
-                'reservation-id':
-                    ctx.instance.runtime_properties['reservation_id']
-            })
+        instances = list(_describe_instances(
+            ec2_client,
+            filters={'reservation-id': reservation_id}))
     except (boto.exception.EC2ResponseError,
             boto.exception.BotoServerError) as e:
         raise NonRecoverableError('{0}'.format(str(e)))
 
-    if len(reservations) < 1:
-        return None
+    if snapshot:
+        instances = records.InstanceRecord.from_resources(instances)
 
-    return reservations[0].instances
+    return instances or None
 
 
 def _create_external_instance():
@@ -394,7 +553,7 @@ def _create_external_instance():
         return False
 
     instance_id = ctx.node.properties['resource_id']
-    instance = _get_instance_from_id(instance_id)
+    instance = _get_instance_from_id(instance_id, snapshot=True)
     if instance is None:
         raise NonRecoverableError(
             'Cannot use_external_resource because instance_id {0} '
@@ -442,9 +601,37 @@ def _terminate_external_instance(instance_id):
     return True
 
 
-def _get_all_instances(list_of_instance_ids=None):
+def _describe_instances(ec2_client, list_of_instance_ids=None, filters=None):
+    """Yields the instances of every reservation matching the arguments.
+    Reservations are requested one page at a time, so stopping the
+    iteration early spares the remaining DescribeInstances calls.
+
+    :param ec2_client: The EC2 client.
+    :param list_of_instance_ids: An instance ID or list of instance IDs.
+    :param filters: Server-side filters for DescribeInstances.
+    :returns a generator of instance objects.
+    """
+
+    describe_args = dict(instance_ids=list_of_instance_ids, filters=filters)
+
+    # AWS refuses MaxResults when instance IDs are given.
+    if not list_of_instance_ids:
+        describe_args['max_results'] = constants.DESCRIBE_PAGE_SIZE
+
+    reservations = utils.describe_resources(
+        ec2_client.get_all_reservations,
+        token_argument='next_token', **describe_args)
+
+    for reservation in reservations:
+        for instance in reservation.instances:
+            yield instance
+
+
+def _get_all_instances(list_of_instance_ids=None, snapshot=False):
     """Returns a list of instance objects for a list of instance IDs.
 
+    :param list_of_instance_ids: An instance ID or list of instance IDs.
+    :param snapshot: Return InstanceRecord snapshots instead of boto objects.
     :returns a list of instance objects.
     :raises NonRecoverableError: If Boto errors.
     """
@@ -452,57 +639,61 @@ def _get_all_instances(list_of_instance_ids=None):
     ec2_client = connection.EC2ConnectionClient().client()
 
     try:
-        reservations = ec2_client.get_all_reservations(list_of_instance_ids)
+        instances = list(_describe_instances(ec2_client, list_of_instance_ids))
     except boto.exception.EC2ResponseError as e:
         if 'InvalidInstanceID.NotFound' in e:
-            instances = [instance for res in ec2_client.get_all_reservations()
-                         for instance in res.instances]
-            utils.log_available_resources(instances)
+            utils.log_available_resources(_describe_instances(ec2_client))
         return None
     except boto.exception.BotoServerError as e:
         raise NonRecoverableError('{0}'.format(str(e)))
 
-    instances = []
-
-    for reservation in reservations:
-        for instance in reservation.instances:
-            instances.append(instance)
+    if snapshot:
+        return records.InstanceRecord.from_resources(instances)
 
     return instances
 
 
-def _get_instance_from_id(instance_id):
+def _get_instance_from_id(instance_id, snapshot=False):
     """Gets the instance ID of a EC2 Instance
 
     :param instance_id: The ID of an EC2 Instance
+    :param snapshot: Return an InstanceRecord instead of the boto object.
     :returns an ID of a an EC2 Instance or None.
     """
 
-    instance = _get_all_instances(list_of_instance_ids=instance_id)
+    instance = _get_all_instances(
+        list_of_instance_ids=instance_id, snapshot=snapshot)
 
     return instance[0] if instance else instance
 
 
 def _get_image(image_id):
-    """Gets the boto object that represents the AMI image for image id.
+    """Gets the AMI image for image id, from the AMI cache of the agent
+    when it holds the image with a current state.
 
     :param image_id: The ID of the AMI image.
-    :returns an object that represents an AMI image.
+    :returns an image record.
     """
 
     ec2_client = connection.EC2ConnectionClient().client()
 
-    if not image_id:
-        raise NonRecoverableError(
-            'No image_id was provided.')
+    return images.ImageCache(ec2_client).get(image_id)
 
-    try:
-        image_object = ec2_client.get_image(image_id)
-    except (boto.exception.EC2ResponseError,
-            boto.exception.BotoServerError) as e:
-        raise NonRecoverableError('{0}.'.format(str(e)))
 
-    return image_object
+def _check_cached_image(image_id):
+    """Fails a launch early if the AMI cache knows that the image is
+    not available. An image that is not cached is left for RunInstances
+    to check, so that launching never describes images.
+
+    :param image_id: The ID of the AMI image.
+    """
+
+    ec2_client = connection.EC2ConnectionClient().client()
+    image = images.ImageCache(ec2_client).get_cached(image_id)
+
+    if image and 'available' not in image.state:
+        raise NonRecoverableError(
+            'image_id {0} not available to this account.'.format(image_id))
 
 
 def _get_instance_attribute(attribute):
@@ -514,6 +705,22 @@ def _get_instance_attribute(attribute):
     :raises NonRecoverableError if no instance is found.
     """
 
+    return _get_instance_attributes([attribute])[attribute]
+
+
+def _get_instance_attributes(attributes):
+    """Gets several attributes of the EC2 Instance. Attributes cached
+    at launch are served from the cache, and the instance is described
+    at most once for the rest.
+
+    :param attributes: A list of named python attributes of a boto object.
+    :returns a dict of attribute name to value.
+    :raises NonRecoverableError if constants.EXTERNAL_RESOURCE_ID not set
+    :raises NonRecoverableError if no instance is found.
+    """
+
+    attribute = ', '.join(attributes)
+
     if constants.EXTERNAL_RESOURCE_ID not in ctx.instance.runtime_properties:
         raise NonRecoverableError(
             'Unable to get instance attibute {0}, because {1} is not set.'
@@ -521,12 +728,18 @@ def _get_instance_attribute(attribute):
 
     instance_id = \
         ctx.instance.runtime_properties[constants.EXTERNAL_RESOURCE_ID]
-    instance_object = _get_instance_from_id(instance_id)
+
+    launch_attributes = _get_launch_attributes(instance_id)
+    if all(name in launch_attributes for name in attributes):
+        return dict((name, launch_attributes[name]) for name in attributes)
+
+    instance_object = _get_instance_from_id(instance_id, snapshot=True)
 
     if not instance_object:
         if not ctx.node.properties['use_external_resource']:
             ec2_client = connection.EC2ConnectionClient().client()
-            instances = _get_instances_from_reservation_id(ec2_client)
+            instances = _get_instances_from_reservation_id(
+                ec2_client, snapshot=True)
             if not instances:
                 raise NonRecoverableError(
                     'Unable to get instance attibute {0}, because '
@@ -543,8 +756,8 @@ def _get_instance_attribute(attribute):
                 'External resource, but the supplied '
                 'instance id {0} is not in the account.'.format(instance_id))
 
-    attribute = getattr(instance_object, attribute)
-    return attribute
+    return dict((name, getattr(instance_object, name))
+                for name in attributes)
 
 
 def _get_instance_state():
@@ -559,44 +772,100 @@ def _get_instance_state():
 def _get_instance_parameters():
     """The parameters to the run_instance boto call.
 
+    The parameters shared by the instances of a node are assembled once
+    per agent, for the same node properties, provider context and
+    relationship targets. The user data and client token of the node
+    instance are then applied to a copy of them.
+
     :returns parameters dictionary
     """
 
     provider_variables = utils.get_provider_variables()
 
+    target_ids = utils.get_target_external_resource_ids_by_type(
+        [constants.INSTANCE_SECURITY_GROUP_RELATIONSHIP,
+         constants.INSTANCE_KEYPAIR_RELATIONSHIP,
+         constants.INSTANCE_SUBNET_RELATIONSHIP],
+        ctx.instance)
+
+    key = _digest([ctx.deployment.id, ctx.node.id, ctx.node.properties,
+                   provider_variables, target_ids])
+
+    if key not in _launch_parameters_cache:
+        _remember(_launch_parameters_cache, key,
+                  _get_node_instance_parameters(
+                      provider_variables, target_ids))
+
+    parameters = copy.deepcopy(_launch_parameters_cache[key])
+    parameters = _handle_userdata(parameters)
+
+    if not parameters.get('client_token'):
+        parameters['client_token'] = _get_client_token()
+
+    return parameters
+
+
+def _get_node_instance_parameters(provider_variables, target_ids):
+    """The run_instance parameters that are the same for every
+    instance of a node.
+
+    :param provider_variables: The provider context variables.
+    :param target_ids: The relationship target ids, by relationship type.
+    :returns parameters dictionary
+    """
+
     attached_group_ids = \
-        utils.get_target_external_resource_ids(
-            constants.INSTANCE_SECURITY_GROUP_RELATIONSHIP,
-            ctx.instance)
+        list(target_ids[constants.INSTANCE_SECURITY_GROUP_RELATIONSHIP])
 
     if provider_variables.get(constants.AGENTS_SECURITY_GROUP):
         attached_group_ids.append(
             provider_variables[constants.AGENTS_SECURITY_GROUP])
 
-    parameters = \
-        provider_variables.get(constants.AGENTS_AWS_INSTANCE_PARAMETERS)
+    parameters = dict(
+        provider_variables.get(constants.AGENTS_AWS_INSTANCE_PARAMETERS))
     parameters.update({
         'image_id': ctx.node.properties['image_id'],
         'instance_type': ctx.node.properties['instance_type'],
         'security_group_ids': attached_group_ids,
-        'key_name': _get_instance_keypair(provider_variables),
-        'subnet_id': _get_instance_subnet(provider_variables)
+        'key_name': _get_instance_keypair(
+            provider_variables,
+            target_ids[constants.INSTANCE_KEYPAIR_RELATIONSHIP]),
+        'subnet_id': _get_instance_subnet(
+            provider_variables,
+            target_ids[constants.INSTANCE_SUBNET_RELATIONSHIP])
     })
 
     parameters.update(ctx.node.properties['parameters'])
-    parameters = _handle_userdata(parameters)
+
+    volumes = ctx.node.properties.get(constants.INSTANCE_VOLUMES_PROPERTY)
+    if volumes and \
+            ctx.node.properties.get(constants.INSTANCE_VOLUMES_AT_LAUNCH) \
+            and not parameters.get('block_device_map'):
+        parameters['block_device_map'] = ebs.get_block_device_map(volumes)
 
     return parameters
 
 
-def _get_instance_keypair(provider_variables):
+def _digest(inputs):
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+
+def _remember(cache, key, value):
+    """Caches a value, emptying the cache first when it is full, so that
+    a long lived agent does not keep every deployment's parameters.
+    """
+
+    if len(cache) >= constants.INSTANCE_PARAMETERS_CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+
+
+def _get_instance_keypair(provider_variables, list_of_keypairs):
     """Gets the instance key pair. If more or less than one is provided,
     this will raise an error.
 
     """
-    list_of_keypairs = \
-        utils.get_target_external_resource_ids(
-            constants.INSTANCE_KEYPAIR_RELATIONSHIP, ctx.instance)
+    list_of_keypairs = list(list_of_keypairs)
 
     if not list_of_keypairs and \
             provider_variables.get(constants.AGENTS_KEYPAIR):
@@ -608,12 +877,9 @@ def _get_instance_keypair(provider_variables):
     return list_of_keypairs[0] if list_of_keypairs else None
 
 
-def _get_instance_subnet(provider_variables):
+def _get_instance_subnet(provider_variables, list_of_subnets):
 
-    list_of_subnets = \
-        utils.get_target_external_resource_ids(
-            constants.INSTANCE_SUBNET_RELATIONSHIP, ctx.instance
-        )
+    list_of_subnets = list(list_of_subnets)
 
     if not list_of_subnets and provider_variables.get(constants.SUBNET):
         list_of_subnets.append(provider_variables[constants.SUBNET])
@@ -236,12 +236,13 @@ def _get_key_pair_by_id(key_pair_id):
     ec2_client = connection.EC2ConnectionClient().client()
 
     try:
-        key_pairs = ec2_client.get_all_key_pairs(keynames=key_pair_id)
+        key_pair = utils.find_resource(utils.describe_resources(
+            ec2_client.get_all_key_pairs, keynames=key_pair_id))
     except (boto.exception.EC2ResponseError,
             boto.exception.BotoServerError) as e:
         raise NonRecoverableError('{0}'.format(str(e)))
 
-    return key_pairs[0] if key_pairs else None
+    return key_pair
 
 
 def _get_path_to_key_file():
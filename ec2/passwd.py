@@ -17,8 +17,6 @@
 import base64
 import binascii
 
-from Crypto.PublicKey import RSA
-
 from cloudify.exceptions import NonRecoverableError
 
 
@@ -57,6 +55,9 @@ def _decrypt_password(rsa_key, password):
 
 def get_windows_passwd(private_key_path, password_data):
 
+    # imported here, so that only Windows instances load pycrypto
+    from Crypto.PublicKey import RSA
+
     with open(private_key_path, 'r') as key_file:
         key_lines = key_file.readlines()
     try:
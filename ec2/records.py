@@ -0,0 +1,158 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import json
+import hashlib
+
+
+class ResourceRecord(object):
+    """A read-only snapshot of the few attributes that the plugin reads
+    from a boto resource. Records hold no reference to the boto object,
+    its connection, tags or nested sets, so they are cheap to keep around
+    while validating or cleaning up many resources.
+
+    Subclasses list the attributes to copy in __slots__. By default a slot
+    copies the boto attribute of the same name, sources maps a slot to
+    a dotted attribute path instead.
+    """
+
+    __slots__ = ()
+    sources = {}
+    label = None
+    label_field = 'id'
+
+    @classmethod
+    def from_resource(cls, resource):
+        """Returns a record of a boto resource.
+
+        :param resource: A boto object.
+        :returns a record of type cls.
+        """
+
+        record = cls.__new__(cls)
+
+        for field in cls.__slots__:
+            value = resource
+            for attribute in cls.sources.get(field, field).split('.'):
+                value = getattr(value, attribute, None)
+            object.__setattr__(record, field, value)
+
+        return record
+
+    @classmethod
+    def from_resources(cls, resources):
+        """Returns a list of records of boto resources.
+
+        :param resources: An iterable of boto objects.
+        :returns a list of records of type cls.
+        """
+
+        return [cls.from_resource(resource) for resource in resources]
+
+    @classmethod
+    def from_dict(cls, fields):
+        """Returns a record from the fields of to_dict, for example
+        after storing them in runtime properties.
+
+        :param fields: A dict of field names to values.
+        :returns a record of type cls.
+        """
+
+        record = cls.__new__(cls)
+
+        for field in cls.__slots__:
+            object.__setattr__(record, field, fields.get(field))
+
+        return record
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
+    @property
+    def etag(self):
+        """A digest of the fields of the record, which changes
+        whenever one of them does.
+        """
+
+        return hashlib.sha1(
+            json.dumps(self.to_dict(), sort_keys=True)).hexdigest()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            '{0} is a read-only snapshot.'.format(type(self).__name__))
+
+    def __repr__(self):
+        return '{0}:{1}'.format(self.label, getattr(self, self.label_field))
+
+
+class InstanceRecord(ResourceRecord):
+
+    __slots__ = ('id', 'state', 'state_code', 'image_id', 'key_name',
+                 'private_ip_address', 'ip_address',
+                 'private_dns_name', 'public_dns_name',
+                 'vpc_id', 'subnet_id', 'placement')
+    label = 'Instance'
+
+
+class ImageRecord(ResourceRecord):
+
+    __slots__ = ('id', 'name', 'state', 'owner_id', 'architecture',
+                 'virtualization_type', 'hypervisor', 'platform',
+                 'root_device_type', 'root_device_name')
+    label = 'Image'
+
+
+class VolumeRecord(ResourceRecord):
+
+    __slots__ = ('id', 'status', 'zone', 'size', 'snapshot_id',
+                 'instance_id', 'device', 'attachment_status')
+    sources = {
+        'instance_id': 'attach_data.instance_id',
+        'device': 'attach_data.device',
+        'attachment_status': 'attach_data.status'
+    }
+    label = 'Volume'
+
+
+class SecurityGroupRecord(ResourceRecord):
+
+    __slots__ = ('id', 'name', 'vpc_id')
+    label = 'SecurityGroup'
+    label_field = 'name'
+
+
+class AddressRecord(ResourceRecord):
+
+    __slots__ = ('public_ip', 'allocation_id', 'association_id',
+                 'instance_id', 'domain')
+    label = 'Address'
+    label_field = 'public_ip'
+
+
+class VpcResourceRecord(ResourceRecord):
+    """A record of any VPC resource: VPCs, subnets, route tables,
+    gateways, network ACLs, DHCP options and peering connections.
+    """
+
+    __slots__ = ('id', 'resource_type', 'vpc_id', 'cidr_block',
+                 'availability_zone', 'state', 'dhcp_options_id')
+    sources = {
+        'resource_type': '__class__.__name__'
+    }
+
+    @property
+    def label(self):
+        return self.resource_type
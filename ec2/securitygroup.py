@@ -21,6 +21,7 @@ from boto import exception
 
 # Cloudify imports
 from ec2 import utils
+from ec2 import records
 from ec2 import constants
 from ec2 import connection
 from cloudify import ctx
@@ -37,7 +38,7 @@ def creation_validation(**_):
         utils.validate_node_property(property_key, ctx.node.properties)
 
     security_group = _get_security_group_from_id(
-        utils.get_resource_id())
+        utils.get_resource_id(), snapshot=True)
 
     if ctx.node.properties['use_external_resource'] and not security_group:
         raise NonRecoverableError(
@@ -153,15 +154,17 @@ def _delete_security_group(group_id):
     """Tries to delete a Security group
     """
 
-    group_to_delete = _get_security_group_from_id(group_id)
+    group_to_delete = _get_security_group_from_id(group_id, snapshot=True)
 
     if not group_to_delete:
         raise NonRecoverableError(
             'Unable to delete security group {0}, because the group '
             'does not exist in the account'.format(group_id))
 
+    ec2_client = connection.EC2ConnectionClient().client()
+
     try:
-        group_to_delete.delete()
+        ec2_client.delete_security_group(group_id=group_to_delete.id)
     except (exception.EC2ResponseError,
             exception.BotoServerError) as e:
         raise NonRecoverableError('{0}'.format(str(e)))
@@ -225,7 +228,7 @@ def _create_external_securitygroup(name):
     if not utils.use_external_resource(ctx.node.properties):
         return False
 
-    group = _get_security_group_from_id(name)
+    group = _get_security_group_from_id(name, snapshot=True)
     if not group:
         raise NonRecoverableError(
             'External security group was indicated, but the given '
@@ -254,51 +257,56 @@ def _delete_external_securitygroup():
     return True
 
 
-def _get_security_group_from_id(group_id):
+def _get_security_group_from_id(group_id, snapshot=False):
     """Returns the security group object for a given security group id.
 
     :param group_id: The ID of a security group.
+    :param snapshot: Return a SecurityGroupRecord instead of the boto object.
     :returns The boto security group object.
     """
 
     if not re.match('^sg\-[0-9a-z]{8}$', group_id):
-        group = _get_security_group_from_name(group_id)
+        group = _get_security_group_from_name(group_id, snapshot=snapshot)
         return group
 
-    group = _get_all_security_groups(list_of_group_ids=group_id)
+    group = _get_all_security_groups(
+        list_of_group_ids=group_id, snapshot=snapshot)
 
     return group[0] if group else group
 
 
-def _get_security_group_from_name(group_name):
+def _get_security_group_from_name(group_name, snapshot=False):
     """Returns the security group object for a given group name.
 
     :param group_name: The name of a security group.
+    :param snapshot: Return a SecurityGroupRecord instead of the boto object.
     :returns The boto security group object.
     """
 
     if re.match('^sg\-[0-9a-z]{8}$', group_name):
-        group = _get_security_group_from_id(group_name)
+        group = _get_security_group_from_id(group_name, snapshot=snapshot)
         return group
 
-    group = _get_all_security_groups(list_of_group_names=group_name)
+    group = _get_all_security_groups(
+        list_of_group_names=group_name, snapshot=snapshot)
 
     return group[0] if group else group
 
 
 def _get_vpc_security_group_from_name(name):
-    groups = _get_all_security_groups()
-    for group in groups:
-        if group.name == name:
-            return group
-    return None
+    groups = _get_all_security_groups(filters={'group-name': name})
+    return utils.find_resource(groups or [], lambda group: group.name == name)
 
 
-def _get_all_security_groups(list_of_group_names=None, list_of_group_ids=None):
+def _get_all_security_groups(list_of_group_names=None, list_of_group_ids=None,
+                             filters=None, snapshot=False):
     """Returns a list of security groups for a given list of group names and IDs.
 
     :param list_of_group_names: A list of security group names.
     :param list_of_group_ids: A list of security group IDs.
+    :param filters: Server-side filters for DescribeSecurityGroups.
+    :param snapshot: Return SecurityGroupRecord snapshots instead of boto
+        objects.
     :returns A list of security group objects.
     :raises NonRecoverableError: If Boto errors.
     """
@@ -306,15 +314,20 @@ def _get_all_security_groups(list_of_group_names=None, list_of_group_ids=None):
     ec2_client = connection.EC2ConnectionClient().client()
 
     try:
-        groups = ec2_client.get_all_security_groups(
+        groups = list(utils.describe_resources(
+            ec2_client.get_all_security_groups,
             groupnames=list_of_group_names,
-            group_ids=list_of_group_ids)
+            group_ids=list_of_group_ids,
+            filters=filters))
     except exception.EC2ResponseError as e:
         if 'InvalidGroup.NotFound' in e:
-            groups = ec2_client.get_all_security_groups()
-            utils.log_available_resources(groups)
+            utils.log_available_resources(
+                utils.describe_resources(ec2_client.get_all_security_groups))
         return None
     except exception.BotoServerError as e:
         raise NonRecoverableError('{0}'.format(str(e)))
 
+    if snapshot:
+        return records.SecurityGroupRecord.from_resources(groups)
+
     return groups
@@ -14,6 +14,8 @@
 #    * limitations under the License.
 
 # Built-in Imports
+import uuid
+import mock
 import testtools
 
 # Third Party Imports
@@ -26,7 +28,7 @@ from ec2 import constants
 from cloudify.state import current_ctx
 from cloudify.mocks import MockContext
 from cloudify.mocks import MockCloudifyContext
-from cloudify.exceptions import NonRecoverableError
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 
 TEST_AMI_IMAGE_ID = 'ami-e214778a'
 TEST_INSTANCE_TYPE = 't1.micro'
@@ -54,6 +56,7 @@ class TestEBS(testtools.TestCase):
 
         ctx = MockCloudifyContext(
             node_id=test_node_id,
+            deployment_id=str(uuid.uuid4()),
             properties=test_properties
         )
 
@@ -150,6 +153,10 @@ class TestEBS(testtools.TestCase):
         args = dict()
         ebs.create(args, ctx=ctx)
         self.assertIn('aws_resource_id', ctx.instance.runtime_properties)
+        ec2_client = self.get_client()
+        volume = ec2_client.get_all_volumes(
+            [ctx.instance.runtime_properties['aws_resource_id']])[0]
+        self.assertEqual(ctx.deployment.id, volume.tags['deployment_id'])
 
     @mock_ec2
     def test_create_with_zone(self):
@@ -526,3 +533,198 @@ class TestEBS(testtools.TestCase):
         self.assertIn(
             constants.VOLUME_SNAPSHOT_ATTRIBUTE,
             ctx.instance.runtime_properties)
+
+    @mock_ec2
+    def test_attach_confirms_attachment(self):
+        """ Tests that attach only returns once the volume is
+            attached to the target instance.
+        """
+
+        ctx = self.mock_relationship_context('test_attach_confirms')
+        current_ctx.set(ctx=ctx)
+        volume = self.get_volume()
+        instance_id = self.get_instance_id()
+        ctx.source.instance.runtime_properties['aws_resource_id'] = \
+            volume.id
+        ctx.target.instance.runtime_properties['placement'] = \
+            TEST_ZONE
+        ctx.target.instance.runtime_properties['aws_resource_id'] = \
+            instance_id
+        ebs.attach(ctx=ctx)
+        self.assertEqual(
+            instance_id,
+            ctx.source.instance.runtime_properties['instance_id'])
+        volume.update()
+        self.assertEqual(instance_id, volume.attach_data.instance_id)
+
+    @mock_ec2
+    def test_attach_volume_in_use_elsewhere(self):
+        """ Tests that attach refuses a volume attached to
+            another instance.
+        """
+
+        ctx = self.mock_relationship_context('test_attach_in_use')
+        current_ctx.set(ctx=ctx)
+        volume = self.get_volume()
+        volume.attach(self.get_instance_id(), TEST_DEVICE)
+        ctx.source.instance.runtime_properties['aws_resource_id'] = \
+            volume.id
+        ctx.target.instance.runtime_properties['placement'] = \
+            TEST_ZONE
+        ctx.target.instance.runtime_properties['aws_resource_id'] = \
+            self.get_instance_id()
+        ex = self.assertRaises(NonRecoverableError, ebs.attach, ctx=ctx)
+        self.assertIn('because it is in state in-use', ex.message)
+
+    @mock_ec2
+    def test_detach_available_volume(self):
+        """ Tests that detaching a volume that is already
+            available succeeds without calling EC2.
+        """
+
+        ctx = self.mock_relationship_context('test_detach_available')
+        current_ctx.set(ctx=ctx)
+        volume = self.get_volume()
+        instance_id = self.get_instance_id()
+        ctx.source.instance.runtime_properties['aws_resource_id'] = \
+            volume.id
+        ctx.source.instance.runtime_properties['instance_id'] = \
+            instance_id
+        ctx.target.instance.runtime_properties['aws_resource_id'] = \
+            instance_id
+        ebs.detach(dict(), ctx=ctx)
+        self.assertNotIn(
+            'instance_id', ctx.source.instance.runtime_properties)
+
+    @mock_ec2
+    @mock.patch('ec2.constants.MAX_CONCURRENT_REQUESTS', 1)
+    def test_snapshot_retention(self):
+        """ Tests that snapshots beyond the retention count
+            are deleted.
+        """
+
+        ctx = self.mock_ctx('test_snapshot_retention')
+        current_ctx.set(ctx=ctx)
+        ebs.create(dict(), ctx=ctx)
+        for _ in range(3):
+            current_ctx.set(ctx=ctx)
+            ebs.create_snapshot(dict(), retention=2,
+                                wait_for_completion=True, ctx=ctx)
+        volume_id = ctx.instance.runtime_properties['aws_resource_id']
+        snapshots = self.get_client().get_all_snapshots(
+            filters={'volume-id': volume_id})
+        self.assertEqual(2, len(snapshots))
+        self.assertEqual(
+            sorted(snapshot.id for snapshot in snapshots),
+            sorted(ctx.instance.runtime_properties[
+                constants.VOLUME_SNAPSHOT_ATTRIBUTE]))
+        self.assertNotIn(constants.VOLUME_PENDING_SNAPSHOTS,
+                         ctx.instance.runtime_properties)
+
+    @mock_ec2
+    @mock.patch('ec2.constants.MAX_CONCURRENT_REQUESTS', 1)
+    def test_snapshot_retention_counts_pending(self):
+        """ Tests that a snapshot still pending counts toward
+            the retention count.
+        """
+
+        ctx = self.mock_ctx('test_snapshot_retention_counts_pending')
+        current_ctx.set(ctx=ctx)
+        ebs.create(dict(), ctx=ctx)
+        for _ in range(3):
+            current_ctx.set(ctx=ctx)
+            ebs.create_snapshot(dict(), ctx=ctx)
+        volume_id = ctx.instance.runtime_properties['aws_resource_id']
+        completed_snapshot_ids = \
+            ctx.instance.runtime_properties[
+                constants.VOLUME_SNAPSHOT_ATTRIBUTE][:]
+
+        current_ctx.set(ctx=ctx)
+        ebs._prune_snapshots({volume_id: 'snap-12345678'}, 2)
+        snapshots = self.get_client().get_all_snapshots(
+            filters={'volume-id': volume_id})
+        self.assertEqual(1, len(snapshots))
+        self.assertIn(snapshots[0].id, completed_snapshot_ids)
+
+    @mock_ec2
+    @mock.patch('ec2.constants.MAX_CONCURRENT_REQUESTS', 1)
+    def test_snapshot_pending_state(self):
+        """ Tests that snapshots left pending by another execution,
+            deleted, or failed, are not waited for again.
+        """
+
+        ctx = self.mock_ctx('test_snapshot_pending_state')
+        current_ctx.set(ctx=ctx)
+        ebs.create(dict(), ctx=ctx)
+        volume_id = ctx.instance.runtime_properties['aws_resource_id']
+        runtime_properties = ctx.instance.runtime_properties
+
+        # left by an earlier execution, so a new snapshot is created
+        runtime_properties[constants.VOLUME_PENDING_SNAPSHOTS] = \
+            {volume_id: 'snap-12345678'}
+        runtime_properties[constants.VOLUME_PENDING_SNAPSHOTS_EXECUTION] = \
+            'earlier_execution'
+        current_ctx.set(ctx=ctx)
+        ebs.create_snapshot(dict(), wait_for_completion=True, ctx=ctx)
+        self.assertEqual(
+            1, len(runtime_properties[constants.VOLUME_SNAPSHOT_ATTRIBUTE]))
+        self.assertNotIn(constants.VOLUME_PENDING_SNAPSHOTS,
+                         runtime_properties)
+        self.assertNotIn(constants.VOLUME_PENDING_SNAPSHOTS_EXECUTION,
+                         runtime_properties)
+
+        # deleted outside the plugin, so it is created again on retry
+        runtime_properties[constants.VOLUME_PENDING_SNAPSHOTS] = \
+            {volume_id: 'snap-12345678'}
+        runtime_properties[constants.VOLUME_PENDING_SNAPSHOTS_EXECUTION] = \
+            ctx.execution_id
+        current_ctx.set(ctx=ctx)
+        with mock.patch('ec2.ebs._create_snapshots') as create_snapshots:
+            self.assertRaises(
+                OperationRetry, ebs.create_snapshot, dict(),
+                wait_for_completion=True, ctx=ctx)
+        self.assertFalse(create_snapshots.called)
+        self.assertNotIn(constants.VOLUME_PENDING_SNAPSHOTS,
+                         runtime_properties)
+
+        # failed, so the error is not raised again by the next run
+        def get_failed_snapshots(snapshot_ids=None, **_):
+            return [mock.Mock(id=snapshot_id, volume_id=volume_id,
+                              status=constants.SNAPSHOT_ERROR)
+                    for snapshot_id in snapshot_ids]
+
+        current_ctx.set(ctx=ctx)
+        with mock.patch('boto.ec2.connection.EC2Connection'
+                        '.get_all_snapshots',
+                        side_effect=get_failed_snapshots):
+            self.assertRaises(
+                NonRecoverableError, ebs.create_snapshot, dict(),
+                wait_for_completion=True, ctx=ctx)
+        self.assertNotIn(constants.VOLUME_PENDING_SNAPSHOTS,
+                         runtime_properties)
+
+    @mock_ec2
+    @mock.patch('ec2.constants.MAX_CONCURRENT_REQUESTS', 1)
+    def test_snapshot_instance_volumes(self):
+        """ Tests that all the volumes attached to an instance
+            are snapshotted together.
+        """
+
+        ctx = self.mock_ctx('test_snapshot_instance_volumes')
+        current_ctx.set(ctx=ctx)
+        instance_id = self.get_instance_id()
+        volumes = [self.get_volume() for _ in range(2)]
+        for index, volume in enumerate(volumes):
+            volume.attach(instance_id, '/dev/sdf{0}'.format(index))
+        detached_volume = self.get_volume()
+        ctx.instance.runtime_properties['aws_resource_id'] = instance_id
+        ebs.snapshot_instance_volumes(wait_for_completion=True, ctx=ctx)
+        snapshots = self.get_client().get_all_snapshots(
+            filters={'tag:deployment_id': ctx.deployment.id})
+        snapshot_volume_ids = [snapshot.volume_id for snapshot in snapshots]
+        for volume in volumes:
+            self.assertIn(volume.id, snapshot_volume_ids)
+        self.assertNotIn(detached_volume.id, snapshot_volume_ids)
+        self.assertEqual(
+            len(snapshots), len(ctx.instance.runtime_properties[
+                constants.VOLUME_SNAPSHOT_ATTRIBUTE]))
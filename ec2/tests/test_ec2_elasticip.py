@@ -14,6 +14,8 @@
 #    * limitations under the License.
 
 # Built-in Imports
+import time
+import mock
 import testtools
 
 # Third Party Imports
@@ -344,6 +346,37 @@ class TestElasticIP(testtools.TestCase):
             instance_id
         elasticip.associate(ctx=ctx)
 
+    @mock_ec2
+    def test_vpc_association_id_is_kept(self):
+        """ Tests that the association ID returned by associate is
+            used by disassociate, without describing the address.
+        """
+
+        ctx = self.mock_relationship_context('test_vpc_association_id')
+        current_ctx.set(ctx=ctx)
+        client = self.get_client()
+        address = client.allocate_address(domain=constants.VPC_DOMAIN)
+        instance_id = self.get_instance_id()
+        ctx.target.instance.runtime_properties['aws_resource_id'] = \
+            address.public_ip
+        ctx.target.instance.runtime_properties['allocation_id'] = \
+            address.allocation_id
+        ctx.source.instance.runtime_properties['aws_resource_id'] = \
+            instance_id
+        elasticip.associate(ctx=ctx)
+        self.assertIn(constants.ASSOCIATION_ID,
+                      ctx.target.instance.runtime_properties)
+
+        current_ctx.set(ctx=ctx)
+        with mock.patch('ec2.elasticip._get_address_object_by_id') as get:
+            elasticip.disassociate(ctx=ctx)
+        self.assertFalse(get.called)
+        self.assertNotIn(constants.ASSOCIATION_ID,
+                         ctx.target.instance.runtime_properties)
+        self.assertFalse(
+            client.get_all_addresses(addresses=[address.public_ip])[0]
+            .instance_id)
+
     @mock_ec2
     def test_good_address_disassociate(self):
         """ Tests that disassociate runs when clean. """
@@ -554,3 +587,127 @@ class TestElasticIP(testtools.TestCase):
         output = \
             elasticip._disassociate_external_elasticip_or_instance()
         self.assertEqual(False, output)
+
+    def mock_pool_ctx(self, test_name, pool_preallocate=0):
+
+        test_properties = {
+            constants.AWS_CONFIG_PROPERTY: {},
+            'use_external_resource': False,
+            'resource_id': '',
+            'domain': '',
+            constants.ELASTIC_IP_POOL_PROPERTY: 'pool',
+            constants.ELASTIC_IP_POOL_PREALLOCATE_PROPERTY: pool_preallocate
+        }
+
+        return MockCloudifyContext(
+            node_id=test_name,
+            deployment_id='test_deployment',
+            properties=test_properties,
+            provider_context={'resources': {}}
+        )
+
+    @mock_ec2
+    @mock.patch('ec2.constants.POOL_LEASE_SETTLE_TIME', 0)
+    @mock.patch('ec2.constants.MAX_CONCURRENT_REQUESTS', 1)
+    def test_pool_reuses_released_addresses(self):
+        """ This tests that addresses of a pool are preallocated,
+        returned to the pool on release and claimed again.
+        """
+
+        client = self.get_client()
+        ctx = self.mock_pool_ctx('test_pool', pool_preallocate=1)
+        current_ctx.set(ctx=ctx)
+        elasticip.allocate(ctx=ctx)
+        allocated = set(address.allocation_id
+                        for address in client.get_all_addresses())
+        self.assertEqual(2, len(allocated))
+        self.assertIn(ctx.instance.runtime_properties['allocation_id'],
+                      allocated)
+
+        current_ctx.set(ctx=ctx)
+        elasticip.release(ctx=ctx)
+        self.assertNotIn('aws_resource_id',
+                         ctx.instance.runtime_properties)
+
+        claimed = []
+        for index in range(2):
+            ctx = self.mock_pool_ctx('test_pool_{0}'.format(index))
+            current_ctx.set(ctx=ctx)
+            elasticip.allocate(ctx=ctx)
+            claimed.append(ctx.instance.runtime_properties['allocation_id'])
+
+        self.assertEqual(allocated, set(claimed))
+        self.assertEqual(
+            allocated,
+            set(address.allocation_id
+                for address in client.get_all_addresses()))
+        self.assertEqual(
+            [constants.POOL_STATE_LEASED] * 2,
+            [tag.value for tag in client.get_all_tags(
+                filters={'key': constants.POOL_STATE_TAG})])
+
+    @mock_ec2
+    @mock.patch('ec2.constants.POOL_LEASE_SETTLE_TIME', 0)
+    @mock.patch('ec2.constants.MAX_CONCURRENT_REQUESTS', 1)
+    def test_pool_preallocation_failure(self):
+        """ This tests that a failed preallocation keeps the claimed
+        address recorded, so that release returns it to the pool.
+        """
+
+        ctx = self.mock_pool_ctx('test_pool_preallocation_failure',
+                                 pool_preallocate=2)
+        current_ctx.set(ctx=ctx)
+        allocate_into_pool = elasticip._allocate_into_pool
+        calls = []
+
+        def allocate_or_fail(*args):
+            calls.append(args)
+            if len(calls) > 1:
+                raise NonRecoverableError('AddressLimitExceeded')
+            return allocate_into_pool(*args)
+
+        with mock.patch('ec2.elasticip._allocate_into_pool',
+                        side_effect=allocate_or_fail):
+            elasticip.allocate(ctx=ctx)
+        self.assertEqual(3, len(calls))
+        allocation_id = ctx.instance.runtime_properties['allocation_id']
+        self.assertIn('aws_resource_id', ctx.instance.runtime_properties)
+
+        current_ctx.set(ctx=ctx)
+        elasticip.release(ctx=ctx)
+        self.assertEqual(
+            [constants.POOL_STATE_FREE],
+            [tag.value for tag in self.get_client().get_all_tags(
+                filters={'key': constants.POOL_STATE_TAG,
+                         'resource-id': allocation_id})])
+
+        # an address that was never recorded is not returned
+        current_ctx.set(ctx=ctx)
+        ctx.instance.runtime_properties['aws_resource_id'] = '1.2.3.4'
+        elasticip.release(ctx=ctx)
+        self.assertNotIn('aws_resource_id', ctx.instance.runtime_properties)
+
+    @mock_ec2
+    @mock.patch('ec2.constants.POOL_LEASE_SETTLE_TIME', 0)
+    def test_pool_lease_conflict(self):
+        """ This tests that a claim gives way to an earlier lease
+        of the same address.
+        """
+
+        client = self.get_client()
+        ctx = self.mock_pool_ctx('test_pool_lease_conflict')
+        current_ctx.set(ctx=ctx)
+        address = client.allocate_address(domain=constants.VPC_DOMAIN)
+        client.create_tags([address.allocation_id], {
+            constants.POOL_TAG: 'pool',
+            constants.POOL_STATE_TAG: constants.POOL_STATE_FREE,
+            constants.POOL_LEASE_TAG_PREFIX + 'other': repr(time.time() - 1)
+        })
+
+        self.assertFalse(elasticip._lease_pooled_address(
+            client, address.allocation_id))
+        self.assertEqual(
+            [constants.POOL_LEASE_TAG_PREFIX + 'other'],
+            [tag.name for tag in client.get_all_tags(
+                filters={'resource-id': address.allocation_id})
+             if tag.name.startswith(constants.POOL_LEASE_TAG_PREFIX)])
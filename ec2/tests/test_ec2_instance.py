@@ -14,6 +14,7 @@
 #    * limitations under the License.
 
 # Built-in Imports
+import time
 import testtools
 import tempfile
 import uuid
@@ -24,6 +25,7 @@ import mock
 from boto.vpc import VPCConnection
 
 # Cloudify Imports is imported and used in operations
+from ec2 import images
 from ec2 import constants
 from ec2 import connection
 from ec2 import instance
@@ -216,6 +218,79 @@ class TestInstance(testtools.TestCase):
         self.assertIn('aws_resource_id',
                       ctx.instance.runtime_properties.keys())
 
+    @mock_ec2
+    def test_run_instances_caches_launch_attributes(self):
+        """ this tests that the attributes returned by RunInstances
+        are served without describing the instance
+        """
+
+        ctx = self.mock_ctx('test_run_instances_caches_launch_attributes')
+        current_ctx.set(ctx=ctx)
+        with mock.patch('ec2.instance._get_all_instances') as describe:
+            instance.run_instances(ctx=ctx)
+            current_ctx.set(ctx=ctx)
+            private_ip_address = \
+                instance._get_instance_attribute('private_ip_address')
+        self.assertFalse(describe.called)
+        launch_attributes = \
+            ctx.instance.runtime_properties[constants.INSTANCE_LAUNCH_CACHE]
+        self.assertEquals(
+            ctx.instance.runtime_properties['aws_resource_id'],
+            launch_attributes['id'])
+        self.assertEquals(launch_attributes['private_ip_address'],
+                          private_ip_address)
+        self.assertEquals(launch_attributes['placement'],
+                          ctx.instance.runtime_properties['placement'])
+
+    @mock_ec2
+    def test_empty_launch_attributes_are_described(self):
+        """ this tests that an address missing from the launch
+        response is described instead of cached as final
+        """
+
+        ctx = self.mock_ctx('test_empty_launch_attributes_are_described')
+        current_ctx.set(ctx=ctx)
+        launched = mock.Mock(id='i-4a2f5e3c', private_ip_address='',
+                             private_dns_name=None, vpc_id=None,
+                             subnet_id=None, placement='us-east-1a')
+        instance._cache_launch_attributes(launched)
+        launch_attributes = \
+            ctx.instance.runtime_properties[constants.INSTANCE_LAUNCH_CACHE]
+        self.assertNotIn('private_ip_address', launch_attributes)
+        self.assertNotIn('private_dns_name', launch_attributes)
+        self.assertIn('vpc_id', launch_attributes)
+
+        ctx.instance.runtime_properties['aws_resource_id'] = 'i-4a2f5e3c'
+        described = mock.Mock(private_ip_address='10.0.0.7')
+        with mock.patch('ec2.instance._get_instance_from_id',
+                        return_value=described) as describe:
+            self.assertEquals(
+                '10.0.0.7',
+                instance._get_instance_attribute('private_ip_address'))
+            self.assertEquals(
+                'us-east-1a', instance._get_instance_attribute('placement'))
+        self.assertEquals(1, describe.call_count)
+
+    @mock_ec2
+    def test_post_create_properties_describe_once(self):
+        """ this tests that runtime properties missing from the launch
+        response are read with a single describe
+        """
+
+        ctx = self.mock_ctx('test_post_create_properties_describe_once')
+        current_ctx.set(ctx=ctx)
+        instance.run_instances(ctx=ctx)
+        current_ctx.set(ctx=ctx)
+        launch_attributes = \
+            ctx.instance.runtime_properties[constants.INSTANCE_LAUNCH_CACHE]
+        del launch_attributes['vpc_id']
+        del launch_attributes['placement']
+        with mock.patch('ec2.instance._get_all_instances',
+                        wraps=instance._get_all_instances) as describe:
+            instance._instance_created_assign_runtime_properties()
+        self.assertEquals(1, describe.call_count)
+        self.assertIn('placement', ctx.instance.runtime_properties)
+
     @mock_ec2
     def test_with_userdata_clean(self):
         """ this tests that handle user data returns the expected output
@@ -379,6 +454,64 @@ class TestInstance(testtools.TestCase):
         state = instance_object.update()
         self.assertEqual(state, 'running')
 
+    @mock_ec2
+    @mock.patch('ec2.constants.MAX_CONCURRENT_REQUESTS', 1)
+    def test_start_provisions_volumes(self):
+        """ this tests that start creates and attaches the volumes
+        listed in the volumes property, and that they are deleted
+        with the instance.
+        """
+
+        ctx = self.mock_ctx('test_start_provisions_volumes')
+        ctx.node.properties[constants.INSTANCE_VOLUMES_PROPERTY] = [
+            {'device': '/dev/sdf', 'size': 1},
+            {'device': '/dev/sdg', 'size': 2, 'volume_type': 'gp2'}
+        ]
+        current_ctx.set(ctx=ctx)
+
+        ec2_client = connection.EC2ConnectionClient().client()
+        reservation = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, instance_type=TEST_INSTANCE_TYPE,
+            placement=TEST_AVAILABILITY_ZONE)
+        instance_id = reservation.instances[0].id
+        ctx.instance.runtime_properties['aws_resource_id'] = instance_id
+        ctx.instance.runtime_properties['placement'] = \
+            TEST_AVAILABILITY_ZONE
+        instance.start(ctx=ctx)
+
+        volume_ids = \
+            ctx.instance.runtime_properties[constants.INSTANCE_VOLUME_IDS]
+        self.assertEquals(['/dev/sdf', '/dev/sdg'], sorted(volume_ids))
+        volumes = ec2_client.get_all_volumes(volume_ids.values())
+        for volume in volumes:
+            self.assertEquals(instance_id, volume.attach_data.instance_id)
+            volume.detach()
+
+        current_ctx.set(ctx=ctx)
+        instance.terminate(ctx=ctx)
+        self.assertNotIn(constants.INSTANCE_VOLUME_IDS,
+                         ctx.instance.runtime_properties)
+        self.assertEquals(
+            [], ec2_client.get_all_volumes(
+                filters={'volume-id': volume_ids.values()}))
+
+    @mock_ec2
+    def test_get_instance_parameters_volumes_at_launch(self):
+        """ this tests that volumes are passed as a block device map
+        when volumes_at_launch is set.
+        """
+
+        ctx = self.mock_ctx('test_get_instance_parameters_volumes_at_launch')
+        ctx.node.properties[constants.INSTANCE_VOLUMES_PROPERTY] = [
+            {'device': '/dev/sdf', 'size': 1}
+        ]
+        ctx.node.properties[constants.INSTANCE_VOLUMES_AT_LAUNCH] = True
+        current_ctx.set(ctx=ctx)
+        parameters = instance._get_instance_parameters()
+        block_device = parameters['block_device_map']['/dev/sdf']
+        self.assertEquals(1, block_device.size)
+        self.assertTrue(block_device.delete_on_termination)
+
     @mock_ec2
     def test_terminate_clean(self):
         """ this tests that the instance.terminate function
@@ -605,6 +738,83 @@ class TestInstance(testtools.TestCase):
         self.assertIn('xyz', parameters['key_name'])
         self.assertIn('efg', parameters['instance_type'])
 
+    @mock_ec2
+    def test_get_instance_parameters_client_token(self):
+        """ This tests that the launch parameters carry a client token
+        that is stable across retries and honors a user supplied one.
+        """
+
+        ctx = self.mock_ctx('test_get_instance_parameters_client_token')
+        current_ctx.set(ctx=ctx)
+        client_token = instance._get_instance_parameters()['client_token']
+        self.assertEquals(client_token, instance._get_client_token())
+        self.assertEquals(
+            client_token,
+            instance._get_instance_parameters()['client_token'])
+
+        other_ctx = self.mock_ctx('test_get_instance_parameters_client_token')
+        current_ctx.set(ctx=other_ctx)
+        self.assertNotEqual(client_token, instance._get_client_token())
+
+        other_ctx.node.properties['parameters']['client_token'] = 'abc'
+        self.assertEquals(
+            'abc', instance._get_instance_parameters()['client_token'])
+
+    @mock_ec2
+    def test_run_instances_retry_client_token(self):
+        """ This tests that a retried launch found by its client token
+        records its reservation, and that the reservation lookup is
+        skipped when none is recorded.
+        """
+
+        ctx = self.mock_ctx('test_run_instances_retry_client_token')
+        ctx.operation._operation_context['retry_number'] = 1
+        current_ctx.set(ctx=ctx)
+        ec2_client = connection.EC2ConnectionClient().client()
+        self.assertIsNone(
+            instance._get_instances_from_reservation_id(ec2_client))
+
+        reservation = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, instance_type=TEST_INSTANCE_TYPE)
+        with mock.patch('ec2.instance._get_reservation_from_client_token',
+                        return_value=reservation):
+            self.assertEquals(
+                reservation.instances[0].id,
+                instance._run_instances_if_needed(
+                    ec2_client, instance._get_instance_parameters()))
+        self.assertEquals(
+            reservation.id, ctx.instance.runtime_properties['reservation_id'])
+
+    @mock_ec2
+    def test_get_instance_parameters_once_per_node(self):
+        """ This tests that the parameters shared by the instances of
+        a node are assembled once, and that each instance gets its own
+        copy with its own client token.
+        """
+
+        ctx = self.mock_ctx('test_get_instance_parameters_once_per_node')
+        current_ctx.set(ctx=ctx)
+
+        with mock.patch('ec2.instance._get_node_instance_parameters',
+                        wraps=instance._get_node_instance_parameters) \
+                as get_node_instance_parameters:
+            parameters = instance._get_instance_parameters()
+            parameters['security_group_ids'].append('sg-abcd1234')
+            ctx.instance._id = 'test_get_instance_parameters_once_per_node2'
+            other_parameters = instance._get_instance_parameters()
+
+            self.assertEquals(1, get_node_instance_parameters.call_count)
+            self.assertNotIn('sg-abcd1234',
+                             other_parameters['security_group_ids'])
+            self.assertNotEqual(parameters['client_token'],
+                                other_parameters['client_token'])
+
+            ctx.node.properties['instance_type'] = 'm3.medium'
+            self.assertEquals(
+                'm3.medium',
+                instance._get_instance_parameters()['instance_type'])
+            self.assertEquals(2, get_node_instance_parameters.call_count)
+
     @mock_ec2
     def test_creation_validation_image_id(self):
         """This tests that creation validation gets to image_id
@@ -621,6 +831,62 @@ class TestInstance(testtools.TestCase):
                 'Invalid id:'):
             instance.creation_validation(ctx=ctx)
 
+    @mock_ec2
+    def test_image_cache(self):
+        """This tests that validation caches the AMI on disk, and that
+        the cached AMI is used until its state expires.
+        """
+
+        ctx = self.mock_ctx('test_image_cache')
+        current_ctx.set(ctx=ctx)
+        ec2_client = connection.EC2ConnectionClient().client()
+        reservation = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, instance_type=TEST_INSTANCE_TYPE)
+        image_id = ec2_client.create_image(
+            reservation.instances[0].id, 'test_image_cache')
+        ctx.node.properties['image_id'] = image_id
+        work_dir = tempfile.mkdtemp()
+
+        with mock.patch.dict('os.environ', {
+                constants.AMI_CACHE_WORK_DIR_ENV_VAR_NAME: work_dir}):
+            instance.creation_validation(ctx=ctx)
+            current_ctx.set(ctx=ctx)
+            cache = images.ImageCache(ec2_client)
+            self.assertEqual(image_id, cache.get_cached(image_id).id)
+
+            with mock.patch('boto.ec2.connection.EC2Connection'
+                            '.get_all_images') as get_all_images:
+                instance.creation_validation(ctx=ctx)
+                current_ctx.set(ctx=ctx)
+                self.assertFalse(get_all_images.called)
+
+                with mock.patch('time.time', return_value=time.time() +
+                                constants.AMI_CACHE_STATE_TTL + 1):
+                    self.assertIsNone(cache.get_cached(image_id))
+                    self.assertIsNotNone(
+                        cache.get_cached(image_id, current_state=False))
+
+            self.assertEqual(
+                [image_id], images.ImageCache(ec2_client).prefetch(
+                    [image_id, image_id]).keys())
+
+            other_client = connection.EC2ConnectionClient().config_client(
+                dict(aws_access_key_id='other_access_key',
+                     aws_secret_access_key='other_secret_key'))
+            self.assertIsNone(
+                images.ImageCache(other_client).get_cached(image_id))
+
+        work_dir = tempfile.mkdtemp()
+
+        with mock.patch.dict('os.environ', {
+                constants.AMI_CACHE_WORK_DIR_ENV_VAR_NAME: work_dir}):
+            current_ctx.set(ctx=ctx)
+            instance.prefetch_images(image_ids=[image_id], ctx=ctx)
+            current_ctx.set(ctx=ctx)
+            self.assertEqual(
+                image_id,
+                images.ImageCache(ec2_client).get_cached(image_id).id)
+
     @mock_ec2
     def test_start_and_tag_name(self):
         """ this tests that the instance start function
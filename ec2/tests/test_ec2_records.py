@@ -0,0 +1,73 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import testtools
+
+# Third Party Imports
+import boto
+from moto import mock_ec2
+
+# Cloudify Imports is imported and used in operations
+from ec2 import records
+
+TEST_AMI_IMAGE_ID = 'ami-e214778a'
+TEST_ZONE = 'us-east-1a'
+
+
+class TestRecords(testtools.TestCase):
+
+    @mock_ec2
+    def test_instance_record(self):
+        ec2_client = boto.connect_ec2()
+        instance = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID).instances[0]
+        record = records.InstanceRecord.from_resource(instance)
+        self.assertEquals(instance.id, record.id)
+        self.assertEquals(instance.private_ip_address,
+                          record.private_ip_address)
+        self.assertEquals('Instance:{0}'.format(instance.id), repr(record))
+        self.assertFalse(hasattr(record, '__dict__'))
+
+    @mock_ec2
+    def test_volume_record_flattens_attach_data(self):
+        ec2_client = boto.connect_ec2()
+        instance = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, placement=TEST_ZONE).instances[0]
+        volume = ec2_client.create_volume(1, TEST_ZONE)
+        volume.attach(instance.id, '/dev/sdh')
+        volume.update()
+        record = records.VolumeRecord.from_resource(volume)
+        self.assertEquals(instance.id, record.instance_id)
+        self.assertEquals('/dev/sdh', record.device)
+        self.assertEquals(TEST_ZONE, record.zone)
+
+    @mock_ec2
+    def test_records_are_read_only(self):
+        ec2_client = boto.connect_ec2()
+        group = ec2_client.create_security_group('records', 'records')
+        record = records.SecurityGroupRecord.from_resource(group)
+        self.assertEquals('SecurityGroup:records', repr(record))
+        self.assertRaises(AttributeError, setattr, record, 'name', 'other')
+
+    @mock_ec2
+    def test_vpc_resource_record(self):
+        vpc_client = boto.connect_vpc()
+        vpc = vpc_client.create_vpc('10.10.0.0/16')
+        subnet = vpc_client.create_subnet(vpc.id, '10.10.10.0/24')
+        record = records.VpcResourceRecord.from_resource(subnet)
+        self.assertEquals(vpc.id, record.vpc_id)
+        self.assertEquals('10.10.10.0/24', record.cidr_block)
+        self.assertEquals('Subnet:{0}'.format(subnet.id), repr(record))
@@ -0,0 +1,142 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Import time of the operation and workflow entry points of the plugin.
+
+Every operation starts in a fresh agent process, so the modules loaded
+by importing its entry point are paid for on every operation. Run this
+module to print the import time of every entry point:
+
+    python -m ec2.tests.test_ec2_startup [runs]
+"""
+
+# Built-in Imports
+import os
+import re
+import sys
+import json
+import subprocess
+
+# Third-party Imports
+import testtools
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+PLUGIN_YAML = os.path.join(ROOT_DIR, 'plugin.yaml')
+
+# modules loaded on first use, and the entry points that may load them
+LAZY_MODULES = {
+    'boto.ec2.elb': ['ec2.elasticloadbalancer'],
+    'boto.vpc': [],
+    'Crypto.PublicKey.RSA': []
+}
+
+# only the modules loaded by the import itself are reported, and not
+# those the interpreter, or a sitecustomize, loaded before it
+MEASURE_IMPORT = (
+    'import sys, json, time\n'
+    'loaded = set(sys.modules)\n'
+    'start = time.time()\n'
+    'for module in sys.argv[1:]:\n'
+    '    __import__(module)\n'
+    'seconds = time.time() - start\n'
+    'print(json.dumps([seconds, sorted(set(sys.modules) - loaded)]))\n'
+)
+
+
+def get_entry_point_modules():
+    """Returns the modules of the operations and workflows of plugin.yaml.
+
+    :returns a sorted list of module names.
+    """
+
+    with open(PLUGIN_YAML) as plugin_yaml:
+        mappings = re.findall(
+            r':\s*aws\.([\w.]+)\.\w+\s*$',
+            plugin_yaml.read(), re.MULTILINE)
+
+    return sorted(set(mappings))
+
+
+def measure_import(*modules):
+    """Imports modules in a fresh interpreter, as an agent would.
+
+    :param modules: Module names, imported in order.
+    :returns the seconds the imports took and the set of modules they
+        loaded.
+    """
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT_DIR] + filter(None, [env.get('PYTHONPATH')]))
+
+    process = subprocess.Popen(
+        [sys.executable, '-c', MEASURE_IMPORT] + list(modules),
+        cwd=ROOT_DIR, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode:
+        raise RuntimeError(
+            'Importing {0} failed: {1}'.format(', '.join(modules), stderr))
+
+    seconds, loaded_modules = json.loads(stdout.splitlines()[-1])
+
+    return seconds, set(loaded_modules)
+
+
+class TestStartup(testtools.TestCase):
+
+    def test_entry_points_load_lazy_modules_on_first_use(self):
+        modules = get_entry_point_modules()
+        self.assertIn('ec2.instance', modules)
+        self.assertIn('vpc.gateway', modules)
+
+        # the entry points that may load no lazy module share one
+        # interpreter, the others get one each
+        allowed = set(
+            module for entry_points in LAZY_MODULES.values()
+            for module in entry_points)
+        groups = [[module for module in modules if module not in allowed]]
+        groups.extend([module] for module in sorted(allowed))
+
+        for group in groups:
+            _, loaded_modules = measure_import(*group)
+            for lazy_module, entry_points in LAZY_MODULES.items():
+                if not set(group) & set(entry_points):
+                    self.assertFalse(
+                        lazy_module in loaded_modules,
+                        '{0} loads {1}'.format(', '.join(group),
+                                               lazy_module))
+
+
+def main(runs=5):
+    """Prints the median import time of every entry point."""
+
+    modules = get_entry_point_modules()
+    timings = dict((module, []) for module in modules)
+
+    # one import at a time, so that they do not compete for the CPU
+    for _ in range(runs):
+        for module in modules:
+            seconds, _ = measure_import(module)
+            timings[module].append(seconds)
+
+    for module in modules:
+        seconds = sorted(timings[module])[len(timings[module]) // 2]
+        print('{0:<32}{1:>8.1f} ms'.format(module, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
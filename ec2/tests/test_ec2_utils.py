@@ -20,11 +20,13 @@ import testtools
 # Third Party Imports
 from moto import mock_ec2
 from boto.ec2 import EC2Connection
+from boto.resultset import ResultSet
 
 # Cloudify Imports is imported and used in operations
 from ec2 import utils
 from ec2 import constants
 from cloudify.state import current_ctx
+from cloudify.mocks import MockContext
 from cloudify.mocks import MockCloudifyContext
 from cloudify.exceptions import NonRecoverableError
 
@@ -253,6 +255,39 @@ class TestUtils(testtools.TestCase):
             constants.EXTERNAL_RESOURCE_ID,
             ctx.instance.runtime_properties)
 
+    def test_runtime_property_stage(self):
+
+        ctx = self.mock_ctx('test_runtime_property_stage')
+        current_ctx.set(ctx=ctx)
+        ctx.instance.runtime_properties.update({
+            'vpc_id': 'vpc-1',
+            'routes': [{'destination_cidr_block': '10.0.0.0/16',
+                        'gateway_id': 'igw-1'}]
+        })
+
+        with utils.RuntimePropertyStage(ctx.instance) as runtime_properties:
+            runtime_properties['subnet_id'] = 'subnet-1'
+            runtime_properties.unset('vpc_id', 'missing')
+            routes = runtime_properties.list('routes')
+            self.assertFalse(routes.add({'gateway_id': 'igw-1',
+                                         'destination_cidr_block':
+                                         '10.0.0.0/16'}))
+            self.assertTrue(routes.add({'destination_cidr_block':
+                                        '10.1.0.0/16',
+                                        'gateway_id': 'igw-1'}))
+            self.assertIsNone(runtime_properties.get('vpc_id'))
+            self.assertEquals(2, len(runtime_properties['routes']))
+            self.assertIn('vpc_id', ctx.instance.runtime_properties)
+            self.assertNotIn('subnet_id', ctx.instance.runtime_properties)
+
+        self.assertEquals(
+            {'subnet_id': 'subnet-1',
+             'routes': [{'destination_cidr_block': '10.0.0.0/16',
+                         'gateway_id': 'igw-1'},
+                        {'destination_cidr_block': '10.1.0.0/16',
+                         'gateway_id': 'igw-1'}]},
+            ctx.instance.runtime_properties)
+
     @mock_ec2
     def test_utils_use_external_resource_not_external(self):
 
@@ -291,3 +326,124 @@ class TestUtils(testtools.TestCase):
             ctx.instance)
 
         self.assertEquals(0, len(output))
+
+    def test_relationship_index(self):
+
+        def relationship(relationship_type, resource_id, aws_type=None,
+                         type_hierarchy=None):
+            return MockContext({
+                'type': relationship_type,
+                'type_hierarchy': type_hierarchy or [relationship_type],
+                'target': MockContext({
+                    'node': MockContext({'id': resource_id}),
+                    'instance': MockContext({
+                        'runtime_properties': {
+                            constants.EXTERNAL_RESOURCE_ID: resource_id,
+                            constants.AWS_TYPE_PROPERTY: aws_type
+                        }
+                    })
+                })
+            })
+
+        security_group_type = 'cloudify.aws.relationships.' \
+            'instance_connected_to_security_group'
+        ctx = self.mock_ctx('test_relationship_index')
+        ctx.instance.relationships = [
+            relationship(security_group_type, 'sg-1', 'group'),
+            relationship(security_group_type, 'sg-2', 'group'),
+            relationship('my.relationships.instance_in_web_group', 'sg-3',
+                         'group', ['my.relationships.instance_in_web_group',
+                                   security_group_type]),
+            relationship('cloudify.aws.relationships.'
+                         'instance_connected_to_keypair', 'kp-1', 'keypair')
+        ]
+        current_ctx.set(ctx=ctx)
+
+        index = utils.get_relationship_index(ctx.instance)
+        self.assertIs(index, utils.get_relationship_index(ctx.instance))
+        self.assertNotIn('_relationship_index', vars(ctx.instance))
+        self.assertEquals(
+            ['sg-1', 'sg-2', 'sg-3'],
+            index.get_target_ids(security_group_type))
+        # the targets are not read until they are looked up by AWS type
+        self.assertIsNone(index._by_aws_type)
+        self.assertEquals(
+            ['sg-1', 'sg-2', 'sg-3'],
+            utils.get_target_external_resource_ids(
+                constants.INSTANCE_SECURITY_GROUP_RELATIONSHIP,
+                ctx.instance))
+        self.assertEquals(
+            {constants.INSTANCE_KEYPAIR_RELATIONSHIP: ['kp-1'],
+             constants.INSTANCE_SUBNET_RELATIONSHIP: []},
+            utils.get_target_external_resource_ids_by_type(
+                [constants.INSTANCE_KEYPAIR_RELATIONSHIP,
+                 constants.INSTANCE_SUBNET_RELATIONSHIP], ctx.instance))
+        self.assertEquals(
+            ['sg-1', 'sg-2', 'sg-3'],
+            [node.id for node in
+             utils.get_connected_nodes_by_type(ctx, 'group')])
+
+        # the next operation builds its own index
+        other_ctx = self.mock_ctx('test_relationship_index')
+        other_ctx.instance.relationships = ctx.instance.relationships
+        current_ctx.set(ctx=other_ctx)
+        self.assertIsNot(
+            index, utils.get_relationship_index(other_ctx.instance))
+
+    def test_describe_resources_follows_next_token(self):
+
+        pages = {
+            None: (['i-1', 'i-2'], 'token-1'),
+            'token-1': (['i-3'], None)
+        }
+        calls = []
+
+        def describe(next_token=None, filters=None):
+            calls.append(next_token)
+            page = ResultSet()
+            page.extend(pages[next_token][0])
+            page.next_token = pages[next_token][1]
+            return page
+
+        resources = utils.describe_resources(
+            describe, token_argument='next_token', filters={})
+
+        self.assertEquals('i-1', utils.find_resource(resources))
+        self.assertEquals([None], calls)
+        self.assertEquals(['i-2', 'i-3'], list(resources))
+        self.assertEquals([None, 'token-1'], calls)
+
+    def test_get_retry_interval(self):
+
+        ctx = self.mock_ctx('test_get_retry_interval')
+        current_ctx.set(ctx=ctx)
+        self.assertEquals(5, utils.get_retry_interval(5, 60))
+
+        for retry_number, interval in [(1, 10), (3, 40), (4, 60), (99, 60)]:
+            ctx = MockCloudifyContext(
+                operation={'retry_number': retry_number})
+            current_ctx.set(ctx=ctx)
+            self.assertEquals(interval, utils.get_retry_interval(5, 60))
+
+    def test_run_concurrently(self):
+
+        ctx = self.mock_ctx('test_run_concurrently')
+        current_ctx.set(ctx=ctx)
+
+        def node_id_and_square(number):
+            return utils.ctx.node.id, number * number
+
+        output = utils.run_concurrently(
+            node_id_and_square, range(5), max_workers=3)
+        self.assertEquals(
+            [(ctx.node.id, number * number) for number in range(5)],
+            output)
+
+        def fail_on_two(number):
+            if number == 2:
+                raise NonRecoverableError('failed {0}'.format(number))
+
+        error = self.assertRaises(
+            NonRecoverableError, utils.run_concurrently, fail_on_two,
+            [1, 2, 3], max_workers=2)
+        self.assertIn('failed 2', error.message)
@@ -15,16 +15,24 @@
 
 # Built-in Imports
 import os
+import json
+import time
 import uuid
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 # Cloudify Imports
 from ec2 import constants
 from cloudify import ctx
+from cloudify.state import current_ctx
 from cloudify.exceptions import NonRecoverableError
 
 # Third-party Imports
 from boto import exception
 
+# The relationship indexes of the current operation, by node instance ID.
+_relationship_indexes = (None, dict())
+
 
 def validate_node_property(key, ctx_node_properties):
     """Checks if the node property exists in the blueprint.
@@ -89,10 +97,8 @@ def set_external_resource_id(value, ctx_instance, external=True):
 
 
 def unassign_runtime_properties_from_resource(property_names, ctx_instance):
-    for property_name in property_names:
-        if property_name in ctx_instance.runtime_properties:
-            unassign_runtime_property_from_resource(
-                property_name, ctx_instance)
+    with RuntimePropertyStage(ctx_instance) as runtime_properties:
+        runtime_properties.unset(*property_names)
 
 
 def unassign_runtime_property_from_resource(property_name, ctx_instance):
@@ -108,6 +114,162 @@ def unassign_runtime_property_from_resource(property_name, ctx_instance):
         'Unassigned {0} runtime property: {1}'.format(property_name, value))
 
 
+class StagedList(object):
+    """A list runtime property held as an ordered set while it is staged,
+    so that lookups, adds and removes do not scan the list. Items are
+    keyed by key_function, by default their canonical JSON for dicts and
+    lists, so the same dict with its keys in another order is one item.
+    """
+
+    def __init__(self, values=None, key_function=None):
+        self._key = key_function or _get_list_item_key
+        self._items = OrderedDict()
+        for value in values or []:
+            self.add(value)
+
+    def add(self, value):
+        """Adds an item, unless an item with the same key is listed.
+
+        :returns True if the item was added.
+        """
+
+        key = self._key(value)
+        if key in self._items:
+            return False
+        self._items[key] = value
+        return True
+
+    def discard(self, value):
+        """Removes the item with the key of value, if there is one.
+
+        :returns True if an item was removed.
+        """
+
+        return self._items.pop(self._key(value), _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        return self._items.get(key, default)
+
+    def keys(self):
+        return self._items.keys()
+
+    def to_list(self):
+        return list(self._items.values())
+
+    def __contains__(self, value):
+        return self._key(value) in self._items
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __len__(self):
+        return len(self._items)
+
+
+_MISSING = object()
+
+
+def _get_list_item_key(value):
+
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+
+    return value
+
+
+class RuntimePropertyStage(object):
+    """Stages the runtime property changes of a node instance in memory,
+    and writes them to the instance once, when flushed or when the with
+    block exits. Staged lists are written back whole, so changes to them
+    are always seen as changes to the runtime properties.
+    """
+
+    def __init__(self, ctx_instance):
+        self.ctx_instance = ctx_instance
+        self._values = dict()
+        self._lists = dict()
+        self._unset = set()
+
+    def get(self, key, default=None):
+
+        if key in self._lists:
+            return self._lists[key].to_list()
+        elif key in self._values:
+            return self._values[key]
+        elif key in self._unset:
+            return default
+
+        return self.ctx_instance.runtime_properties.get(key, default)
+
+    def __getitem__(self, key):
+
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key, value):
+        self._lists.pop(key, None)
+        self._unset.discard(key)
+        self._values[key] = value
+
+    def update(self, values):
+        for key, value in values.items():
+            self[key] = value
+
+    def unset(self, *keys):
+        for key in keys:
+            self._values.pop(key, None)
+            self._lists.pop(key, None)
+            self._unset.add(key)
+
+    def list(self, key, key_function=None):
+        """Returns a list runtime property as a StagedList.
+
+        :param key: The runtime property.
+        :param key_function: Returns the key of an item of the list.
+        :returns a StagedList, written back to key when flushed.
+        """
+
+        if key not in self._lists:
+            staged_list = StagedList(self.get(key), key_function)
+            self._values.pop(key, None)
+            self._unset.discard(key)
+            self._lists[key] = staged_list
+
+        return self._lists[key]
+
+    def flush(self):
+        """Writes the staged changes to the runtime properties."""
+
+        runtime_properties = self.ctx_instance.runtime_properties
+
+        unassigned = dict(
+            (key, runtime_properties.pop(key)) for key in self._unset
+            if key in runtime_properties)
+
+        for key, value in self._values.items():
+            runtime_properties[key] = value
+
+        for key, staged_list in self._lists.items():
+            runtime_properties[key] = staged_list.to_list()
+
+        if unassigned:
+            ctx.logger.debug(
+                'Unassigned runtime properties: {0}'.format(unassigned))
+
+        self._values = dict()
+        self._lists = dict()
+        self._unset = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.flush()
+
+
 def use_external_resource(ctx_node_properties):
     """Checks if use_external_resource node property is true,
     logs the ID and answer to the debug log,
@@ -130,6 +292,116 @@ def use_external_resource(ctx_node_properties):
         return True
 
 
+class RelationshipIndex(object):
+    """The relationships of a node instance, indexed with one walk over
+    them. A relationship is found by its type, by any type it derives
+    from, and by the short name of those types, the part after the last
+    dot, which is how the plugin's constants name most of them. Targets
+    are also found by their AWS resource type. Each key lists all the
+    matching relationships, in order.
+    """
+
+    def __init__(self, relationships):
+        self.relationships = list(relationships or [])
+        self._by_type = None
+        self._by_aws_type = None
+
+    def get(self, relationship_type):
+        """Returns the relationships of a type, or derived from it.
+
+        :param relationship_type: A relationship type or its short name.
+        :returns a list of relationship contexts.
+        """
+
+        if self._by_type is None:
+            self._by_type = dict()
+            for relationship in self.relationships:
+                names = set()
+                for name in [relationship.type] + \
+                        _get_type_hierarchy(relationship):
+                    names.add(name)
+                    names.add(name.rsplit('.', 1)[-1])
+                for name in names:
+                    self._by_type.setdefault(name, []).append(relationship)
+
+        return self._by_type.get(relationship_type, [])
+
+    def get_target_ids(self, relationship_type):
+        """Returns the resource IDs of the targets of a relationship
+        type, None for a target without one.
+
+        :param relationship_type: A relationship type or its short name.
+        :returns a list of resource IDs.
+        """
+
+        return [relationship.target.instance.runtime_properties.get(
+                constants.EXTERNAL_RESOURCE_ID)
+                for relationship in self.get(relationship_type)]
+
+    def get_target_nodes_by_aws_type(self, aws_type):
+        """Returns the target nodes of an AWS resource type.
+
+        :param aws_type: The external_type runtime property of the target.
+        :returns a list of node contexts.
+        """
+
+        # the runtime properties of every target are read, so only once
+        # they are asked for
+        if self._by_aws_type is None:
+            self._by_aws_type = dict()
+            for relationship in self.relationships:
+                target_aws_type = relationship.target.instance \
+                    .runtime_properties.get(constants.AWS_TYPE_PROPERTY)
+                if target_aws_type:
+                    self._by_aws_type.setdefault(
+                        target_aws_type, []).append(relationship)
+
+        return [relationship.target.node
+                for relationship in self._by_aws_type.get(aws_type, [])]
+
+
+def _get_type_hierarchy(relationship):
+
+    try:
+        return list(relationship.type_hierarchy or [])
+    except (AttributeError, KeyError, IndexError):
+        # Relationships of mock contexts have no hierarchy.
+        return []
+
+
+def get_relationship_index(ctx_instance):
+    """Returns the relationship index of a node instance, built once
+    per operation and kept for the current ctx.
+
+    :param ctx_instance: The Cloudify ctx instance, or ctx.source/target
+        instance.
+    :returns a RelationshipIndex.
+    """
+
+    global _relationship_indexes
+
+    relationships = getattr(ctx_instance, 'relationships', None) or []
+
+    try:
+        operation_ctx = current_ctx.get_ctx()
+    except RuntimeError:
+        operation_ctx = None
+
+    owner, indexes = _relationship_indexes
+    if owner is not operation_ctx:
+        indexes = dict()
+        _relationship_indexes = (operation_ctx, indexes)
+
+    key = getattr(ctx_instance, 'id', None)
+    cached = indexes.get(key)
+
+    if cached is None or cached[0] is not relationships:
+        cached = (relationships, RelationshipIndex(relationships))
+        indexes[key] = cached
+
+    return cached[1]
+
+
 def get_target_external_resource_ids(relationship_type, ctx_instance):
     """Gets a list of target node ids connected via a relationship to a node.
 
@@ -138,20 +410,34 @@ def get_target_external_resource_ids(relationship_type, ctx_instance):
     :returns a list of security group ids.
     """
 
-    ids = []
-
     if not getattr(ctx_instance, 'relationships', []):
         ctx.logger.info('Skipping attaching relationships, '
                         'because none are attached to this node.')
-        return ids
+        return []
 
-    for r in ctx_instance.relationships:
-        if relationship_type in r.type:
-            ids.append(
-                r.target.instance.runtime_properties[
-                    constants.EXTERNAL_RESOURCE_ID])
+    return [r.target.instance.runtime_properties[
+            constants.EXTERNAL_RESOURCE_ID]
+            for r in get_relationship_index(ctx_instance).get(
+                relationship_type)]
 
-    return ids
+
+def get_target_external_resource_ids_by_type(
+        relationship_types, ctx_instance):
+    """Gets the target node ids of several relationship types.
+
+    :param relationship_types: A list of relationship type strings.
+    :param ctx_instance: The Cloudify ctx instance.
+    :returns a dict of relationship types to lists of target node ids.
+    """
+
+    index = get_relationship_index(ctx_instance)
+
+    return dict(
+        (relationship_type,
+         [r.target.instance.runtime_properties[
+             constants.EXTERNAL_RESOURCE_ID]
+          for r in index.get(relationship_type)])
+        for relationship_type in relationship_types)
 
 
 def get_resource_id():
@@ -221,11 +507,8 @@ def get_single_connected_node_by_type(
 
 
 def get_connected_nodes_by_type(ctx, type_name):
-    return [rel.target.node for rel in ctx.instance.relationships
-            if rel.target.instance.runtime_properties.get(
-                constants.AWS_TYPE_PROPERTY) and
-            rel.target.instance.runtime_properties.get(
-                constants.AWS_TYPE_PROPERTY) == type_name]
+    return get_relationship_index(ctx.instance).get_target_nodes_by_aws_type(
+        type_name)
 
 
 def add_tag(resource):
@@ -239,6 +522,32 @@ def add_tag(resource):
     _add_tag(resource, 'resource_id', ctx.instance.id)
     _add_tag(resource, 'deployment_id', ctx.deployment.id)
 
+    if not use_external_resource(ctx.node.properties):
+        for tag_key, tag_value in get_owner_tags().items():
+            _add_tag(resource, tag_key, tag_value)
+
+
+def get_owner_tags():
+    """Returns the tags that mark a resource as created by the plugin
+    for this manager. Only resources with them are swept once their
+    deployment is gone, so external resources, which are tagged with
+    the deployment too, and the resources of other managers in the same
+    account are left alone.
+
+    :returns a dict of tag key to value.
+    """
+
+    return {constants.OWNER_TAG: get_owner()}
+
+
+def get_owner():
+    """Returns the name of the manager in the owner tag, its IP address,
+    or constants.OWNER_LOCAL outside of a manager.
+    """
+
+    return os.environ.get(constants.OWNER_ENV_VAR_NAME) or \
+        constants.OWNER_LOCAL
+
 
 def _add_tag(resource, tag_key, tag_value):
 
@@ -250,3 +559,139 @@ def _add_tag(resource, tag_key, tag_value):
             'unable to tag resource name: {0}'.format(str(e)))
 
     return output
+
+
+def describe_resources(describe_function, token_argument=None,
+                       token_attribute='next_token', **kwargs):
+    """Yields the resources returned by a boto describe call,
+    requesting the following page only when the previous one is consumed.
+
+    :param describe_function: A boto get_all_* function.
+    :param token_argument: The name of the pagination argument accepted
+        by describe_function, such as next_token or marker.
+        If None, the call is not paginated.
+    :param token_attribute: The result set attribute holding the token
+        of the next page.
+    :param kwargs: The arguments, such as filters, for describe_function.
+    :returns a generator of boto objects.
+    """
+
+    while True:
+        page = describe_function(**kwargs)
+        for resource in page:
+            yield resource
+        token = getattr(page, token_attribute, None) \
+            if token_argument else None
+        if not token:
+            return
+        kwargs[token_argument] = token
+
+
+def find_resource(resources, matcher=None):
+    """Returns the first resource accepted by matcher.
+
+    Since resources may be a generator, no further pages are requested
+    once a match is found.
+
+    :param resources: An iterable of boto objects.
+    :param matcher: A function taking a resource and returning a boolean.
+        If None, the first resource is returned.
+    :returns a boto object or None.
+    """
+
+    for resource in resources:
+        if matcher is None or matcher(resource):
+            return resource
+
+    return None
+
+
+def get_retry_interval(initial_interval=constants.RETRY_INITIAL_INTERVAL,
+                       max_interval=constants.RETRY_MAX_INTERVAL):
+    """Returns how long to wait before the next retry of the current
+    operation. The interval doubles with every retry up to max_interval,
+    so quick transitions are noticed early and slow ones cost few calls.
+
+    :param initial_interval: The interval of the first retry, in seconds.
+    :param max_interval: The longest interval, in seconds.
+    :returns the retry_after value for ctx.operation.retry.
+    """
+
+    retry_number = min(ctx.operation.retry_number or 0, 16)
+
+    return min(initial_interval * 2 ** retry_number, max_interval)
+
+
+def call_with_throttling_retry(function, *args, **kwargs):
+    """Calls function, retrying it in place while AWS throttles it.
+    Unlike an operation retry, this keeps the progress of the calls
+    made around it, such as the other calls of run_concurrently.
+
+    :param function: A boto client method.
+    :returns the return value of function.
+    :raises EC2ResponseError: If function fails for another reason or
+        is still throttled after the last attempt.
+    """
+
+    interval = constants.THROTTLING_RETRY_INTERVAL
+
+    for attempt in range(constants.THROTTLING_RETRY_ATTEMPTS):
+        try:
+            return function(*args, **kwargs)
+        except exception.EC2ResponseError as e:
+            if e.error_code not in constants.THROTTLING_ERRORS or \
+                    attempt == constants.THROTTLING_RETRY_ATTEMPTS - 1:
+                raise
+        time.sleep(interval)
+        interval = min(interval * 2, constants.RETRY_MAX_INTERVAL)
+
+
+def run_concurrently(function, items, max_workers=None):
+    """Calls function on every item from a pool of threads.
+
+    Every thread works with the Cloudify context of the caller, if any,
+    so that function may use ctx and create its own connection clients.
+    Boto connections are not thread safe and must not be shared between
+    threads.
+
+    :param function: A function taking one item.
+    :param items: An iterable of items.
+    :param max_workers: The most calls in flight at the same time,
+        by default constants.MAX_CONCURRENT_REQUESTS. With one worker,
+        the calls are made in the calling thread.
+    :returns a list of the results, in the order of items.
+    :raises the first exception raised by function.
+    """
+
+    items = list(items)
+
+    if not items:
+        return []
+
+    max_workers = min(max_workers or constants.MAX_CONCURRENT_REQUESTS,
+                      len(items))
+
+    if max_workers == 1:
+        return [function(item) for item in items]
+
+    try:
+        caller_ctx = current_ctx.get_ctx()
+    except RuntimeError:
+        caller_ctx = None
+
+    def call(item):
+        if caller_ctx is None:
+            return function(item)
+        current_ctx.set(caller_ctx)
+        try:
+            return function(item)
+        finally:
+            current_ctx.clear()
+
+    pool = ThreadPool(max_workers)
+
+    try:
+        return pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
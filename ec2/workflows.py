@@ -0,0 +1,101 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import json
+
+# Cloudify imports
+from ec2 import constants
+from cloudify.decorators import workflow
+
+
+@workflow
+def snapshot_volumes(ctx, group_by_instance=True, retention=0,
+                     wait_for_completion=True, args=None, **_):
+    """Snapshots the EBS volumes of a deployment, all at once.
+
+    With group_by_instance, the volumes attached to each instance are
+    snapshotted together by one operation on the instance, and only the
+    volumes not connected to an instance get their own operation.
+
+    :param group_by_instance: Whether to snapshot by instance.
+    :param retention: How many snapshots to keep per volume, 0 for all.
+    :param wait_for_completion: Whether to wait for the snapshots.
+    :param args: Additional CreateSnapshot arguments.
+    """
+
+    kwargs = dict(args=args or {},
+                  retention=retention,
+                  wait_for_completion=wait_for_completion)
+
+    graph = ctx.graph_mode()
+
+    for node in ctx.nodes:
+        if group_by_instance and \
+                constants.INSTANCE_NODE_TYPE in node.type_hierarchy:
+            node_instances = node.instances
+        elif constants.VOLUME_NODE_TYPE in node.type_hierarchy:
+            node_instances = [
+                node_instance for node_instance in node.instances
+                if not group_by_instance or not any(
+                    relationship.relationship.is_derived_from(
+                        constants.VOLUME_INSTANCE_RELATIONSHIP_TYPE)
+                    for relationship in node_instance.relationships)]
+        else:
+            continue
+
+        for node_instance in node_instances:
+            graph.add_task(node_instance.execute_operation(
+                constants.SNAPSHOT_OPERATION,
+                kwargs=kwargs,
+                allow_kwargs_override=True))
+
+    return graph.execute()
+
+
+@workflow
+def prefetch_images(ctx, **_):
+    """Caches the AMIs of all the instances of a deployment, with one
+    DescribeImages call per AWS config, so that validating and launching
+    the instances does not describe them one by one.
+
+    The AMI cache is a file of the agent that runs the operations of the
+    instances, so each DescribeImages call is made by an operation on one
+    of the instances that share the AWS config.
+    """
+
+    node_instances = dict()
+    image_ids = dict()
+
+    for node in ctx.nodes:
+        if constants.INSTANCE_NODE_TYPE not in node.type_hierarchy or \
+                not node.instances:
+            continue
+        aws_config = json.dumps(
+            node.properties.get(constants.AWS_CONFIG_PROPERTY) or {},
+            sort_keys=True)
+        image_id = node.properties.get('parameters', {}).get('image_id') \
+            or node.properties['image_id']
+        node_instances.setdefault(aws_config, list(node.instances)[0])
+        image_ids.setdefault(aws_config, set()).add(image_id)
+
+    graph = ctx.graph_mode()
+
+    for aws_config, node_instance in node_instances.items():
+        graph.add_task(node_instance.execute_operation(
+            constants.PREFETCH_IMAGES_OPERATION,
+            kwargs=dict(image_ids=sorted(image_ids[aws_config]))))
+
+    return graph.execute()
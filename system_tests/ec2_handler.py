@@ -13,9 +13,9 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
-import copy
 from time import sleep
 from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 from boto.ec2 import get_region
 from boto.ec2 import EC2Connection
@@ -45,7 +45,7 @@ class EC2CleanupContext(BaseHandler.CleanupContext):
         for segment in range(6):
             failed_to_remove = \
                 env.handler.remove_ec2_resources(resources)
-            if not failed_to_remove:
+            if not any(failed_to_remove.values()):
                 break
 
         cls.logger.info('Leftover resources after cleanup: {0}'
@@ -75,11 +75,11 @@ class EC2CleanupContext(BaseHandler.CleanupContext):
             "Current resources in account:"
             " {0}".format(resources_to_be_removed))
         if env.use_existing_manager_keypair:
-            resources_to_be_removed['key_pairs'].pop(
-                env.management_keypair_name, None)
+            resources_to_be_removed['key_pairs'].discard(
+                env.management_keypair_name)
         if env.use_existing_agent_keypair:
-            resources_to_be_removed['key_pairs'].pop(env.agent_keypair_name,
-                                                     None)
+            resources_to_be_removed['key_pairs'].discard(
+                env.agent_keypair_name)
 
         failed_to_remove = cls.clean_resources(env, resources_to_be_removed)
 
@@ -168,35 +168,51 @@ class EC2Handler(BaseHandler):
         return connect_to_elb_region(elb_region, **credentials)
 
     def ec2_infra_state(self):
-
-        ec2_client = self.ec2_client()
-        vpc_client = self.vpc_client()
-        elb_client = self.elb_client()
-
-        return {
-            'instances': dict(self._instances(ec2_client)),
-            'key_pairs': dict(self._key_pairs(ec2_client)),
-            'elasticips': dict(self._elasticips(ec2_client)),
-            'security_groups': dict(self._security_groups(ec2_client)),
-            'volumes': dict(self._volumes(ec2_client)),
-            'snapshots': dict(self._snapshots(ec2_client)),
-            'load_balancers': dict(self._elbs(elb_client)),
-            'vpcs': dict(self._vpcs(vpc_client)),
-            'subnets': dict(self._subnets(vpc_client)),
-            'internet_gateways': dict(self._internet_gateways(vpc_client)),
-            'vpn_gateways': dict(self._vpn_gateways(vpc_client)),
-            'customer_gateways': dict(self._customer_gateways(vpc_client)),
-            'network_acls': dict(self._network_acls(vpc_client)),
-            'dhcp_options_sets': dict(self._dhcp_options_sets(vpc_client)),
-            'route_tables': dict(self._route_tables(vpc_client))
-        }
+        """Describes the resources of the account concurrently, each
+        kind with its own client, since boto connections are not
+        thread-safe.
+
+        :returns a dict of resource kind to the set of resource IDs.
+        """
+
+        default_vpc = self._default_vpc(self.vpc_client())
+
+        describes = [
+            ('instances', self.ec2_client, self._instances),
+            ('key_pairs', self.ec2_client, self._key_pairs),
+            ('elasticips', self.ec2_client, self._elasticips),
+            ('security_groups', self.ec2_client, self._security_groups),
+            ('volumes', self.ec2_client, self._volumes),
+            ('snapshots', self.ec2_client, self._snapshots),
+            ('load_balancers', self.elb_client, self._elbs),
+            ('vpcs', self.vpc_client, self._vpcs),
+            ('subnets', self.vpc_client, self._subnets),
+            ('internet_gateways', self.vpc_client,
+             self._internet_gateways),
+            ('vpn_gateways', self.vpc_client, self._vpn_gateways),
+            ('customer_gateways', self.vpc_client,
+             self._customer_gateways),
+            ('network_acls', self.vpc_client, self._network_acls),
+            ('dhcp_options_sets', self.vpc_client,
+             self._dhcp_options_sets),
+            ('route_tables', self.vpc_client, self._route_tables)
+        ]
+
+        def describe(args):
+            kind, get_client, get_ids = args
+            return kind, set(get_ids(get_client(), default_vpc))
+
+        pool = ThreadPool(len(describes))
+        try:
+            return dict(pool.map(describe, describes))
+        finally:
+            pool.close()
+            pool.join()
 
     def ec2_infra_state_delta(self, before, after):
 
-        after = copy.deepcopy(after)
-
         return {
-            prop: self._remove_keys(after[prop], before[prop].keys())
+            prop: after[prop] - before[prop]
             for prop in before.keys()
         }
 
@@ -206,21 +222,22 @@ class EC2Handler(BaseHandler):
         vpc_client = self.vpc_client()
         elb_client = self.elb_client()
 
-        instances = self._instances(ec2_client)
-        key_pairs = self._key_pairs(ec2_client)
-        elasticips = self._elasticips(ec2_client)
-        security_groups = self._security_groups(ec2_client)
-        volumes = self._volumes(ec2_client)
-        snapshots = self._snapshots(ec2_client)
-        load_balancers = self._elbs(elb_client)
-        vpcs = self._vpcs(vpc_client)
-        subnets = self._subnets(vpc_client)
-        internet_gateways = self._internet_gateways(vpc_client)
-        vpn_gateways = self._vpn_gateways(vpc_client)
-        customer_gateways = self._customer_gateways(vpc_client)
-        network_acls = self._network_acls(vpc_client)
-        dhcp_options_sets = self._dhcp_options_sets(vpc_client)
-        route_tables = self._route_tables(vpc_client)
+        current = self.ec2_infra_state()
+        instances = current['instances']
+        key_pairs = current['key_pairs']
+        elasticips = current['elasticips']
+        security_groups = current['security_groups']
+        volumes = current['volumes']
+        snapshots = current['snapshots']
+        load_balancers = current['load_balancers']
+        vpcs = current['vpcs']
+        subnets = current['subnets']
+        internet_gateways = current['internet_gateways']
+        vpn_gateways = current['vpn_gateways']
+        customer_gateways = current['customer_gateways']
+        network_acls = current['network_acls']
+        dhcp_options_sets = current['dhcp_options_sets']
+        route_tables = current['route_tables']
 
         failed = {
             'instances': {},
@@ -240,7 +257,7 @@ class EC2Handler(BaseHandler):
             'route_tables': {}
         }
 
-        for instance_id, _ in instances:
+        for instance_id in instances:
             if instance_id in resources_to_remove['instances']:
                 with self._handled_exception(instance_id, failed, 'instances'):
                     specific_instance = \
@@ -263,51 +280,51 @@ class EC2Handler(BaseHandler):
                             'The test failed because '
                             'instance would not terminate.')
 
-        for kp_name, _ in key_pairs:
+        for kp_name in key_pairs:
             if kp_name in resources_to_remove['key_pairs']:
                 with self._handled_exception(kp_name, failed, 'key_pairs'):
                     ec2_client.delete_key_pair(kp_name)
 
-        for elasticip_id, elasticip in elasticips:
+        for elasticip_id in elasticips:
             if elasticip_id in resources_to_remove['elasticips']:
                 with self._handled_exception(
                         elasticip_id, failed, 'elasticips'):
                     ec2_client.get_all_addresses(elasticip_id)[0].release()
 
-        for security_group_id, _ in security_groups:
+        for security_group_id in security_groups:
             if security_group_id in resources_to_remove['security_groups']:
                 with self._handled_exception(
                         security_group_id, failed, 'security_groups'):
                     ec2_client.get_all_security_groups(
                         group_ids=[security_group_id])[0].delete()
 
-        for volume_id, _ in volumes:
+        for volume_id in volumes:
             if volume_id in resources_to_remove['volumes']:
                 with self._handled_exception(
                         volume_id, failed, 'volumes'):
-                    volumes = []
+                    volume_objects = []
                     try:
-                        volumes = ec2_client.get_all_volumes(volume_id)
+                        volume_objects = ec2_client.get_all_volumes(volume_id)
                     except EC2ResponseError:
                         continue
-                    for volume in volumes:
+                    for volume in volume_objects:
                         if 'in-use' in volume.status:
                             volume.detach(force=True)
                         volume.delete()
 
-        for snapshot_id, _ in snapshots:
+        for snapshot_id in snapshots:
             if snapshot_id in resources_to_remove['snapshots']:
                 with self._handled_exception(
                         snapshot_id, failed, 'snapshots'):
                     ec2_client.get_all_snapshots(snapshot_id)[0].delete()
 
-        for elb_name, _ in load_balancers:
+        for elb_name in load_balancers:
             if elb_name in resources_to_remove['load_balancers']:
                 with self._handled_exception(
                         elb_name, failed, 'load_balancers'):
                     elb_client.get_all_load_balancers(elb_name)[0].delete()
 
-        for customer_gateway_id, _ in customer_gateways:
+        for customer_gateway_id in customer_gateways:
             if customer_gateway_id in resources_to_remove['customer_gateways']:
                 with self._handled_exception(customer_gateway_id,
                                              failed,
@@ -317,7 +334,7 @@ class EC2Handler(BaseHandler):
                             vpnx.delete()
                     vpc_client.delete_customer_gateway(customer_gateway_id)
 
-        for vpn_gateway_id, _ in vpn_gateways:
+        for vpn_gateway_id in vpn_gateways:
             if vpn_gateway_id in resources_to_remove['vpn_gateways']:
                 with self._handled_exception(vpn_gateway_id,
                                              failed,
@@ -332,12 +349,12 @@ class EC2Handler(BaseHandler):
                                 pass
                     vpc_client.delete_vpn_gateway(vpn_gateway_id)
 
-        for subnet_id, _ in subnets:
+        for subnet_id in subnets:
             if subnet_id in resources_to_remove['subnets']:
                 with self._handled_exception(subnet_id, failed, 'subnets'):
                     vpc_client.delete_subnet(subnet_id)
 
-        for internet_gateway_id, _ in internet_gateways:
+        for internet_gateway_id in internet_gateways:
             if internet_gateway_id in resources_to_remove['internet_gateways']:
                 with self._handled_exception(internet_gateway_id,
                                              failed,
@@ -353,14 +370,14 @@ class EC2Handler(BaseHandler):
                                 pass
                     vpc_client.delete_internet_gateway(internet_gateway_id)
 
-        for dhcp_options_set_id, _ in dhcp_options_sets:
+        for dhcp_options_set_id in dhcp_options_sets:
             if dhcp_options_set_id in resources_to_remove['dhcp_options_sets']:
                 with self._handled_exception(dhcp_options_set_id,
                                              failed,
                                              'dhcp_options_sets'):
                     vpc_client.delete_dhcp_options(dhcp_options_set_id)
 
-        for route_table_id, _ in route_tables:
+        for route_table_id in route_tables:
             if route_table_id in resources_to_remove['route_tables']:
                 with self._handled_exception(route_table_id, failed,
                                              'route_tables'):
@@ -378,7 +395,7 @@ class EC2Handler(BaseHandler):
                                 pass
                     vpc_client.delete_route_table(route_table_id)
 
-        for network_acl_id, _ in network_acls:
+        for network_acl_id in network_acls:
             if network_acl_id in resources_to_remove['network_acls']:
                 with self._handled_exception(network_acl_id,
                                              failed,
@@ -390,7 +407,7 @@ class EC2Handler(BaseHandler):
                                 association.subnet_id)
                     vpc_client.delete_network_acl(network_acl_id)
 
-        for vpc_id, _ in vpcs:
+        for vpc_id in vpcs:
             if vpc_id in resources_to_remove['vpcs']:
                 with self._handled_exception(vpc_id, failed, 'vpcs'):
                     for peer_cx in \
@@ -412,110 +429,76 @@ class EC2Handler(BaseHandler):
             'region': region
         }
 
-    def _security_groups(self, ec2_client):
-        return [(security_group.id, security_group.id)
+    def _default_vpc(self, vpc_client):
+        return next((vpc for vpc in vpc_client.get_all_vpcs()
+                     if vpc.is_default), None)
+
+    def _security_groups(self, ec2_client, default_vpc):
+        return [security_group.id
                 for security_group in ec2_client.get_all_security_groups()
                 if 'default' not in security_group.name]
 
-    def _instances(self, ec2_client):
-        return [(instance[0].id, instance[0].id)
-                for instance in
-                [res.instances for res in ec2_client.get_all_reservations()]]
+    def _instances(self, ec2_client, default_vpc):
+        return [instance.id
+                for reservation in ec2_client.get_all_reservations()
+                for instance in reservation.instances]
 
-    def _key_pairs(self, ec2_client):
-        return [(kp.name, kp.name)
-                for kp in ec2_client.get_all_key_pairs()]
+    def _key_pairs(self, ec2_client, default_vpc):
+        return [kp.name for kp in ec2_client.get_all_key_pairs()]
 
-    def _elasticips(self, ec2_client):
-        return [(address.public_ip, address.public_ip)
+    def _elasticips(self, ec2_client, default_vpc):
+        return [address.public_ip
                 for address in ec2_client.get_all_addresses()]
 
-    def _volumes(self, ec2_client):
-        return [(vol.id, vol.id)
-                for vol in ec2_client.get_all_volumes()]
+    def _volumes(self, ec2_client, default_vpc):
+        return [vol.id for vol in ec2_client.get_all_volumes()]
 
-    def _snapshots(self, ec2_client):
-        return [(ss.id, ss.id)
-                for ss in ec2_client.get_all_snapshots(owner='self')]
+    def _snapshots(self, ec2_client, default_vpc):
+        return [ss.id for ss in ec2_client.get_all_snapshots(owner='self')]
 
-    def _elbs(self, elb_client):
-        return [(elb.name, elb.name)
-                for elb in elb_client.get_all_load_balancers()]
+    def _elbs(self, elb_client, default_vpc):
+        return [elb.name for elb in elb_client.get_all_load_balancers()]
 
-    def _vpcs(self, vpc_client):
-        return [(vpc.id, vpc.id)
-                for vpc in vpc_client.get_all_vpcs()
+    def _vpcs(self, vpc_client, default_vpc):
+        return [vpc.id for vpc in vpc_client.get_all_vpcs()
                 if not vpc.is_default]
 
-    def _subnets(self, vpc_client):
-        default_vpc = ''
-        vpcs = vpc_client.get_all_vpcs()
-        for vpc in vpcs:
-            if vpc.is_default:
-                default_vpc = vpc.id
-        return [(subnet.id, subnet.id)
-                for subnet in vpc_client.get_all_subnets()
-                if subnet.vpc_id != default_vpc]
-
-    def _internet_gateways(self, vpc_client):
-        default_vpc_id = ''
-        all_vpcs = vpc_client.get_all_vpcs()
-        all_internet_gateways = vpc_client.get_all_internet_gateways()
-        not_default_internet_gateways = []
-        for vpc in all_vpcs:
-            if vpc.is_default:
-                default_vpc_id = vpc.id
-        for ig in all_internet_gateways:
-            for attachment in ig.attachments:
-                if attachment.vpc_id != default_vpc_id:
-                    not_default_internet_gateways.append((ig.id, ig.id))
-        return not_default_internet_gateways
-
-    def _vpn_gateways(self, vpc_client):
-        return [(vpn_gateway.id, vpn_gateway.id)
+    def _subnets(self, vpc_client, default_vpc):
+        default_vpc_id = default_vpc.id if default_vpc else ''
+        return [subnet.id for subnet in vpc_client.get_all_subnets()
+                if subnet.vpc_id != default_vpc_id]
+
+    def _internet_gateways(self, vpc_client, default_vpc):
+        default_vpc_id = default_vpc.id if default_vpc else ''
+        return [ig.id for ig in vpc_client.get_all_internet_gateways()
+                if any(attachment.vpc_id != default_vpc_id
+                       for attachment in ig.attachments)]
+
+    def _vpn_gateways(self, vpc_client, default_vpc):
+        return [vpn_gateway.id
                 for vpn_gateway in vpc_client.get_all_vpn_gateways()]
 
-    def _customer_gateways(self, vpc_client):
-        return [(customer_gateway.id, customer_gateway.id)
+    def _customer_gateways(self, vpc_client, default_vpc):
+        return [customer_gateway.id
                 for customer_gateway in vpc_client.get_all_customer_gateways()]
 
-    def _network_acls(self, vpc_client):
-        default_vpc = ''
-        vpcs = vpc_client.get_all_vpcs()
-        for vpc in vpcs:
-            if vpc.is_default:
-                default_vpc = vpc.id
-        return [(network_acl.id, network_acl.id)
+    def _network_acls(self, vpc_client, default_vpc):
+        default_vpc_id = default_vpc.id if default_vpc else ''
+        return [network_acl.id
                 for network_acl in vpc_client.get_all_network_acls()
-                if network_acl.vpc_id != default_vpc]
-
-    def _dhcp_options_sets(self, vpc_client):
-        default_dopt = ''
-        vpcs = vpc_client.get_all_vpcs()
-        for vpc in vpcs:
-            if vpc.is_default:
-                default_dopt = vpc.dhcp_options_id
-        return [(dopt.id, dopt.id) for dopt
-                in vpc_client.get_all_dhcp_options()
+                if network_acl.vpc_id != default_vpc_id]
+
+    def _dhcp_options_sets(self, vpc_client, default_vpc):
+        default_dopt = default_vpc.dhcp_options_id if default_vpc else ''
+        return [dopt.id for dopt in vpc_client.get_all_dhcp_options()
                 if dopt.id != default_dopt]
 
-    def _route_tables(self, vpc_client):
-        default_vpc = ''
-        vpcs = vpc_client.get_all_vpcs()
-        for vpc in vpcs:
-            if vpc.is_default:
-                default_vpc = vpc.id
-        return [(rtb.id, rtb.id) for rtb
-                in vpc_client.get_all_route_tables()
-                if rtb.vpc_id != default_vpc and not any(
+    def _route_tables(self, vpc_client, default_vpc):
+        default_vpc_id = default_vpc.id if default_vpc else ''
+        return [rtb.id for rtb in vpc_client.get_all_route_tables()
+                if rtb.vpc_id != default_vpc_id and not any(
                 association.main for association in rtb.associations)]
 
-    def _remove_keys(self, dct, keys):
-        for key in keys:
-            if key in dct:
-                del dct[key]
-        return dct
-
     @contextmanager
     def _handled_exception(self, resource_id, failed, resource_group):
         try:
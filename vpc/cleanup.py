@@ -0,0 +1,438 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import time
+
+# Third-party Imports
+from boto import exception
+
+# Cloudify imports
+from . import constants
+from .topology import ThreadLocalClients, plan_levels
+from ec2 import utils as ec2_utils
+from ec2 import constants as ec2_constants
+from cloudify import ctx
+from cloudify.decorators import operation
+from cloudify.exceptions import NonRecoverableError
+
+
+@operation
+def release(**_):
+    """Forgets a resource deleted by the teardown_deployment workflow.
+    """
+
+    for property_name in list(ctx.instance.runtime_properties.keys()):
+        ec2_utils.unassign_runtime_property_from_resource(
+            property_name, ctx.instance)
+
+
+class TeardownPlanner(ThreadLocalClients):
+    """Deletes the resources tagged with a deployment ID.
+
+    The resources are described with one call per resource type, and
+    deleted level by level of a deletion plan, in which every resource
+    comes after the resources that block its deletion, such as the
+    instances in a subnet or everything in a VPC. The resources of a
+    level are deleted concurrently.
+    """
+
+    resource_types = constants.TEARDOWN_RESOURCES
+
+    def __init__(self, deployment_id, aws_config=None, max_workers=None):
+        super(TeardownPlanner, self).__init__()
+        self.deployment_id = deployment_id
+        self.aws_config = aws_config
+        self.max_workers = max_workers
+        self.errors = []
+
+    @property
+    def filters(self):
+        return {'tag:deployment_id': self.deployment_id}
+
+    def snapshot(self):
+        """Describes the resources tagged with the deployment ID.
+
+        :returns a list of resource dicts with an id, a resource_type,
+            the deployment and node instance IDs in its tags, and the
+            IDs of the VPCs, subnet, security groups, DHCP options,
+            route table associations and instance it refers to.
+        """
+
+        described = ec2_utils.run_concurrently(
+            self._describe,
+            [resource['AWS_RESOURCE_TYPE']
+             for resource in self.resource_types],
+            self.max_workers)
+
+        return [resource for resources in described
+                for resource in resources]
+
+    def plan(self, resources):
+        """Adds to every resource the IDs of the resources that must be
+        deleted before it, as its dependencies.
+
+        :param resources: A list of resource dicts, as from snapshot.
+        :returns a list of resource dicts for plan_levels.
+        """
+
+        by_type = dict()
+        for resource in resources:
+            by_type.setdefault(resource['resource_type'], []).append(resource)
+
+        def ids_of(resource_type, condition):
+            return [resource['id']
+                    for resource in by_type.get(resource_type, [])
+                    if condition(resource)]
+
+        def shares_vpc(resource):
+            vpc_ids = set(resource['vpc_ids'])
+            return lambda other: vpc_ids & set(other['vpc_ids'])
+
+        planned = []
+
+        for resource in resources:
+            resource_type = resource['resource_type']
+
+            if resource_type == 'security_group':
+                dependencies = ids_of(
+                    'instance',
+                    lambda other: resource['id'] in other['group_ids'])
+            elif resource_type == 'subnet':
+                dependencies = ids_of(
+                    'instance',
+                    lambda other: other['subnet_id'] == resource['id'])
+            elif resource_type in ['route_table', 'network_acl']:
+                dependencies = ids_of('subnet', shares_vpc(resource))
+            elif resource_type in ['internet_gateway', 'vpn_gateway']:
+                dependencies = ids_of('instance', shares_vpc(resource))
+            elif resource_type == 'vpc':
+                dependencies = [
+                    other['id'] for other in resources
+                    if resource['id'] in other['vpc_ids']]
+            elif resource_type == 'volume':
+                dependencies = ids_of(
+                    'instance',
+                    lambda other: other['id'] == resource['instance_id'])
+            elif resource_type == 'dhcp_options':
+                dependencies = ids_of(
+                    'vpc',
+                    lambda other: other['dhcp_options_id'] == resource['id'])
+            else:
+                dependencies = []
+
+            planned.append(dict(resource, dependencies=dependencies))
+
+        return planned
+
+    def teardown(self, resources):
+        """Deletes the resources. Tearing down stops after the first
+        level where a resource fails, and the errors are left in errors.
+
+        :param resources: A list of resource dicts, as from snapshot.
+        :returns the list of the deleted resource dicts.
+        """
+
+        deleted = []
+
+        for level in plan_levels(self.plan(resources)):
+            errors = ec2_utils.run_concurrently(
+                self._delete_resource, level, self.max_workers)
+
+            level_deleted = [resource for resource, error
+                             in zip(level, errors) if not error]
+            deleted.extend(level_deleted)
+            self.errors.extend(error for error in errors if error)
+
+            instance_ids = [resource['id'] for resource in level_deleted
+                            if resource['resource_type'] == 'instance']
+            if instance_ids and not self.errors:
+                self._wait_for_termination(instance_ids)
+
+            if self.errors:
+                break
+
+        return deleted
+
+    def _describe(self, resource_type):
+
+        describe = getattr(self, '_describe_{0}'.format(resource_type))
+
+        try:
+            aws_resources = describe(
+                self.client(self.aws_config), self.filters)
+        except (exception.EC2ResponseError,
+                exception.BotoServerError) as e:
+            raise NonRecoverableError(
+                'Unable to describe the {0} resources tagged {1}: {2}'
+                .format(resource_type, self.filters, str(e)))
+
+        return [dict(id=aws_resource.id,
+                     resource_type=resource_type,
+                     deployment_id=aws_resource.tags.get('deployment_id'),
+                     node_instance_id=aws_resource.tags.get('resource_id'),
+                     **references)
+                for aws_resource, references in aws_resources]
+
+    def _references(self, vpc_ids=None, subnet_id=None, group_ids=None,
+                    dhcp_options_id=None, association_ids=None,
+                    instance_id=None):
+        return dict(vpc_ids=[vpc_id for vpc_id in vpc_ids or [] if vpc_id],
+                    subnet_id=subnet_id,
+                    group_ids=group_ids or [],
+                    dhcp_options_id=dhcp_options_id,
+                    association_ids=association_ids or [],
+                    instance_id=instance_id)
+
+    def _describe_instance(self, client, filters):
+        """Describes the instances page by page, since an account may
+        have more of them than one DescribeInstances returns.
+        """
+
+        instances = []
+        next_token = None
+        terminated = ec2_constants.INSTANCE_STATE_TERMINATED
+
+        while True:
+            reservations = client.get_all_reservations(
+                filters=filters,
+                max_results=constants.DESCRIBE_PAGE_SIZE,
+                next_token=next_token)
+            for reservation in reservations:
+                instances.extend(reservation.instances)
+            next_token = getattr(reservations, 'next_token', None)
+            if not next_token:
+                break
+
+        return [(instance, self._references(
+                    vpc_ids=[instance.vpc_id],
+                    subnet_id=instance.subnet_id,
+                    group_ids=[group.id for group in instance.groups]))
+                for instance in instances
+                if instance.state_code != terminated]
+
+    def _describe_volume(self, client, filters):
+        return [(volume, self._references(
+                    instance_id=volume.attach_data.instance_id))
+                for volume in client.get_all_volumes(filters=filters)]
+
+    def _describe_security_group(self, client, filters):
+        return [(group, self._references(vpc_ids=[group.vpc_id]))
+                for group in client.get_all_security_groups(filters=filters)
+                if group.name != 'default']
+
+    def _describe_vpc(self, client, filters):
+        return [(vpc, self._references(
+                    dhcp_options_id=vpc.dhcp_options_id))
+                for vpc in client.get_all_vpcs(filters=filters)]
+
+    def _describe_subnet(self, client, filters):
+        return [(subnet, self._references(vpc_ids=[subnet.vpc_id]))
+                for subnet in client.get_all_subnets(filters=filters)]
+
+    def _describe_route_table(self, client, filters):
+        return [(route_table, self._references(
+                    vpc_ids=[route_table.vpc_id],
+                    association_ids=[association.id for association
+                                     in route_table.associations]))
+                for route_table in client.get_all_route_tables(
+                    filters=filters)
+                if not any(association.main
+                           for association in route_table.associations)]
+
+    def _describe_network_acl(self, client, filters):
+        return [(network_acl, self._references(
+                    vpc_ids=[network_acl.vpc_id]))
+                for network_acl in client.get_all_network_acls(
+                    filters=filters)]
+
+    def _describe_internet_gateway(self, client, filters):
+        return [(gateway, self._references(
+                    vpc_ids=[attachment.vpc_id
+                             for attachment in gateway.attachments]))
+                for gateway in client.get_all_internet_gateways(
+                    filters=filters)]
+
+    def _describe_vpn_gateway(self, client, filters):
+        return [(gateway, self._references(
+                    vpc_ids=[attachment.vpc_id
+                             for attachment in gateway.attachments
+                             if attachment.state != 'detached']))
+                for gateway in client.get_all_vpn_gateways(filters=filters)
+                if gateway.state != 'deleted']
+
+    def _describe_customer_gateway(self, client, filters):
+        return [(gateway, self._references())
+                for gateway in client.get_all_customer_gateways(
+                    filters=filters)
+                if gateway.state != 'deleted']
+
+    def _describe_dhcp_options(self, client, filters):
+        return [(dhcp_options, self._references())
+                for dhcp_options in client.get_all_dhcp_options(
+                    filters=filters)]
+
+    def _delete_resource(self, resource):
+        """Deletes one resource. Deletes that are refused because of
+        a dependency that AWS has not released yet are retried.
+
+        :returns the NonRecoverableError that occurred, or None.
+        """
+
+        client = self.client(self.aws_config)
+        delete = getattr(
+            self, '_delete_{0}'.format(resource['resource_type']))
+
+        for attempt in range(constants.TEARDOWN_DELETE_ATTEMPTS):
+            try:
+                delete(client, resource)
+            except exception.EC2ResponseError as e:
+                if e.error_code and e.error_code.endswith('NotFound'):
+                    return None
+                if e.error_code in constants.CLEANUP_RETRY_ERRORS \
+                        and attempt + 1 < constants.TEARDOWN_DELETE_ATTEMPTS:
+                    time.sleep(constants.TEARDOWN_WAIT_INTERVAL)
+                    continue
+                error = e
+            except exception.BotoServerError as e:
+                error = e
+            else:
+                return None
+
+            return NonRecoverableError(
+                'Unable to delete {0} {1}: {2}'
+                .format(resource['resource_type'], resource['id'],
+                        str(error)))
+
+    def _wait_for_termination(self, instance_ids):
+
+        client = self.client(self.aws_config)
+
+        for _ in range(constants.TEARDOWN_WAIT_ATTEMPTS):
+            try:
+                instances = client.get_only_instances(
+                    instance_ids=instance_ids)
+            except (exception.EC2ResponseError,
+                    exception.BotoServerError) as e:
+                self.errors.append(NonRecoverableError('{0}'.format(str(e))))
+                return
+            if all(instance.state_code ==
+                   ec2_constants.INSTANCE_STATE_TERMINATED
+                   for instance in instances):
+                return
+            time.sleep(constants.TEARDOWN_WAIT_INTERVAL)
+
+        self.errors.append(NonRecoverableError(
+            'Instances {0} were not terminated in time.'
+            .format(', '.join(instance_ids))))
+
+    def _delete_instance(self, client, resource):
+        client.terminate_instances(instance_ids=[resource['id']])
+
+    def _delete_security_group(self, client, resource):
+        client.delete_security_group(group_id=resource['id'])
+
+    def _delete_vpc(self, client, resource):
+        client.delete_vpc(resource['id'])
+
+    def _delete_subnet(self, client, resource):
+        client.delete_subnet(resource['id'])
+
+    def _delete_route_table(self, client, resource):
+        for association_id in resource['association_ids']:
+            client.disassociate_route_table(association_id)
+        client.delete_route_table(resource['id'])
+
+    def _delete_network_acl(self, client, resource):
+        client.delete_network_acl(resource['id'])
+
+    def _delete_internet_gateway(self, client, resource):
+        for vpc_id in resource['vpc_ids']:
+            client.detach_internet_gateway(resource['id'], vpc_id)
+        client.delete_internet_gateway(resource['id'])
+
+    def _delete_vpn_gateway(self, client, resource):
+        for vpc_id in resource['vpc_ids']:
+            client.detach_vpn_gateway(resource['id'], vpc_id)
+        client.delete_vpn_gateway(resource['id'])
+
+    def _delete_customer_gateway(self, client, resource):
+        client.delete_customer_gateway(resource['id'])
+
+    def _delete_dhcp_options(self, client, resource):
+        client.delete_dhcp_options(resource['id'])
+
+    def _delete_volume(self, client, resource):
+        client.delete_volume(resource['id'])
+
+
+class OrphanSweeper(TeardownPlanner):
+    """Deletes the resources left behind by deployments that no longer
+    exist: those the plugin created for this manager, as its owner tag
+    says, and tagged with a deployment ID that is not live. Besides the
+    resources of a teardown, it deletes tagged volumes.
+    """
+
+    resource_types = constants.TEARDOWN_RESOURCES + [constants.VOLUME]
+
+    def __init__(self, live_deployment_ids, aws_config=None,
+                 max_workers=None, owner=None):
+        super(OrphanSweeper, self).__init__(None, aws_config, max_workers)
+        self.live_deployment_ids = set(live_deployment_ids)
+        self.owner = owner or ec2_utils.get_owner()
+
+    @property
+    def filters(self):
+        return {'tag:{0}'.format(ec2_constants.OWNER_TAG): self.owner}
+
+    def snapshot(self):
+        """Describes the resources of this manager tagged with the ID of
+        a deployment that is not live.
+
+        :returns a list of resource dicts, as for TeardownPlanner.
+        """
+
+        return [resource
+                for resource in super(OrphanSweeper, self).snapshot()
+                if resource['deployment_id'] and
+                resource['deployment_id'] not in self.live_deployment_ids]
+
+    def report(self, resources):
+        """Describes what sweeping the resources deletes, and in which
+        order, without deleting anything.
+
+        :param resources: A list of resource dicts, as from snapshot.
+        :returns a list of lines, one per level of the deletion plan,
+            with the IDs of its resources by deployment and type.
+        """
+
+        lines = []
+
+        for index, level in enumerate(plan_levels(self.plan(resources))):
+            resource_ids = dict()
+            for resource in level:
+                resource_ids.setdefault(
+                    (resource['deployment_id'], resource['resource_type']),
+                    []).append(resource['id'])
+            lines.append('Level {0}: {1}'.format(
+                index + 1,
+                '; '.join(
+                    '{0} of deployment {1}: {2}'.format(
+                        resource_type, deployment_id,
+                        ', '.join(sorted(ids)))
+                    for (deployment_id, resource_type), ids
+                    in sorted(resource_ids.items()))))
+
+        return lines
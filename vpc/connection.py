@@ -15,7 +15,6 @@
 
 # Third-party Imports
 from boto.ec2 import get_region
-from boto.vpc import VPCConnection
 
 # Cloudify imports
 from ec2.connection import EC2ConnectionClient
@@ -27,12 +26,15 @@ class VPCConnectionClient(EC2ConnectionClient):
     """Provides functions for getting the VPC Client
     """
 
-    def client(self, aws_config=None):
-        """Represents the VPCConnection Client
+    def _connect(self, aws_config_property):
+        """Returns the VPCConnection of an AWS config, or the default
+        one if there is none.
         """
 
-        aws_config_property = (self._get_aws_config_property(aws_config) or
-                               self._get_aws_config_from_file())
+        # imported here, so that the VPC modules load boto.vpc only
+        # once they connect, and not to plan or validate
+        from boto.vpc import VPCConnection
+
         if not aws_config_property:
             return VPCConnection()
         elif aws_config_property.get('ec2_region_name'):
@@ -14,9 +14,17 @@
 #    * limitations under the License.
 
 EXTERNAL_RESOURCE_ID = 'aws_resource_id'
+EXTERNAL_RESOURCE_STATE = 'external_resource'
 AVAILABILITY_ZONE = 'availability_zone'
 AWS_CONFIG_PROPERTY = 'aws_config'
 ROUTE_NOT_FOUND_ERROR = 'InvalidRoute.NotFound'
+# route fields naming the target of a route, in CreateRoute's order
+ROUTE_TARGETS = ['gateway_id', 'instance_id', 'interface_id',
+                 'vpc_peering_connection_id']
+# routes that belong to the route table itself and are never deleted
+ROUTE_LOCAL_GATEWAY = 'local'
+ROUTE_PROPAGATED_ORIGIN = 'EnableVgwRoutePropagation'
+SUBNET_CONFLICT_ERROR = 'InvalidSubnet.Conflict'
 
 VPC = dict(
     AWS_RESOURCE_TYPE='vpc',
@@ -102,3 +110,34 @@ DHCP_VPC_RELATIONSHIP = \
     'cloudify.aws.relationships.dhcp_options_associated_with_vpc'
 CUSTOMER_VPC_RELATIONSHIP = \
     'cloudify.aws.relationships.customer_gateway_connected_to_vpn_gateway'
+
+# topology module constants
+TOPOLOGY_RESOURCES = [VPC, SUBNET, ROUTE_TABLE, NETWORK_ACL,
+                      INTERNET_GATEWAY, DHCP_OPTIONS]
+TOPOLOGY_VPC_RELATIONSHIPS = [SUBNET_IN_VPC, ROUTE_TABLE_VPC_RELATIONSHIP,
+                              NETWORK_ACL_IN_VPC_RELATIONSHIP]
+TOPOLOGY_BUILT = 'built_by_topology'
+TOPOLOGY_ASSIGN_OPERATION = 'cloudify.interfaces.aws.topology.assign'
+
+# cleanup module constants
+INSTANCE = dict(
+    AWS_RESOURCE_TYPE='instance',
+    CLOUDIFY_NODE_TYPE='cloudify.aws.nodes.Instance'
+)
+SECURITY_GROUP = dict(
+    AWS_RESOURCE_TYPE='security_group',
+    CLOUDIFY_NODE_TYPE='cloudify.aws.nodes.SecurityGroup'
+)
+TEARDOWN_RESOURCES = [INSTANCE, SECURITY_GROUP, VPC, SUBNET, ROUTE_TABLE,
+                      NETWORK_ACL, INTERNET_GATEWAY, VPN_GATEWAY,
+                      CUSTOMER_GATEWAY, DHCP_OPTIONS]
+VOLUME = dict(
+    AWS_RESOURCE_TYPE='volume',
+    CLOUDIFY_NODE_TYPE='cloudify.aws.nodes.Volume'
+)
+TEARDOWN_RELEASE_OPERATION = 'cloudify.interfaces.aws.teardown.release'
+CLEANUP_RETRY_ERRORS = ['DependencyViolation', 'VolumeInUse']
+DESCRIBE_PAGE_SIZE = 1000
+TEARDOWN_DELETE_ATTEMPTS = 5
+TEARDOWN_WAIT_INTERVAL = 5
+TEARDOWN_WAIT_ATTEMPTS = 60
@@ -13,12 +13,20 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+# Built-in Imports
+from collections import OrderedDict
+
+# Third-party Imports
+from boto import exception
+
 # Cloudify imports
 from ec2 import utils as ec2_utils
 from . import constants
+from . import connection
 from core.base import AwsBaseNode, AwsBaseRelationship
 from cloudify import ctx
 from cloudify.decorators import operation
+from cloudify.exceptions import RecoverableError
 
 
 @operation
@@ -95,10 +103,21 @@ def detach_gateway(**_):
     return GatewayVpcAttachment().disassociated()
 
 
+def get_vpn_route_key(route):
+    """Returns the key of a VPN connection static route, since a
+    connection has one route per destination.
+
+    :param route: A route dict.
+    :returns the destination CIDR block of the route.
+    """
+
+    return route['destination_cidr_block']
+
+
 class VpnConnection(AwsBaseRelationship):
 
     def __init__(self, routes=None):
-        super(VpnConnection, self).__init__(routes)
+        super(VpnConnection, self).__init__()
         self.vpn_type = ctx.source.node.properties['type']
         self.routes = \
             routes if routes else \
@@ -116,21 +135,27 @@ class VpnConnection(AwsBaseRelationship):
         }
 
     def associate(self):
-        associate_args = self.generate_associate_args(self.routes)
-        vpn_connection = self.execute(self.client.create_vpn_connection,
-                                      associate_args, raise_on_falsy=True)
-        ctx.source.instance.runtime_properties['vpn_connection'] = \
-            vpn_connection.id
-        ctx.source.instance.runtime_properties['vpn_gateway'] = \
-            vpn_connection.vpn_gateway_id
-        if 'routes' not in ctx.source.instance.runtime_properties.keys():
-            ctx.source.instance.runtime_properties['routes'] = []
-        if self.routes:
-            for route in self.routes:
-                args = self.generate_route_args(vpn_connection.id, route)
-                self.execute(self.client.create_vpn_connection_route,
-                             args, raise_on_falsy=True)
-                ctx.source.instance.runtime_properties['routes'].append(route)
+        with ec2_utils.RuntimePropertyStage(ctx.source.instance) as \
+                runtime_properties:
+            if self.vpn_connection_id:
+                # a retry after a failed route reuses the connection,
+                # and describes the routes it already has
+                live_routes = None
+            else:
+                associate_args = self.generate_associate_args(self.routes)
+                vpn_connection = self.execute(
+                    self.client.create_vpn_connection,
+                    associate_args, raise_on_falsy=True)
+                self.vpn_connection_id = vpn_connection.id
+                runtime_properties['vpn_connection'] = vpn_connection.id
+                runtime_properties['vpn_gateway'] = \
+                    vpn_connection.vpn_gateway_id
+                # a new connection has no routes yet, so none are described
+                live_routes = []
+            self.program_routes(
+                self.vpn_connection_id, runtime_properties.list(
+                    'routes', get_vpn_route_key),
+                create=self.routes, live_routes=live_routes)
         return True
 
     def generate_associate_args(self, routes):
@@ -150,15 +175,111 @@ class VpnConnection(AwsBaseRelationship):
         )
         return args
 
+    def get_live_routes(self, vpn_connection_id):
+        """Returns the destinations of the static routes of a VPN
+        connection, but those being deleted.
+
+        :param vpn_connection_id: The ID of the VPN connection.
+        :returns a set of CIDR blocks.
+        """
+
+        vpn_connections = self.execute(
+            self.client.get_all_vpn_connections,
+            dict(vpn_connection_ids=[vpn_connection_id]))
+
+        return set(
+            route.destination_cidr_block
+            for vpn_connection in vpn_connections or []
+            for route in vpn_connection.static_routes or []
+            if route.state not in ('deleting', 'deleted'))
+
+    def program_routes(self, vpn_connection_id, staged_routes,
+                       create=None, delete=None, live_routes=None):
+        """Creates and deletes static routes of a VPN connection.
+        Only the routes missing from, or present in, the connection are
+        sent, concurrently, and throttled requests are retried in place.
+
+        :param vpn_connection_id: The ID of the VPN connection.
+        :param staged_routes: The StagedList of the routes runtime
+            property, which keeps the routes in place after the calls.
+        :param create: The route dicts to create.
+        :param delete: The route dicts to delete.
+        :param live_routes: The destinations of the routes of the
+            connection, if they are known. Otherwise they are described.
+        :returns the number of requests sent.
+        :raises RecoverableError: If a request failed.
+        """
+
+        if live_routes is None:
+            live_routes = self.get_live_routes(vpn_connection_id)
+
+        # one change per destination, as a connection has one route each
+        changes = OrderedDict()
+        for route in create or []:
+            if get_vpn_route_key(route) in live_routes:
+                staged_routes.add(route)
+            else:
+                changes[get_vpn_route_key(route)] = ('create', route)
+        for route in delete or []:
+            if get_vpn_route_key(route) in live_routes:
+                changes[get_vpn_route_key(route)] = ('delete', route)
+            else:
+                staged_routes.discard(route)
+        changes = changes.values()
+
+        ctx.logger.info(
+            'VPN connection {0}: {1} static routes to program.'
+            .format(vpn_connection_id, len(changes)))
+
+        errors = ec2_utils.run_concurrently(
+            lambda change: self._apply_route_change(
+                vpn_connection_id, change), changes)
+
+        for (action, route), error in zip(changes, errors):
+            if error:
+                continue
+            if action == 'create':
+                staged_routes.add(route)
+            else:
+                staged_routes.discard(route)
+
+        for error in errors:
+            if error:
+                raise RecoverableError('{0}'.format(str(error)))
+
+        return len(changes)
+
+    def _apply_route_change(self, vpn_connection_id, change):
+        """Creates or deletes one static route, with a client of its
+        own, since it runs in a thread of program_routes.
+
+        :returns None, or the EC2ResponseError of the change.
+        """
+
+        action, route = change
+        client = connection.VPCConnectionClient().client()
+        function = client.create_vpn_connection_route \
+            if action == 'create' else client.delete_vpn_connection_route
+
+        try:
+            ec2_utils.call_with_throttling_retry(
+                function, **self.generate_route_args(
+                    vpn_connection_id, route))
+        except exception.EC2ResponseError as e:
+            if action == 'delete' and \
+                    e.error_code == constants.ROUTE_NOT_FOUND_ERROR:
+                return None
+            return e
+
+        return None
+
     def disassociate(self):
-        if self.routes:
-            for route in self.routes:
-                args = self.generate_route_args(self.vpn_connection_id, route)
-                if self.execute(
-                        self.client.delete_vpn_connection_route,
-                        args, raise_on_falsy=True):
-                    ctx.source.instance.runtime_properties['routes'].remove(
-                        route)
+        with ec2_utils.RuntimePropertyStage(ctx.source.instance) as \
+                runtime_properties:
+            self.program_routes(
+                self.vpn_connection_id, runtime_properties.list(
+                    'routes', get_vpn_route_key),
+                delete=self.routes)
         disassociate_args = dict(vpn_connection_id=self.vpn_connection_id)
         return self.execute(self.client.delete_vpn_connection,
                             disassociate_args, raise_on_falsy=True)
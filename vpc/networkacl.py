@@ -118,9 +118,15 @@ class NetworkAcl(AwsBaseNode):
         self.add_entries_to_network_acl()
         return True
 
+    def use_built_resource(self):
+        if not super(NetworkAcl, self).use_built_resource():
+            return False
+        self.add_entries_to_network_acl()
+        return True
+
     def generate_create_args(self):
         relationships = \
-            self.get_related_targets_and_types(ctx.instance.relationships)
+            self.get_related_targets_and_types(ctx.instance)
         vpc_ids = \
             self.get_target_ids_of_relationship_type(
                 constants.NETWORK_ACL_IN_VPC_RELATIONSHIP, relationships)
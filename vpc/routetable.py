@@ -13,6 +13,9 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+# Built-in Imports
+from collections import OrderedDict
+
 # Cloudify imports
 from . import constants
 from core.base import AwsBaseNode, AwsBaseRelationship, RouteMixin
@@ -32,6 +35,11 @@ def create_route_table(routes, **_):
     return RouteTable(routes).created()
 
 
+@operation
+def reconcile_route_table(routes=None, delete_unmanaged=False, **_):
+    return RouteTable().reconcile(routes, delete_unmanaged)
+
+
 @operation
 def start_route_table(**_):
     return RouteTable().started()
@@ -163,22 +171,76 @@ class RouteTable(AwsBaseNode, RouteMixin):
             in ctx.instance.runtime_properties.keys() else routes
 
     def create(self):
+        route_table_id = ctx.instance.runtime_properties.get(
+            constants.EXTERNAL_RESOURCE_ID)
+        if route_table_id:
+            # a retry after a failed route adopts the route table created
+            # before, and diffs its routes again
+            self.resource_id = route_table_id
+            self.reconcile_routes(route_table_id, self.routes, ctx.instance)
+            return True
+
         create_args = self._generate_creation_args()
         route_table = \
             self.execute(self.client.create_route_table,
                          create_args, raise_on_falsy=True)
         self.resource_id = route_table.id
-        for route in self.routes:
-            self.create_route(route_table.id, route, ctx.instance)
+        ec2_utils.set_external_resource_id(self.resource_id, ctx.instance)
+        self.reconcile_routes(route_table.id, self.routes, ctx.instance,
+                              live_routes=route_table.routes)
+        return True
+
+    def use_built_resource(self):
+        if not super(RouteTable, self).use_built_resource():
+            return False
+        self.reconcile_routes(self.resource_id, self.routes, ctx.instance)
         return True
 
+    def reconcile(self, routes=None, delete_unmanaged=False):
+        """Repairs the routes of the route table after drift. The wanted
+        routes are those recorded in the routes runtime property, which
+        includes the routes of gateway and peering relationships, with
+        the given routes replacing any to the same destination.
+        """
+
+        wanted = OrderedDict()
+        for route in list(ctx.instance.runtime_properties.get('routes') or
+                          []) + list(routes or []):
+            wanted[route['destination_cidr_block']] = route
+
+        self.reconcile_routes(
+            ctx.instance.runtime_properties.get(
+                constants.EXTERNAL_RESOURCE_ID),
+            wanted.values(), ctx.instance,
+            delete_unmanaged=delete_unmanaged,
+            kept_peering_connection_ids=self.get_peering_connection_ids())
+        return True
+
+    def get_peering_connection_ids(self):
+        """Returns the IDs of the VPC peering connections of the route
+        table and of its VPC. The return routes of a peering connection
+        are added to the route tables of the peer VPC, and are only
+        recorded in the runtime properties of that VPC.
+        """
+
+        runtime_properties = [ctx.instance.runtime_properties] + [
+            relationship.target.instance.runtime_properties
+            for relationship in self.get_related_targets_and_types(
+                ctx.instance).get(constants.ROUTE_TABLE_VPC_RELATIONSHIP)]
+
+        return set(
+            vpc_peering_connection['vpc_peering_connection_id']
+            for properties in runtime_properties
+            for vpc_peering_connection in
+            properties.get('vpc_peering_connections') or [])
+
     def _generate_creation_args(self):
         vpc = self.get_containing_vpc()
         return dict(vpc_id=vpc.id)
 
     def get_containing_vpc(self):
         relationships = \
-            self.get_related_targets_and_types(ctx.instance.relationships)
+            self.get_related_targets_and_types(ctx.instance)
         vpc_ids = \
             self.get_target_ids_of_relationship_type(
                 constants.ROUTE_TABLE_VPC_RELATIONSHIP, relationships)
@@ -206,13 +268,14 @@ class RouteTable(AwsBaseNode, RouteMixin):
         return True
 
     def delete(self):
-        for route in self.routes:
-            self.delete_route(
-                ctx.instance.runtime_properties.get(
-                    constants.EXTERNAL_RESOURCE_ID),
-                route,
-                route_table_ctx_instance=ctx.instance
-            )
+        with self.route_batch(ctx.instance):
+            for route in list(self.routes or []):
+                self.delete_route(
+                    ctx.instance.runtime_properties.get(
+                        constants.EXTERNAL_RESOURCE_ID),
+                    route,
+                    route_table_ctx_instance=ctx.instance
+                )
         delete_args = dict(
             route_table_id=ctx.instance.runtime_properties.get(
                 constants.EXTERNAL_RESOURCE_ID
@@ -13,12 +13,20 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+# Built-in Imports
+import bisect
+import socket
+import struct
+
+# Third-party Imports
+from boto import exception
+
 # Cloudify imports
 from . import constants
 from core.base import AwsBaseNode
 from cloudify import ctx
 from cloudify.decorators import operation
-from cloudify.exceptions import NonRecoverableError
+from cloudify.exceptions import NonRecoverableError, RecoverableError
 
 
 @operation
@@ -56,15 +64,32 @@ class Subnet(AwsBaseNode):
 
     def create(self):
         create_args = self._generate_creation_args()
-        subnet = self.execute(self.client.create_subnet,
-                              create_args, raise_on_falsy=True)
+
+        if not is_prefix_length(ctx.node.properties['cidr_block']):
+            subnet = self.execute(self.client.create_subnet,
+                                  create_args, raise_on_falsy=True)
+            self.resource_id = subnet.id
+            return True
+
+        try:
+            subnet = self.client.create_subnet(**create_args)
+        except exception.EC2ResponseError as e:
+            if constants.SUBNET_CONFLICT_ERROR in str(e):
+                raise RecoverableError(
+                    'Subnet {0} was taken concurrently. Planning again.'
+                    .format(create_args['cidr_block']))
+            raise NonRecoverableError('{0}'.format(str(e)))
+        except exception.BotoServerError as e:
+            raise NonRecoverableError('{0}'.format(str(e)))
+
         self.resource_id = subnet.id
+        ctx.instance.runtime_properties['cidr_block'] = subnet.cidr_block
         return True
 
     def _generate_creation_args(self):
 
         relationships = \
-            self.get_related_targets_and_types(ctx.instance.relationships)
+            self.get_related_targets_and_types(ctx.instance)
 
         vpc_ids = self.get_target_ids_of_relationship_type(
             constants.SUBNET_IN_VPC, relationships)
@@ -84,6 +109,15 @@ class Subnet(AwsBaseNode):
             cidr_block=ctx.node.properties['cidr_block']
         )
 
+        if is_prefix_length(create_args['cidr_block']):
+            subnets = self.iterate_resources_by_matcher(
+                self.client.get_all_subnets,
+                {'filters': {'vpc-id': vpc.id}})
+            allocator = CidrAllocator(
+                vpc.cidr_block, [subnet.cidr_block for subnet in subnets])
+            create_args['cidr_block'] = \
+                allocator.allocate(create_args['cidr_block'])
+
         if ctx.node.properties[constants.AVAILABILITY_ZONE]:
             create_args.update(
                 {
@@ -101,3 +135,75 @@ class Subnet(AwsBaseNode):
         delete_args = dict(subnet_id=self.resource_id)
         return self.execute(self.client.delete_subnet,
                             delete_args, raise_on_falsy=True)
+
+
+def is_prefix_length(cidr_block):
+    """A cidr_block of the form /24 asks for a block of that size to be
+    carved out of the VPC CIDR block.
+    """
+
+    return cidr_block.startswith('/')
+
+
+def _cidr_to_interval(cidr_block):
+
+    address, prefix_length = cidr_block.split('/')
+    size = 2 ** (32 - int(prefix_length))
+    start = struct.unpack('!I', socket.inet_aton(address))[0] & \
+        (0xFFFFFFFF ^ (size - 1))
+
+    return start, start + size
+
+
+class CidrAllocator(object):
+    """Carves CIDR blocks out of a VPC CIDR block. The blocks in use are
+    kept as intervals of addresses sorted by start, and each allocation
+    takes the lowest free block of the requested size.
+    """
+
+    def __init__(self, cidr_block, reserved_cidr_blocks=None):
+        self.start, self.end = _cidr_to_interval(cidr_block)
+        self.cidr_block = cidr_block
+        self._starts = []
+        self._ends = []
+
+        for reserved_cidr_block in reserved_cidr_blocks or []:
+            self.reserve(reserved_cidr_block)
+
+    def reserve(self, cidr_block):
+        """Marks a CIDR block as in use.
+        """
+
+        start, end = _cidr_to_interval(cidr_block)
+        index = bisect.bisect(self._starts, start)
+        self._starts.insert(index, start)
+        self._ends.insert(index, end)
+
+    def allocate(self, prefix_length):
+        """Reserves the lowest free block of a size.
+
+        :param prefix_length: The size of the block, such as 24 or '/24'.
+        :returns the CIDR block.
+        :raises NonRecoverableError: If no such block is free.
+        """
+
+        prefix_length = int(str(prefix_length).lstrip('/'))
+        size = 2 ** (32 - prefix_length)
+        candidate = -(-self.start // size) * size
+
+        for start, end in zip(self._starts, self._ends):
+            if candidate + size <= start:
+                break
+            if end > candidate:
+                candidate = -(-end // size) * size
+
+        if candidate + size > self.end:
+            raise NonRecoverableError(
+                'No free /{0} block left in {1}.'
+                .format(prefix_length, self.cidr_block))
+
+        cidr_block = '{0}/{1}'.format(
+            socket.inet_ntoa(struct.pack('!I', candidate)), prefix_length)
+        self.reserve(cidr_block)
+
+        return cidr_block
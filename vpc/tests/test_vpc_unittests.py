@@ -18,21 +18,29 @@ import mock
 
 # Third-party Imports
 from moto import mock_ec2
+from boto import exception
 
 # Cloudify Imports
-from vpc import vpc, subnet, routetable, dhcp
+from vpc import vpc, subnet, routetable, dhcp, topology, cleanup, gateway
+from vpc import workflows
+from core.base import AwsBase, RouteMixin, RouteStore
 
 from vpc_testcase import VpcTestCase
 from cloudify.state import current_ctx
-from cloudify.exceptions import NonRecoverableError
+from cloudify.mocks import MockContext, MockCloudifyContext
+from cloudify.exceptions import NonRecoverableError, RecoverableError
 from vpc import constants
+from ec2 import constants as ec2_constants
+from ec2 import utils as ec2_utils
 
 VPC_TYPE = 'cloudify.aws.nodes.VPC'
 SUBNET_TYPE = 'cloudify.aws.nodes.Subnet'
 DHCP_OPTIONS_TYPE = 'cloudify.aws.nodes.DHCPOptions'
 ROUTE_TABLE_TYPE = 'cloudify.aws.nodes.RouteTable'
+SECURITY_GROUP_TYPE = 'cloudify.aws.nodes.SecurityGroup'
 TEST_VPC_CIDR = '10.10.10.0/16'
 TEST_SUBNET_CIDR = '10.10.10.0/24'
+TEST_AMI_IMAGE_ID = 'ami-e214778a'
 
 
 class TestVpcModule(VpcTestCase):
@@ -74,6 +82,95 @@ class TestVpcModule(VpcTestCase):
                           ctx.instance.id)
         self.assertEquals(vpc_object.tags.get('deployment_id'),
                           ctx.deployment.id)
+        self.assertEquals(vpc_object.tags.get(ec2_constants.OWNER_TAG),
+                          ec2_utils.get_owner())
+
+    @mock_ec2
+    def test_external_vpc_is_described_once(self, *_):
+
+        ctx = self.get_mock_vpc_node_instance_context(
+            'test_external_vpc_is_described_once')
+        vpc_client = self.create_client()
+        vpc_id = vpc_client.create_vpc(TEST_VPC_CIDR).id
+        ctx.node.properties['use_external_resource'] = True
+        ctx.node.properties['resource_id'] = vpc_id
+
+        with mock.patch('boto.vpc.VPCConnection.get_all_vpcs',
+                        side_effect=vpc_client.get_all_vpcs) as get_all_vpcs:
+            for operation in [vpc.creation_validation, vpc.create_vpc,
+                              vpc.start, vpc.delete]:
+                current_ctx.set(ctx=ctx)
+                operation(ctx=ctx)
+
+        self.assertEquals(1, get_all_vpcs.call_count)
+        self.assertEquals(
+            ctx.deployment.id,
+            vpc_client.get_all_vpcs(vpc_id)[0].tags.get('deployment_id'))
+        self.assertNotIn(ec2_constants.OWNER_TAG,
+                         vpc_client.get_all_vpcs(vpc_id)[0].tags)
+        self.assertNotIn(constants.EXTERNAL_RESOURCE_STATE,
+                         ctx.instance.runtime_properties)
+
+    @mock_ec2
+    def test_external_vpc_is_described_again_after_ttl(self, *_):
+
+        ctx = self.get_mock_vpc_node_instance_context(
+            'test_external_vpc_is_described_again_after_ttl')
+        vpc_client = self.create_client()
+        vpc_id = vpc_client.create_vpc(TEST_VPC_CIDR).id
+        ctx.node.properties['use_external_resource'] = True
+        ctx.node.properties['resource_id'] = vpc_id
+        current_ctx.set(ctx=ctx)
+        vpc_node = vpc.Vpc()
+
+        self.assertEquals(vpc_id, vpc_node.get_external_resource().id)
+        state = ctx.instance.runtime_properties[
+            constants.EXTERNAL_RESOURCE_STATE]
+        etag = state['etag']
+
+        state['described_at'] -= ec2_constants.EXTERNAL_RESOURCE_STATE_TTL
+        with mock.patch('boto.vpc.VPCConnection.get_all_vpcs',
+                        side_effect=vpc_client.get_all_vpcs) as get_all_vpcs:
+            vpc_node = vpc.Vpc()
+            self.assertEquals(vpc_id, vpc_node.get_external_resource().id)
+            self.assertEquals(vpc_id, vpc_node.get_external_resource().id)
+        self.assertEquals(1, get_all_vpcs.call_count)
+        self.assertEquals(etag, ctx.instance.runtime_properties[
+            constants.EXTERNAL_RESOURCE_STATE]['etag'])
+
+        vpc_client.delete_vpc(vpc_id)
+        ctx.instance.runtime_properties[constants.EXTERNAL_RESOURCE_STATE][
+            'described_at'] -= ec2_constants.EXTERNAL_RESOURCE_STATE_TTL
+        vpc_node = vpc.Vpc()
+        self.assertIsNone(vpc_node.get_external_resource())
+        self.assertNotIn(constants.EXTERNAL_RESOURCE_STATE,
+                         ctx.instance.runtime_properties)
+
+    @mock_ec2
+    def test_filter_for_single_resource(self, *_):
+
+        vpc_client = self.create_client()
+        vpc_id = vpc_client.create_vpc(TEST_VPC_CIDR).id
+        vpc_client.create_vpc('10.20.0.0/16')
+        base = AwsBase(client=vpc_client)
+
+        with mock.patch('boto.vpc.VPCConnection.get_all_vpcs',
+                        side_effect=vpc_client.get_all_vpcs) as get_all_vpcs:
+            for _ in range(2):
+                resource = base.filter_for_single_resource(
+                    vpc_client.get_all_vpcs,
+                    {'filters': {'cidr-block': TEST_VPC_CIDR},
+                     'vpc_ids': vpc_id})
+                self.assertEquals(vpc_id, resource.id)
+            self.assertIsNone(base.filter_for_single_resource(
+                vpc_client.get_all_vpcs,
+                {'filters': {'cidr-block': '10.20.0.0/16'},
+                 'vpc_ids': vpc_id}))
+
+        self.assertEquals(2, get_all_vpcs.call_count)
+        self.assertRaises(
+            NonRecoverableError, base.filter_for_single_resource,
+            vpc_client.get_all_vpcs, {'filters': {'state': 'available'}})
 
     @mock_ec2
     def test_delete_invalid_vpc_id(self):
@@ -133,6 +230,51 @@ class TestSubnetModule(VpcTestCase):
                                   args=None, ctx=ctx)
         self.assertIn('subnet can only be connected to one vpc', error.message)
 
+    @mock_ec2
+    def test_create_adopts_built_subnet(self, *_):
+        ctx = self.get_mock_subnet_node_instance_context(
+            'test_create_adopts_built_subnet')
+        vpc_client = self.create_client()
+        vpc = vpc_client.create_vpc(TEST_VPC_CIDR)
+        subnet_id = vpc_client.create_subnet(vpc.id, TEST_SUBNET_CIDR).id
+        ctx.instance.runtime_properties['aws_resource_id'] = subnet_id
+        ctx.instance.runtime_properties[constants.TOPOLOGY_BUILT] = True
+        subnet.create_subnet(ctx=ctx)
+        self.assertEquals(
+            subnet_id, ctx.instance.runtime_properties['aws_resource_id'])
+        self.assertEquals(1, len(vpc_client.get_all_subnets(
+            filters={'vpc-id': vpc.id})))
+
+    def test_cidr_allocator(self):
+        allocator = subnet.CidrAllocator(
+            '10.0.0.0/16', ['10.0.0.0/24', '10.0.2.0/23', '10.1.0.0/24'])
+        self.assertEquals('10.0.1.0/24', allocator.allocate('/24'))
+        self.assertEquals('10.0.4.0/22', allocator.allocate(22))
+        self.assertEquals('10.0.8.0/24', allocator.allocate(24))
+        self.assertEquals('10.0.128.0/17', allocator.allocate(17))
+        error = self.assertRaises(
+            NonRecoverableError, allocator.allocate, 17)
+        self.assertIn('No free /17 block left', error.message)
+
+    @mock_ec2
+    def test_create_carves_subnet(self, *_):
+        vpc_client = self.create_client()
+        vpc = vpc_client.create_vpc('10.20.0.0/16')
+        vpc_client.create_subnet(vpc.id, '10.20.0.0/24')
+        ctx = self.get_mock_subnet_node_instance_context(
+            'test_create_carves_subnet', {'cidr_block': '/24'})
+        ctx.instance.relationships = [MockContext({
+            'type': constants.SUBNET_IN_VPC,
+            'target': MockContext({
+                'instance': MockContext({
+                    'runtime_properties': {'aws_resource_id': vpc.id}
+                })
+            })
+        })]
+        subnet.create_subnet(ctx=ctx)
+        self.assertEquals(
+            '10.20.1.0/24', ctx.instance.runtime_properties['cidr_block'])
+
     @mock_ec2
     def test_start_subnet(self, *_):
         ctx = self.get_mock_subnet_node_instance_context('test_start_subnet')
@@ -231,6 +373,314 @@ class TestRouteTableModule(VpcTestCase):
         self.assertNotIn(ctx.instance.runtime_properties,
                          constants.EXTERNAL_RESOURCE_ID)
 
+    @mock_ec2
+    def test_route_store(self):
+        client = self.create_client()
+        vpc = self.create_vpc(client)
+        route_table = self.create_route_table(client, vpc)
+        gateway = client.create_internet_gateway()
+        client.attach_internet_gateway(gateway.id, vpc.id)
+        for destination_cidr_block in ['10.1.0.0/16', '10.2.0.0/16']:
+            client.create_route(route_table.id, destination_cidr_block,
+                                gateway_id=gateway.id)
+
+        routes = RouteStore([
+            {'destination_cidr_block': '10.1.0.0/16',
+             'gateway_id': gateway.id},
+            {'destination_cidr_block': '10.3.0.0/16',
+             'gateway_id': gateway.id}])
+        self.assertIn({'gateway_id': gateway.id,
+                       'destination_cidr_block': '10.1.0.0/16',
+                       'route_table_id': route_table.id}, routes)
+        self.assertFalse(routes.add({'destination_cidr_block': '10.3.0.0/16',
+                                     'gateway_id': gateway.id,
+                                     'route_table_id': route_table.id}))
+
+        live_routes = client.get_all_route_tables(route_table.id)[0].routes
+        to_create, to_replace, to_delete = routes.diff(live_routes)
+        self.assertEquals(['10.3.0.0/16'],
+                          [r['destination_cidr_block'] for r in to_create])
+        self.assertEquals([], to_replace)
+        self.assertEquals(['10.2.0.0/16'],
+                          [r['destination_cidr_block'] for r in to_delete])
+
+        self.assertTrue(routes.discard({'destination_cidr_block':
+                                        '10.1.0.0/16',
+                                        'gateway_id': gateway.id}))
+        routes.add({'destination_cidr_block': '10.1.0.0/16',
+                    'instance_id': 'i-1234abcd'})
+        to_create, to_replace, to_delete = routes.diff(live_routes)
+        self.assertEquals(['10.1.0.0/16'],
+                          [r['destination_cidr_block'] for r in to_replace])
+
+    @mock_ec2
+    @mock.patch('ec2.constants.MAX_CONCURRENT_REQUESTS', 1)
+    def test_reconcile_route_table(self, *_):
+        client = self.create_client()
+        vpc = self.create_vpc(client)
+        route_table = self.create_route_table(client, vpc)
+        gateway = client.create_internet_gateway()
+        other_gateway = client.create_internet_gateway()
+        ctx = self.get_mock_route_table_node_instance_context(
+            'test_reconcile_route_table', vpc)
+        ctx.instance.runtime_properties[
+            constants.EXTERNAL_RESOURCE_ID] = route_table.id
+        ctx.instance.runtime_properties['routes'] = [
+            {'destination_cidr_block': '10.1.0.0/16',
+             'gateway_id': gateway.id},
+            {'destination_cidr_block': '10.2.0.0/16',
+             'gateway_id': gateway.id},
+            {'destination_cidr_block': '10.3.0.0/16',
+             'gateway_id': gateway.id}]
+
+        # 10.1 is in place, 10.2 drifted, 10.3 is missing, 10.4 is extra
+        for destination_cidr_block, gateway_id in [
+                ('10.1.0.0/16', gateway.id),
+                ('10.2.0.0/16', other_gateway.id),
+                ('10.4.0.0/16', gateway.id)]:
+            client.create_route(route_table.id, destination_cidr_block,
+                                gateway_id=gateway_id)
+
+        # 10.6 is the return route of a peering connection to the VPC
+        peer_vpc = client.create_vpc('10.6.0.0/16')
+        vpc_peering_connection = client.create_vpc_peering_connection(
+            peer_vpc.id, vpc.id)
+        client.create_route(
+            route_table.id, '10.6.0.0/16',
+            vpc_peering_connection_id=vpc_peering_connection.id)
+        ctx.instance.relationships = [MockContext({
+            'type': constants.ROUTE_TABLE_VPC_RELATIONSHIP,
+            'target': MockContext({
+                'node': MockContext({'properties': {}}),
+                'instance': MockContext({'runtime_properties': {
+                    ec2_constants.EXTERNAL_RESOURCE_ID: vpc.id,
+                    'vpc_peering_connections': [{
+                        'vpc_peering_connection_id':
+                            vpc_peering_connection.id}]}})})})]
+
+        apply_route_change = routetable.RouteTable._apply_route_change
+        with mock.patch('core.base.RouteMixin._apply_route_change',
+                        autospec=True, side_effect=apply_route_change) \
+                as apply_route_change:
+            routetable.reconcile_route_table(
+                routes=[{'destination_cidr_block': '10.5.0.0/16',
+                         'gateway_id': other_gateway.id}],
+                delete_unmanaged=True, ctx=ctx)
+        self.assertEquals(4, apply_route_change.call_count)
+
+        live_routes = dict(
+            (route.destination_cidr_block, route.gateway_id)
+            for route in client.get_all_route_tables(
+                route_table.id)[0].routes)
+        self.assertEquals(
+            {'11.0.0.0/24': 'local',
+             '10.1.0.0/16': gateway.id,
+             '10.2.0.0/16': gateway.id,
+             '10.3.0.0/16': gateway.id,
+             '10.5.0.0/16': other_gateway.id,
+             '10.6.0.0/16': None},
+            live_routes)
+        self.assertEquals(
+            ['10.1.0.0/16', '10.2.0.0/16', '10.3.0.0/16', '10.5.0.0/16'],
+            [route['destination_cidr_block'] for route in
+             ctx.instance.runtime_properties['routes']])
+
+        route_mixin = RouteMixin()
+        with route_mixin.route_batch(ctx.instance) as route_store:
+            route_store.add({'destination_cidr_block': '10.6.0.0/16',
+                             'gateway_id': gateway.id})
+            self.assertIs(route_store,
+                          route_mixin.get_route_store(ctx.instance))
+        self.assertEquals(
+            '10.6.0.0/16',
+            ctx.instance.runtime_properties['routes'][-1][
+                'destination_cidr_block'])
+        self.assertIs(route_store, route_mixin.get_route_store(ctx.instance))
+        self.assertNotIn('_route_store', vars(ctx.instance))
+
+    @mock_ec2
+    @mock.patch('ec2.constants.MAX_CONCURRENT_REQUESTS', 1)
+    def test_create_route_table_retry(self, *_):
+        client = self.create_client()
+        vpc = self.create_vpc(client)
+        gateway = client.create_internet_gateway()
+        client.attach_internet_gateway(gateway.id, vpc.id)
+        ctx = self.get_mock_route_table_node_instance_context(
+            'test_create_route_table_retry', vpc)
+        routes = [{'destination_cidr_block': '10.1.0.0/16',
+                   'gateway_id': gateway.id},
+                  {'destination_cidr_block': '10.2.0.0/16',
+                   'gateway_id': gateway.id}]
+        route_error = exception.EC2ResponseError(
+            400, 'Bad Request',
+            '<Response><Errors><Error><Code>InvalidParameterValue</Code>'
+            '<Message>Invalid route</Message></Error></Errors></Response>')
+        apply_route_change = routetable.RouteTable._apply_route_change
+
+        def fail_second_route(route_table, route_table_id, change):
+            if change[1]['destination_cidr_block'] == '10.2.0.0/16':
+                return route_error
+            return apply_route_change(route_table, route_table_id, change)
+
+        # the second route fails, the table and both routes are recorded
+        with mock.patch('vpc.routetable.RouteTable.get_containing_vpc',
+                        return_value=vpc), \
+                mock.patch('core.base.RouteMixin._apply_route_change',
+                           autospec=True, side_effect=fail_second_route):
+            self.assertRaises(RecoverableError,
+                              routetable.create_route_table,
+                              routes=routes, ctx=ctx)
+        route_table_id = \
+            ctx.instance.runtime_properties[constants.EXTERNAL_RESOURCE_ID]
+        self.assertEquals(routes, ctx.instance.runtime_properties['routes'])
+
+        # the retry adopts the table and only creates the missing route
+        current_ctx.set(ctx=ctx)
+        with mock.patch('vpc.routetable.RouteTable.get_containing_vpc',
+                        return_value=vpc):
+            routetable.create_route_table(routes=routes, ctx=ctx)
+        # the main route table of the VPC, and the one created
+        route_tables = client.get_all_route_tables(
+            filters={'vpc-id': vpc.id})
+        self.assertEquals(2, len(route_tables))
+        self.assertIn(route_table_id,
+                      [route_table.id for route_table in route_tables])
+        self.assertEquals(
+            ['10.1.0.0/16', '10.2.0.0/16'],
+            sorted(route.destination_cidr_block
+                   for route in client.get_all_route_tables(
+                       route_table_id)[0].routes
+                   if route.gateway_id == gateway.id))
+
+
+class TestVpnConnection(VpcTestCase):
+
+    def get_mock_vpn_connection_relationship_context(
+            self, test_name, customer_gateway, vpn_gateway):
+
+        customer_gateway_context = MockContext({
+            'node': MockContext({
+                'properties': {
+                    constants.AWS_CONFIG_PROPERTY: {},
+                    'use_external_resource': False,
+                    'resource_id': '',
+                    'type': 'ipsec.1',
+                    'bgp_asn': 65000
+                }
+            }),
+            'instance': MockContext({
+                'runtime_properties': {
+                    constants.EXTERNAL_RESOURCE_ID: customer_gateway.id
+                }
+            })
+        })
+
+        vpn_gateway_context = MockContext({
+            'node': MockContext({
+                'properties': {
+                    constants.AWS_CONFIG_PROPERTY: {},
+                    'use_external_resource': False,
+                    'resource_id': ''
+                }
+            }),
+            'instance': MockContext({
+                'runtime_properties': {
+                    constants.EXTERNAL_RESOURCE_ID: vpn_gateway.id
+                }
+            })
+        })
+
+        return MockCloudifyContext(
+            node_id=test_name, source=customer_gateway_context,
+            target=vpn_gateway_context)
+
+    def get_throttling_error(self):
+        return exception.EC2ResponseError(
+            400, 'Bad Request',
+            '<Response><Errors><Error><Code>Throttling</Code>'
+            '<Message>Rate exceeded</Message></Error></Errors></Response>')
+
+    @mock_ec2
+    @mock.patch('ec2.constants.MAX_CONCURRENT_REQUESTS', 1)
+    @mock.patch('ec2.constants.THROTTLING_RETRY_INTERVAL', 0)
+    def test_program_vpn_connection_routes(self, *_):
+        client = self.create_client()
+        ctx = self.get_mock_vpn_connection_relationship_context(
+            'test_program_vpn_connection_routes',
+            self.create_customer_gateway(client),
+            self.create_vpn_gateway(client))
+        routes = [{'destination_cidr_block': '10.1.0.0/16'},
+                  {'destination_cidr_block': '10.2.0.0/16'},
+                  {'destination_cidr_block': '10.1.0.0/16'}]
+
+        # the first route is throttled once, the duplicate is not sent
+        with mock.patch('boto.vpc.VPCConnection.create_vpn_connection_route',
+                        side_effect=[self.get_throttling_error(),
+                                     True, True]) as create_route:
+            gateway.create_vpn_connection(routes=routes, ctx=ctx)
+        self.assertEquals(3, create_route.call_count)
+        self.assertEquals(
+            routes[:2], ctx.source.instance.runtime_properties['routes'])
+
+        # only the route still in the connection is deleted
+        current_ctx.set(ctx=ctx)
+        with mock.patch('vpc.gateway.VpnConnection.get_live_routes',
+                        return_value=set(['10.1.0.0/16'])), \
+                mock.patch(
+                    'boto.vpc.VPCConnection.delete_vpn_connection_route',
+                    return_value=True) as delete_route:
+            gateway.delete_vpn_connection(ctx=ctx)
+        delete_route.assert_called_once_with(
+            destination_cidr_block='10.1.0.0/16',
+            vpn_connection_id=mock.ANY)
+        self.assertEquals([], ctx.source.instance.runtime_properties['routes'])
+
+    @mock_ec2
+    @mock.patch('ec2.constants.MAX_CONCURRENT_REQUESTS', 1)
+    def test_create_vpn_connection_retry(self, *_):
+        client = self.create_client()
+        ctx = self.get_mock_vpn_connection_relationship_context(
+            'test_create_vpn_connection_retry',
+            self.create_customer_gateway(client),
+            self.create_vpn_gateway(client))
+        routes = [{'destination_cidr_block': '10.1.0.0/16'},
+                  {'destination_cidr_block': '10.2.0.0/16'}]
+        route_error = exception.EC2ResponseError(
+            400, 'Bad Request',
+            '<Response><Errors><Error><Code>InvalidParameterValue</Code>'
+            '<Message>Invalid route</Message></Error></Errors></Response>')
+
+        # the second route fails, so the operation is retried
+        with mock.patch('boto.vpc.VPCConnection.create_vpn_connection_route',
+                        side_effect=[True, route_error]):
+            self.assertRaises(
+                RecoverableError, gateway.create_vpn_connection,
+                routes=routes, ctx=ctx)
+        vpn_connection_id = \
+            ctx.source.instance.runtime_properties['vpn_connection']
+        self.assertEquals(
+            routes[:1], ctx.source.instance.runtime_properties['routes'])
+
+        # the retry reuses the connection, and only sends the failed route
+        current_ctx.set(ctx=ctx)
+        with mock.patch('vpc.gateway.VpnConnection.get_live_routes',
+                        return_value=set(['10.1.0.0/16'])) \
+                as get_live_routes, \
+                mock.patch(
+                    'boto.vpc.VPCConnection.create_vpn_connection_route',
+                    return_value=True) as create_route, \
+                mock.patch('boto.vpc.VPCConnection.create_vpn_connection') \
+                as create_vpn_connection:
+            gateway.create_vpn_connection(routes=routes, ctx=ctx)
+        self.assertFalse(create_vpn_connection.called)
+        get_live_routes.assert_called_once_with(vpn_connection_id)
+        create_route.assert_called_once_with(
+            destination_cidr_block='10.2.0.0/16',
+            vpn_connection_id=vpn_connection_id)
+        self.assertEquals(
+            routes, ctx.source.instance.runtime_properties['routes'])
+        self.assertEquals(1, len(client.get_all_vpn_connections()))
+
 
 class TestDhcpModule(VpcTestCase):
 
@@ -284,3 +734,287 @@ class TestDhcpModule(VpcTestCase):
         error = self.assertRaises(
             NonRecoverableError, dhcp.delete_dhcp_options, ctx=ctx)
         self.assertIn('returned False', error.message)
+
+
+class TestTopology(VpcTestCase):
+
+    def get_resource(self, resource_id, resource_type, properties,
+                     vpc=None, dependencies=None):
+        node_properties = self.get_mock_node_properties(properties)
+        node_properties['resource_id'] = ''
+        return dict(id=resource_id, resource_type=resource_type,
+                    properties=node_properties, vpc=vpc,
+                    dependencies=dependencies or [])
+
+    def test_plan_levels(self):
+
+        resources = [
+            dict(id='subnet', dependencies=['vpc']),
+            dict(id='route_table', dependencies=['vpc', 'gateway']),
+            dict(id='gateway', dependencies=['vpc', 'elsewhere']),
+            dict(id='vpc', dependencies=[])
+        ]
+        levels = topology.plan_levels(resources)
+        self.assertEquals(
+            [['vpc'], ['gateway', 'subnet'], ['route_table']],
+            [[resource['id'] for resource in level] for level in levels])
+
+        resources[3]['dependencies'] = ['route_table']
+        error = self.assertRaises(
+            NonRecoverableError, topology.plan_levels, resources)
+        self.assertIn('form a cycle', error.message)
+
+    @mock_ec2
+    def test_build_topology(self):
+
+        vpc_client = self.create_client()
+        resources = [
+            self.get_resource(
+                'subnet', 'subnet', {'cidr_block': TEST_SUBNET_CIDR},
+                vpc='vpc', dependencies=['vpc']),
+            self.get_resource(
+                'route_table', 'route_table', {}, vpc='vpc',
+                dependencies=['vpc', 'gateway']),
+            self.get_resource('gateway', 'internet_gateway', {}),
+            self.get_resource(
+                'vpc', 'vpc',
+                self.vpc_node_template_properties(
+                    {'cidr_block': TEST_VPC_CIDR}))
+        ]
+        builder = topology.TopologyBuilder('d1', max_workers=1)
+
+        with mock.patch('boto.vpc.VPCConnection.get_all_vpcs') \
+                as get_all_vpcs:
+            runtime_properties = builder.build(resources)
+
+        self.assertFalse(get_all_vpcs.called)
+        self.assertEquals([], builder.errors)
+        vpc_id = runtime_properties['vpc']['aws_resource_id']
+        self.assertEquals(vpc_id, runtime_properties['route_table']['vpc_id'])
+        subnet_object = vpc_client.get_all_subnets(
+            runtime_properties['subnet']['aws_resource_id'])[0]
+        self.assertEquals(vpc_id, subnet_object.vpc_id)
+        self.assertEquals('subnet', subnet_object.tags.get('resource_id'))
+        self.assertEquals('d1', subnet_object.tags.get('deployment_id'))
+        for properties in runtime_properties.values():
+            self.assertTrue(properties[constants.TOPOLOGY_BUILT])
+
+    @mock_ec2
+    def test_build_topology_again(self):
+
+        vpc_client = self.create_client()
+        vpc_object = self.create_vpc(vpc_client)
+        existing_subnet = self.create_subnet(vpc_client, vpc_object)
+        vpc_resource = self.get_resource(
+            'vpc', 'vpc',
+            self.vpc_node_template_properties(
+                {'cidr_block': vpc_object.cidr_block}))
+        vpc_resource['aws_resource_id'] = vpc_object.id
+        existing_subnet_resource = self.get_resource(
+            'subnet_0', 'subnet', {'cidr_block': existing_subnet.cidr_block},
+            vpc='vpc', dependencies=['vpc'])
+        existing_subnet_resource['aws_resource_id'] = existing_subnet.id
+        resources = [
+            vpc_resource, existing_subnet_resource,
+            self.get_resource(
+                'subnet_1', 'subnet', {'cidr_block': '/25'},
+                vpc='vpc', dependencies=['vpc'])
+        ]
+        builder = topology.TopologyBuilder('d1', max_workers=1)
+        vpc_count = len(vpc_client.get_all_vpcs())
+
+        runtime_properties = builder.build(resources)
+
+        self.assertEquals([], builder.errors)
+        self.assertEquals(['subnet_1'], runtime_properties.keys())
+        self.assertEquals(vpc_count, len(vpc_client.get_all_vpcs()))
+        subnet_object = vpc_client.get_all_subnets(
+            runtime_properties['subnet_1']['aws_resource_id'])[0]
+        self.assertEquals(vpc_object.id, subnet_object.vpc_id)
+        self.assertNotEquals(existing_subnet.cidr_block,
+                             subnet_object.cidr_block)
+
+    @mock_ec2
+    def test_plan_subnets(self):
+
+        resources = [
+            self.get_resource(
+                'vpc', 'vpc',
+                self.vpc_node_template_properties(
+                    {'cidr_block': '10.0.0.0/16'})),
+            self.get_resource(
+                'subnet_0', 'subnet', {'cidr_block': '10.0.0.0/24'},
+                vpc='vpc', dependencies=['vpc'])
+        ] + [
+            self.get_resource(
+                'subnet_{0}'.format(index), 'subnet', {'cidr_block': '/24'},
+                vpc='vpc', dependencies=['vpc'])
+            for index in range(1, 4)
+        ]
+        builder = topology.TopologyBuilder('d1', max_workers=1)
+
+        subnets = [resource['properties']
+                   for resource in builder.plan_subnets(resources)
+                   if resource['id'].startswith('subnet')]
+
+        self.assertEquals(
+            ['10.0.0.0/24', '10.0.1.0/24', '10.0.2.0/24', '10.0.3.0/24'],
+            [properties['cidr_block'] for properties in subnets])
+        zones = [properties[constants.AVAILABILITY_ZONE]
+                 for properties in subnets[1:]]
+        self.assertEquals(len(zones), len(set(zones)))
+
+
+class TestTeardown(VpcTestCase):
+
+    def get_resource(self, resource_id, resource_type, vpc_ids=None,
+                     subnet_id=None, group_ids=None, dhcp_options_id=None):
+        return dict(id=resource_id, resource_type=resource_type,
+                    node_instance_id=None, vpc_ids=vpc_ids or [],
+                    subnet_id=subnet_id, group_ids=group_ids or [],
+                    dhcp_options_id=dhcp_options_id, association_ids=[])
+
+    def test_plan(self):
+
+        resources = [
+            self.get_resource('dhcp', 'dhcp_options'),
+            self.get_resource('vpc', 'vpc', dhcp_options_id='dhcp'),
+            self.get_resource('acl', 'network_acl', vpc_ids=['vpc']),
+            self.get_resource('rtb', 'route_table', vpc_ids=['vpc']),
+            self.get_resource('igw', 'internet_gateway', vpc_ids=['vpc']),
+            self.get_resource('subnet', 'subnet', vpc_ids=['vpc']),
+            self.get_resource('sg', 'security_group', vpc_ids=['vpc']),
+            self.get_resource('instance', 'instance', vpc_ids=['vpc'],
+                              subnet_id='subnet', group_ids=['sg'])
+        ]
+        planner = cleanup.TeardownPlanner('d1', max_workers=1)
+
+        levels = topology.plan_levels(planner.plan(resources))
+
+        self.assertEquals(
+            [['instance'], ['igw', 'sg', 'subnet'], ['acl', 'rtb'],
+             ['vpc'], ['dhcp']],
+            [[resource['id'] for resource in level] for level in levels])
+
+    @mock_ec2
+    def test_teardown(self):
+
+        vpc_client = self.create_client()
+        vpc_object = self.create_vpc(vpc_client)
+        subnet_object = self.create_subnet(vpc_client, vpc_object)
+        route_table = vpc_client.create_route_table(vpc_object.id)
+        gateway = vpc_client.create_internet_gateway()
+        vpc_client.attach_internet_gateway(gateway.id, vpc_object.id)
+        group = vpc_client.create_security_group(
+            'group', 'group', vpc_id=vpc_object.id)
+        reservation = vpc_client.run_instances(
+            TEST_AMI_IMAGE_ID, subnet_id=subnet_object.id,
+            security_group_ids=[group.id])
+        instance_id = reservation.instances[0].id
+        kept = vpc_client.create_vpc('12.0.0.0/16')
+        resource_ids = [vpc_object.id, subnet_object.id, route_table.id,
+                        gateway.id, group.id, instance_id]
+        vpc_client.create_tags(resource_ids, {'deployment_id': 'd1'})
+        vpc_client.create_tags([kept.id], {'deployment_id': 'd2'})
+        planner = cleanup.TeardownPlanner('d1', max_workers=1)
+
+        resources = planner.snapshot()
+        self.assertEquals(sorted(resource_ids),
+                          sorted(resource['id'] for resource in resources))
+
+        deleted = planner.teardown(resources)
+
+        self.assertEquals([], planner.errors)
+        self.assertEquals(len(resource_ids), len(deleted))
+        self.assertEquals(
+            'terminated',
+            vpc_client.get_only_instances([instance_id])[0].state)
+        self.assertEquals(
+            [kept.id],
+            [vpc.id for vpc in vpc_client.get_all_vpcs()
+             if vpc.id in [vpc_object.id, kept.id]])
+
+    def test_teardown_node_instances(self):
+
+        def get_node(node_id, external, *node_instance_ids):
+            node = mock.Mock(
+                type_hierarchy=['cloudify.nodes.Root', SECURITY_GROUP_TYPE],
+                properties={'use_external_resource': external,
+                            'resource_id': 'external' if external else ''})
+            node.instances = [mock.Mock(id=node_instance_id, relationships=[])
+                              for node_instance_id in node_instance_ids]
+            return node
+
+        # the app uses sg_4, which is connected to sg_5
+        nodes = [get_node('created', False, 'sg_1', 'sg_2', 'sg_4', 'sg_5'),
+                 get_node('external', True, 'sg_3')]
+        nodes[0].instances[2].relationships = [mock.Mock(target_id='sg_5')]
+        app = mock.Mock(id='app', relationships=[mock.Mock(target_id='sg_4')])
+        ctx = mock.Mock(
+            nodes=nodes,
+            node_instances=[app] + [node_instance for node in nodes
+                                    for node_instance in node.instances])
+        runtime_properties = {
+            'sg_1': {'aws_resource_id': 'sg-11111111'},
+            'sg_2': {},
+            'sg_3': {'aws_resource_id': 'sg-33333333'},
+            'sg_4': {'aws_resource_id': 'sg-44444444'},
+            'sg_5': {'aws_resource_id': 'sg-55555555'}
+        }
+
+        node_instances, owned_resource_ids, _ = \
+            workflows._get_teardown_node_instances(ctx, runtime_properties)
+
+        self.assertEquals(['sg_1'], node_instances.keys())
+        self.assertEquals({'sg-11111111': 'sg_1'}, owned_resource_ids)
+
+    @mock_ec2
+    def test_sweep_orphans(self):
+
+        vpc_client = self.create_client()
+        vpc_object = self.create_vpc(vpc_client)
+        subnet_object = self.create_subnet(vpc_client, vpc_object)
+        reservation = vpc_client.run_instances(
+            TEST_AMI_IMAGE_ID, subnet_id=subnet_object.id)
+        instance_id = reservation.instances[0].id
+        volume = vpc_client.create_volume(1, 'us-east-1a')
+        vpc_client.attach_volume(volume.id, instance_id, '/dev/sdf')
+        live_vpc = vpc_client.create_vpc('12.0.0.0/16')
+        external_vpc = vpc_client.create_vpc('13.0.0.0/16')
+        other_manager_vpc = vpc_client.create_vpc('14.0.0.0/16')
+        vpc_client.create_tags(
+            [vpc_object.id, subnet_object.id, instance_id, volume.id],
+            {'deployment_id': 'deleted', 'cloudify_manager': '10.0.0.1'})
+        vpc_client.create_tags(
+            [live_vpc.id],
+            {'deployment_id': 'live', 'cloudify_manager': '10.0.0.1'})
+        vpc_client.create_tags([external_vpc.id], {'deployment_id': 'deleted'})
+        vpc_client.create_tags(
+            [other_manager_vpc.id],
+            {'deployment_id': 'other', 'cloudify_manager': '10.0.0.2'})
+        sweeper = cleanup.OrphanSweeper(['live'], max_workers=1,
+                                        owner='10.0.0.1')
+
+        resources = sweeper.snapshot()
+        self.assertEquals(
+            [
+                'Level 1: instance of deployment deleted: {0}'
+                .format(instance_id),
+                'Level 2: subnet of deployment deleted: {0}; '
+                'volume of deployment deleted: {1}'
+                .format(subnet_object.id, volume.id),
+                'Level 3: vpc of deployment deleted: {0}'
+                .format(vpc_object.id)
+            ],
+            sweeper.report(resources))
+
+        sweeper.teardown(resources)
+
+        self.assertEquals([], sweeper.errors)
+        self.assertEquals([], vpc_client.get_all_volumes(
+            filters={'tag:deployment_id': 'deleted'}))
+        self.assertEquals(
+            sorted([live_vpc.id, external_vpc.id, other_manager_vpc.id]),
+            sorted(vpc.id for vpc in vpc_client.get_all_vpcs()
+                   if vpc.id in [vpc_object.id, live_vpc.id,
+                                 external_vpc.id, other_manager_vpc.id]))
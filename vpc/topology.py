@@ -0,0 +1,340 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import json
+import uuid
+import threading
+
+# Third-party Imports
+from boto import exception
+
+# Cloudify imports
+from . import constants
+from . import connection
+from .subnet import CidrAllocator, is_prefix_length
+from ec2 import utils as ec2_utils
+from cloudify import ctx
+from cloudify.decorators import operation
+from cloudify.exceptions import NonRecoverableError
+
+
+@operation
+def assign_runtime_properties(runtime_properties, **_):
+    """Stores the runtime properties of a resource created by the
+    build_topology workflow, so that its lifecycle operations adopt it.
+    """
+
+    for key, value in runtime_properties.items():
+        ctx.instance.runtime_properties[key] = value
+
+
+def plan_levels(resources):
+    """Orders the resources of a topology in levels. The resources of a
+    level only depend on resources of earlier levels, so they can be
+    created concurrently.
+
+    :param resources: A list of resource dicts, each with an id and
+        the ids of the resources it depends on, in dependencies.
+    :returns a list of lists of resource dicts.
+    :raises NonRecoverableError: If the dependencies form a cycle.
+    """
+
+    resources_by_id = dict((resource['id'], resource)
+                           for resource in resources)
+    pending = dict(
+        (resource['id'],
+         set(resource['dependencies']) & set(resources_by_id))
+        for resource in resources)
+    planned = set()
+    levels = []
+
+    while pending:
+        level = sorted(resource_id
+                       for resource_id, dependencies in pending.items()
+                       if dependencies <= planned)
+
+        if not level:
+            raise NonRecoverableError(
+                'The dependencies of {0} form a cycle.'
+                .format(', '.join(sorted(pending))))
+
+        levels.append([resources_by_id[resource_id]
+                       for resource_id in level])
+        planned.update(level)
+        for resource_id in level:
+            del pending[resource_id]
+
+    return levels
+
+
+class ThreadLocalClients(object):
+    """Keeps one VPC client per AWS config in every thread, for the
+    helpers that call AWS from several threads at once.
+    """
+
+    def __init__(self):
+        self._clients = threading.local()
+
+    def client(self, aws_config):
+
+        clients = getattr(self._clients, 'by_config', None)
+        if clients is None:
+            clients = self._clients.by_config = dict()
+
+        key = json.dumps(aws_config or {}, sort_keys=True)
+
+        if key not in clients:
+            clients[key] = \
+                connection.VPCConnectionClient().config_client(aws_config)
+
+        return clients[key]
+
+
+class TopologyBuilder(ThreadLocalClients):
+    """Creates the resources of a VPC topology level by level, with the
+    resources of each level created concurrently. Every worker thread
+    keeps one client per AWS config, and the IDs of created resources
+    are kept, so parent VPCs are never described.
+    """
+
+    def __init__(self, deployment_id, max_workers=None):
+        super(TopologyBuilder, self).__init__()
+        self.deployment_id = deployment_id
+        self.max_workers = max_workers
+        self.resource_ids = dict()
+        self.errors = []
+
+    def build(self, resources):
+        """Creates the resources that are not external and do not exist
+        yet. Building stops after the first level where a resource
+        fails, and the errors are left in errors.
+
+        :param resources: A list of resource dicts with an id, a
+            resource_type, the node properties, the id of the vpc
+            resource that contains it, if any, and its dependencies.
+            The aws_resource_id of a resource that already exists, such
+            as after install or an earlier build, keeps it from being
+            created again.
+        :returns a dict of resource id to the runtime properties
+            of every created resource.
+        """
+
+        runtime_properties = dict()
+        existing_resource_ids = dict(
+            (resource['id'], resource[constants.EXTERNAL_RESOURCE_ID])
+            for resource in resources
+            if resource.get(constants.EXTERNAL_RESOURCE_ID))
+        self.resource_ids.update(existing_resource_ids)
+
+        for level in plan_levels(self.plan_subnets(resources)):
+            level = [resource for resource in level
+                     if resource['id'] not in existing_resource_ids]
+            built = ec2_utils.run_concurrently(
+                self._build_resource, level, self.max_workers)
+
+            for resource, (properties, error) in zip(level, built):
+                if error:
+                    self.errors.append(error)
+                if not properties:
+                    continue
+                self.resource_ids[resource['id']] = \
+                    properties[constants.EXTERNAL_RESOURCE_ID]
+                if not resource['properties']['use_external_resource']:
+                    runtime_properties[resource['id']] = properties
+
+            if self.errors:
+                break
+
+        return runtime_properties
+
+    def plan_subnets(self, resources):
+        """Carves the CIDR block of every subnet whose cidr_block is a
+        prefix length, such as /24, out of its VPC. Such subnets without
+        an availability zone are spread over the zones of the region.
+        Every VPC and the zones are described at most once.
+
+        :param resources: A list of resource dicts, as for build.
+        :returns the list with the planned subnets replaced.
+        """
+
+        resources_by_id = dict((resource['id'], resource)
+                               for resource in resources)
+        planned = sorted(
+            (resource for resource in resources
+             if resource['resource_type'] ==
+             constants.SUBNET['AWS_RESOURCE_TYPE'] and
+             not resource['properties']['use_external_resource'] and
+             is_prefix_length(resource['properties']['cidr_block'])),
+            key=lambda resource: resource['id'])
+
+        if not planned:
+            return resources
+
+        client = self.client(
+            planned[0]['properties'].get(constants.AWS_CONFIG_PROPERTY))
+        zones = sorted(zone.name for zone in client.get_all_zones()
+                       if zone.state == 'available')
+        allocators = dict()
+        subnets_per_vpc = dict()
+
+        for resource in planned:
+            if resource['vpc'] not in resources_by_id:
+                continue
+
+            if resource['vpc'] not in allocators:
+                allocators[resource['vpc']] = self._get_cidr_allocator(
+                    resources_by_id[resource['vpc']], resources)
+
+            properties = dict(resource['properties'])
+            properties['cidr_block'] = allocators[resource['vpc']].allocate(
+                properties['cidr_block'])
+
+            index = subnets_per_vpc.get(resource['vpc'], 0)
+            subnets_per_vpc[resource['vpc']] = index + 1
+            if not properties.get(constants.AVAILABILITY_ZONE) and zones:
+                properties[constants.AVAILABILITY_ZONE] = \
+                    zones[index % len(zones)]
+
+            resources_by_id[resource['id']] = \
+                dict(resource, properties=properties, planned=True)
+
+        return [resources_by_id[resource['id']] for resource in resources]
+
+    def _get_cidr_allocator(self, vpc, resources):
+        """Returns an allocator of the CIDR block of a VPC resource, with
+        the blocks of its other subnets reserved. Only an external VPC
+        and its subnets are described.
+        """
+
+        reserved_cidr_blocks = [
+            resource['properties']['cidr_block'] for resource in resources
+            if resource['vpc'] == vpc['id'] and
+            resource['resource_type'] ==
+            constants.SUBNET['AWS_RESOURCE_TYPE'] and
+            not resource['properties']['use_external_resource'] and
+            not is_prefix_length(resource['properties']['cidr_block'])]
+
+        if not vpc['properties']['use_external_resource']:
+            return CidrAllocator(vpc['properties']['cidr_block'],
+                                 reserved_cidr_blocks)
+
+        client = self.client(
+            vpc['properties'].get(constants.AWS_CONFIG_PROPERTY))
+        vpc_id = vpc['properties']['resource_id']
+
+        try:
+            vpc_object = client.get_all_vpcs(vpc_ids=[vpc_id])[0]
+            subnets = client.get_all_subnets(filters={'vpc-id': vpc_id})
+        except (exception.EC2ResponseError,
+                exception.BotoServerError) as e:
+            raise NonRecoverableError('{0}'.format(str(e)))
+
+        return CidrAllocator(
+            vpc_object.cidr_block,
+            reserved_cidr_blocks +
+            [subnet.cidr_block for subnet in subnets])
+
+    def _build_resource(self, resource):
+        """Creates and tags one resource.
+
+        :returns a tuple of its runtime properties, or None,
+            and the NonRecoverableError that occurred, or None.
+        """
+
+        properties = resource['properties']
+
+        if properties['use_external_resource']:
+            return {constants.EXTERNAL_RESOURCE_ID:
+                    properties['resource_id']}, None
+
+        client = self.client(properties.get(constants.AWS_CONFIG_PROPERTY))
+        create = getattr(self, '_create_{0}'.format(resource['resource_type']))
+
+        try:
+            aws_resource, runtime_properties = create(client, resource)
+        except (exception.EC2ResponseError,
+                exception.BotoServerError) as e:
+            return None, NonRecoverableError(
+                'Unable to create {0} {1}: {2}'
+                .format(resource['resource_type'], resource['id'], str(e)))
+
+        runtime_properties.update({
+            constants.EXTERNAL_RESOURCE_ID: aws_resource.id,
+            constants.TOPOLOGY_BUILT: True
+        })
+
+        tags = {
+            'Name': properties.get('name') or str(uuid.uuid4()),
+            'resource_id': resource['id'],
+            'deployment_id': self.deployment_id
+        }
+        tags.update(ec2_utils.get_owner_tags())
+
+        try:
+            client.create_tags([aws_resource.id], tags)
+        except (exception.EC2ResponseError,
+                exception.BotoServerError) as e:
+            return runtime_properties, NonRecoverableError(
+                'unable to tag resource name: {0}'.format(str(e)))
+
+        return runtime_properties, None
+
+    def _get_vpc_id(self, resource):
+
+        if resource['vpc'] not in self.resource_ids:
+            raise NonRecoverableError(
+                '{0} {1} is not contained in a vpc of the topology.'
+                .format(resource['resource_type'], resource['id']))
+
+        return self.resource_ids[resource['vpc']]
+
+    def _create_vpc(self, client, resource):
+        vpc = client.create_vpc(
+            cidr_block=resource['properties']['cidr_block'],
+            instance_tenancy=resource['properties']['instance_tenancy'])
+        return vpc, {'default_dhcp_options_id': vpc.dhcp_options_id}
+
+    def _create_subnet(self, client, resource):
+        create_args = dict(
+            vpc_id=self._get_vpc_id(resource),
+            cidr_block=resource['properties']['cidr_block'])
+        if resource['properties'].get(constants.AVAILABILITY_ZONE):
+            create_args[constants.AVAILABILITY_ZONE] = \
+                resource['properties'][constants.AVAILABILITY_ZONE]
+        subnet = client.create_subnet(**create_args)
+        if resource.get('planned'):
+            return subnet, {'cidr_block': subnet.cidr_block}
+        return subnet, {}
+
+    def _create_route_table(self, client, resource):
+        vpc_id = self._get_vpc_id(resource)
+        return client.create_route_table(vpc_id), {'vpc_id': vpc_id}
+
+    def _create_network_acl(self, client, resource):
+        vpc_id = self._get_vpc_id(resource)
+        return client.create_network_acl(vpc_id), {'vpc_id': vpc_id}
+
+    def _create_internet_gateway(self, client, resource):
+        return client.create_internet_gateway(), {}
+
+    def _create_dhcp_options(self, client, resource):
+        properties = resource['properties']
+        return client.create_dhcp_options(
+            domain_name=properties.get('domain_name'),
+            domain_name_servers=properties.get('domain_name_servers'),
+            ntp_servers=properties.get('ntp_servers'),
+            netbios_name_servers=properties.get('netbios_name_servers'),
+            netbios_node_type=properties.get('netbios_node_type')), {}
@@ -120,13 +120,15 @@ class VpcPeeringConnection(AwsBaseRelationship, RouteMixin):
                          associate_args, raise_on_falsy=True)
         self.resource_id = vpc_peering_connection.id
 
-        for route in self.routes:
-            route.update(
-                route_table_id=self.source_route_table_id,
-                vpc_peering_connection_id=self.resource_id
-            )
-            self.create_route(self.source_route_table_id, route,
-                              route_table_ctx_instance=ctx.source.instance)
+        with self.route_batch(ctx.source.instance):
+            for route in self.routes:
+                route.update(
+                    route_table_id=self.source_route_table_id,
+                    vpc_peering_connection_id=self.resource_id
+                )
+                self.create_route(
+                    self.source_route_table_id, route,
+                    route_table_ctx_instance=ctx.source.instance)
 
         return True
 
@@ -170,12 +172,13 @@ class VpcPeeringConnection(AwsBaseRelationship, RouteMixin):
         vpc_peering_connections = \
             ctx.source.instance.runtime_properties \
             .get('vpc_peering_connections')
-        for vpc_peering_connection in vpc_peering_connections:
-            ctx.logger.info('{0}'.format(vpc_peering_connection))
-            for route in vpc_peering_connection['routes']:
-                self.delete_route(
-                    self.source_route_table_id, route,
-                    route_table_ctx_instance=ctx.source.instance)
+        with self.route_batch(ctx.source.instance):
+            for vpc_peering_connection in vpc_peering_connections:
+                ctx.logger.info('{0}'.format(vpc_peering_connection))
+                for route in vpc_peering_connection['routes']:
+                    self.delete_route(
+                        self.source_route_table_id, route,
+                        route_table_ctx_instance=ctx.source.instance)
 
     def get_vpc_peering_connection_id(self, ctx_instance,
                                       vpc_id, property_name):
@@ -218,19 +221,19 @@ class VpcPeeringConnection(AwsBaseRelationship, RouteMixin):
         at least one failed.
         """
 
-        source_vpc_cidr_block = ''
-
-        vpcs = self.execute(self.client.get_all_vpcs)
-        for vpc in vpcs:
-            if vpc.id == self.source_vpc_id:
-                source_vpc_cidr_block = vpc.cidr_block
+        source_vpc = self.filter_for_single_resource(
+            self.client.get_all_vpcs,
+            {'vpc_ids': self.source_vpc_id})
+        source_vpc_cidr_block = source_vpc.cidr_block if source_vpc else ''
 
         new_route = dict(
             destination_cidr_block=source_vpc_cidr_block,
             vpc_peering_connection_id=self.source_vpc_peering_connection_id
         )
 
-        route_tables = self.execute(self.client.get_all_route_tables)
+        route_tables = self.iterate_resources_by_matcher(
+            self.client.get_all_route_tables,
+            {'filters': {'vpc-id': self.target_vpc_id}})
         for route_table in route_tables:
             if route_table.vpc_id == self.target_vpc_id:
                 route_created = self.create_route(
@@ -261,7 +264,7 @@ class Vpc(AwsBaseNode):
         if not self.is_external_resource:
             return False
 
-        resource = self.get_resource()
+        resource = self.get_external_resource()
 
         if not resource:
             self.raise_forbidden_external_resource(self.resource_id)
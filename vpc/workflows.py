@@ -0,0 +1,305 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import json
+
+# Cloudify imports
+from . import constants
+from . import topology
+from .cleanup import TeardownPlanner, OrphanSweeper
+from cloudify.decorators import workflow
+from cloudify.manager import get_rest_client
+from cloudify.plugins import lifecycle
+
+
+@workflow
+def build_topology(ctx, max_workers=None, **_):
+    """Creates the VPC resources of a deployment ahead of install.
+
+    The VPCs, subnets, route tables, network ACLs, internet gateways and
+    DHCP options are created level by level of their dependencies, each
+    level concurrently. Their runtime properties are then written in one
+    pass, and their create operations adopt them during install. The
+    node instances that already have a resource are left alone, so the
+    workflow may run again, or after install.
+
+    :param max_workers: The most resources created at the same time.
+    """
+
+    rest_client = get_rest_client()
+    runtime_properties = dict(
+        (node_instance.id, node_instance.runtime_properties or {})
+        for node_instance in rest_client.node_instances.list(
+            deployment_id=ctx.deployment.id,
+            _include=['id', 'runtime_properties']))
+
+    node_instances, resources = \
+        _get_topology_resources(ctx, runtime_properties)
+
+    builder = topology.TopologyBuilder(ctx.deployment.id, max_workers)
+    runtime_properties = builder.build(resources)
+
+    graph = ctx.graph_mode()
+
+    for node_instance_id, properties in runtime_properties.items():
+        graph.add_task(
+            node_instances[node_instance_id].execute_operation(
+                constants.TOPOLOGY_ASSIGN_OPERATION,
+                kwargs={'runtime_properties': properties}))
+
+    graph.execute()
+
+    if builder.errors:
+        raise builder.errors[0]
+
+
+@workflow
+def teardown_deployment(ctx, max_workers=None, **_):
+    """Uninstalls a deployment, deleting most of its resources in bulk.
+
+    The instances, security groups and VPC resources tagged with the
+    deployment ID are described with one call per resource type. Those
+    created by a node instance of the deployment, not used as external
+    resources, and not depended on by a node instance uninstalled as
+    usual, are deleted level by level of their dependencies, each level
+    concurrently. The other node instances, and those whose resources
+    were not deleted, are then uninstalled as usual. Last, the node
+    instances of the deleted resources are released.
+
+    :param max_workers: The most resources deleted at the same time.
+    """
+
+    rest_client = get_rest_client()
+    runtime_properties = dict(
+        (node_instance.id, node_instance.runtime_properties or {})
+        for node_instance in rest_client.node_instances.list(
+            deployment_id=ctx.deployment.id,
+            _include=['id', 'runtime_properties']))
+
+    node_instances, owned_resource_ids, aws_configs = \
+        _get_teardown_node_instances(ctx, runtime_properties)
+
+    deleted = []
+    errors = []
+
+    for aws_config in aws_configs:
+        planner = TeardownPlanner(ctx.deployment.id, aws_config, max_workers)
+        resources = [
+            resource for resource in planner.snapshot()
+            if resource['id'] in owned_resource_ids]
+        deleted.extend(planner.teardown(resources))
+        errors.extend(planner.errors)
+
+    for error in errors:
+        ctx.logger.warn('Teardown left a resource behind: {0}'.format(error))
+
+    released = set(
+        node_instances[owned_resource_ids[resource['id']]]
+        for resource in deleted)
+
+    graph = ctx.graph_mode()
+
+    lifecycle.uninstall_node_instances(
+        graph, set(ctx.node_instances) - released)
+
+    for node_instance in released:
+        sequence = graph.sequence()
+        sequence.add(
+            node_instance.execute_operation(
+                constants.TEARDOWN_RELEASE_OPERATION),
+            node_instance.set_state('deleted'))
+
+    graph.execute()
+
+
+@workflow
+def sweep_orphans(ctx, dry_run=True, max_workers=None, aws_config=None,
+                  **_):
+    """Deletes the resources left behind by deployments that no longer
+    exist on the manager, in the account and region of aws_config.
+
+    Only the resources that the plugin created for this manager, as
+    their owner tag says, are swept, so external resources and those of
+    other managers are left alone, as are resources still used by a
+    node instance of a live deployment. The resources are deleted
+    level by level of their dependencies, each level concurrently.
+
+    :param dry_run: Only report what would be deleted, in which order.
+    :param max_workers: The most resources deleted at the same time.
+    :param aws_config: The AWS config of the account to sweep.
+    """
+
+    rest_client = get_rest_client()
+    live_deployment_ids = [deployment.id for deployment
+                           in rest_client.deployments.list(_include=['id'])]
+    resource_ids_in_use = set(
+        node_instance.runtime_properties.get(
+            constants.EXTERNAL_RESOURCE_ID)
+        for node_instance in rest_client.node_instances.list(
+            _include=['runtime_properties']))
+
+    sweeper = OrphanSweeper(live_deployment_ids, aws_config, max_workers)
+    resources = [resource for resource in sweeper.snapshot()
+                 if resource['id'] not in resource_ids_in_use]
+
+    ctx.logger.info(
+        'Found {0} orphaned resources.'.format(len(resources)))
+    for line in sweeper.report(resources):
+        ctx.logger.info(line)
+
+    if dry_run or not resources:
+        return
+
+    deleted = sweeper.teardown(resources)
+
+    ctx.logger.info(
+        'Deleted {0} of {1} orphaned resources.'
+        .format(len(deleted), len(resources)))
+
+    if sweeper.errors:
+        raise sweeper.errors[0]
+
+
+def _get_teardown_node_instances(ctx, runtime_properties):
+    """Returns the node instances whose resources the TeardownPlanner may
+    delete by ID, the IDs of those resources, which are the only ones it
+    may delete, and the distinct AWS configs of the nodes.
+
+    A node instance that another node instance, uninstalled as usual,
+    depends on through a relationship is uninstalled as usual too, since
+    the operations of the other one may still use its resource.
+
+    :param runtime_properties: A dict of node instance ID to its runtime
+        properties.
+    :returns a dict of node instance ID to node instance, a dict of the
+        aws_resource_id of every such node instance that is not external
+        to its node instance ID, and a list of AWS configs.
+    """
+
+    node_instances = dict()
+    owned_resource_ids = dict()
+    aws_configs = dict()
+
+    for node in ctx.nodes:
+        if not any(resource['CLOUDIFY_NODE_TYPE'] in node.type_hierarchy
+                   for resource in constants.TEARDOWN_RESOURCES):
+            continue
+
+        aws_config = node.properties.get(constants.AWS_CONFIG_PROPERTY)
+        aws_configs[json.dumps(aws_config or {}, sort_keys=True)] = \
+            aws_config
+
+        if node.properties['use_external_resource']:
+            continue
+
+        for node_instance in node.instances:
+            resource_id = (runtime_properties.get(node_instance.id) or
+                           {}).get(constants.EXTERNAL_RESOURCE_ID)
+            if not resource_id:
+                continue
+            node_instances[node_instance.id] = node_instance
+            owned_resource_ids[resource_id] = node_instance.id
+
+    independent = _get_independent_node_instance_ids(ctx, node_instances)
+    node_instances = dict(
+        (node_instance_id, node_instance)
+        for node_instance_id, node_instance in node_instances.items()
+        if node_instance_id in independent)
+    owned_resource_ids = dict(
+        (resource_id, node_instance_id)
+        for resource_id, node_instance_id in owned_resource_ids.items()
+        if node_instance_id in independent)
+
+    return node_instances, owned_resource_ids, aws_configs.values()
+
+
+def _get_independent_node_instance_ids(ctx, node_instance_ids):
+    """Returns the node instances that no other node instance depends on,
+    directly or through others, by a relationship.
+
+    :param node_instance_ids: The IDs of the node instances to check.
+    :returns a set of node instance IDs.
+    """
+
+    independent = set(node_instance_ids)
+    changed = True
+
+    while changed:
+        changed = False
+        for node_instance in ctx.node_instances:
+            if node_instance.id in independent:
+                continue
+            for relationship in node_instance.relationships:
+                if relationship.target_id in independent:
+                    independent.discard(relationship.target_id)
+                    changed = True
+
+    return independent
+
+
+def _get_topology_resources(ctx, runtime_properties):
+    """Returns the node instances of the topology by ID, and the resource
+    dicts describing them for the TopologyBuilder.
+
+    :param runtime_properties: A dict of node instance ID to its runtime
+        properties. The resource of a node instance with an
+        aws_resource_id already exists, and a subnet keeps the CIDR
+        block it was given.
+    """
+
+    resource_types = dict()
+
+    for node in ctx.nodes:
+        for resource in constants.TOPOLOGY_RESOURCES:
+            if resource['CLOUDIFY_NODE_TYPE'] in node.type_hierarchy:
+                for node_instance in node.instances:
+                    resource_types[node_instance] = \
+                        resource['AWS_RESOURCE_TYPE']
+                break
+
+    node_instances = dict((node_instance.id, node_instance)
+                          for node_instance in resource_types)
+    resources = []
+
+    for node_instance, resource_type in resource_types.items():
+        relationships = [relationship
+                         for relationship in node_instance.relationships
+                         if relationship.target_id in node_instances]
+        vpc = next(
+            (relationship.target_id for relationship in relationships
+             if any(relationship.relationship.is_derived_from(vpc_type)
+                    for vpc_type in constants.TOPOLOGY_VPC_RELATIONSHIPS)),
+            None)
+        resource = dict(
+            id=node_instance.id,
+            resource_type=resource_type,
+            properties=node_instance.node.properties,
+            vpc=vpc,
+            dependencies=[relationship.target_id
+                          for relationship in relationships])
+
+        existing = runtime_properties.get(node_instance.id) or {}
+        if existing.get(constants.EXTERNAL_RESOURCE_ID):
+            resource[constants.EXTERNAL_RESOURCE_ID] = \
+                existing[constants.EXTERNAL_RESOURCE_ID]
+            if existing.get('cidr_block'):
+                resource['properties'] = dict(
+                    resource['properties'],
+                    cidr_block=existing['cidr_block'])
+
+        resources.append(resource)
+
+    return node_instances, resources